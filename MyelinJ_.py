@@ -28,38 +28,21 @@ This scipt contains the folowing Dialog boxes:
     * Dialog6 - alternative settings for the analysis of neurite micrographs
 """
 from __future__ import with_statement, division
-from ij import IJ, ImagePlus, WindowManager, Prefs
-from ij.plugin import ImageCalculator, ChannelSplitter, Duplicator
-from ij.process import ImageConverter, ImageProcessor
-import os
-import csv
-from ij import IJ, ImagePlus
-from ij.gui import DialogListener, GenericDialog, ImageWindow, \
-                   MessageDialog, YesNoCancelDialog
-from java.awt.event import ActionListener, ActionEvent, \
-     ItemListener, ItemEvent, WindowAdapter
-from ij.plugin.frame.Editor import actionPerformed
-from java.awt import Button, Checkbox, TextField, \
-                     BorderLayout, Font, Color, \
-                     Dimension, Cursor
-from java.util import Random, Vector
-from java.lang import String
-from javax.swing import JFrame, JButton, JOptionPane, \
-                        BorderFactory, JFrame, JLabel, JPanel, \
-                        JTextArea, JSlider, JCheckBox, JComboBox, \
-                        JTextField, JScrollBar
-from loci.common.DebugTools import enableIJLogging
-from ij.plugin.filter import RankFilters
-from javax.swing.AbstractButton import setBorderPainted
-from ij.io import FileSaver
 import time
-from javax.swing import ImageIcon
+# time at which each step of starting MyelinJ finished
+startup = [("start", time.time())]
+import os
 import sys
-from ij.macro import Interpreter as IJ1
-import mpicbg.ij.clahe.Flat
-from java.lang import Runtime, System
-from inra.ijpb.morphology.attrfilt import BoxDiagonalOpeningQueue
-from inra.ijpb.morphology import Morphology
+import threading
+from ij import IJ, WindowManager, Prefs
+from ij.gui import ImageWindow, YesNoCancelDialog
+from ij.measure import ResultsTable
+from ij.plugin import ImageCalculator, ChannelSplitter
+from ij.process import ImageConverter
+from java.awt import TextField, Color, Cursor
+from java.lang import System, Throwable
+from javax.swing import JFrame, JButton, BorderFactory, JLabel, JPanel, \
+                        JTextArea, JCheckBox, JComboBox, JTextField
 SN = False
 w = WindowManager
 OS = System.getProperty("os.name")
@@ -78,16 +61,25 @@ elif "Mac" in OS:
 sys.path.append(cwd)
 
 import MyelinJanalysis
+startup.append(("import MyelinJanalysis", time.time()))
 import basicfunctions
 import config
+import stages
+import progress
+import preview
+import dialogexecutor
+import profiles
+startup.append(("other imports", time.time()))
 
 # select file containing images for analysis
 imagefolder = IJ.getDirectory("Choose a Directory")
+startup.append(("choose folder", time.time()))
 basicfunctions.closeallimages()  # close any images already open
-username = []
-usernamepath = []
 g = 0
 r = 0
+dialogs = dialogexecutor.DialogExecutor(config.debounce)
+myelinpreview = preview.LivePreview("myelin", config.previewwidth, dialogs)
+neuritepreview = preview.LivePreview("neurites", config.previewwidth, dialogs)
 
 def neuritesubtract():
         """ Subtract neurites from myelin channel
@@ -109,7 +101,8 @@ def analysed():
         user name has been created a .csv file will first be created.
         Analyse will then read settings from the user name .csv file and
         perform the analysis. The imported module MyelinJ analysis is used
-        for this function.
+        for this function. The analysis is run in a separate thread so
+        the progress window can be updated and cancelled.
         """
         if config.newusercb is True:
             MyelinJanalysis.newUser(cwd, config.greyscaleMinVal, g, r, config.backgroundsubRolling,
@@ -120,10 +113,36 @@ def analysed():
                                      config.Max2, config.threshChoice2, config.mCLAHE2,
                                      config.Sbgcbstate)
                                      
-        MyelinJanalysis.analyse(cwd, config.user, imagefolder, config.stats,
-                                 config.experiments, config.multi, config.RscriptPath,
-                                 config.subfoldernames, config.names, config.statsfolderPath,
-                                 cwdR)
+        status = progress.Progress()
+        window = progress.ProgressWindow(status)
+
+        def run():
+            try:
+                MyelinJanalysis.analyse(cwd, config.user, imagefolder, config.stats,
+                                        config.experiments, config.multi, config.RscriptPath,
+                                        config.subfoldernames, config.names, config.statsfolderPath,
+                                        cwdR, progress=status)
+            finally:
+                window.close()
+
+        threading.Thread(target=run, name="MyelinJ analysis").start()
+
+
+
+def dryrun():
+        """
+        Reads the headers of all images in the selected folder without
+        analysing them. Problems (missing channels, truncated or 16bit
+        files) and the predicted run time are written to the log
+        and each image is listed in Preflight.csv in the selected folder.
+        """
+        readsettings = MyelinJanalysis.getsettings(cwd, config.user)
+        import preflight
+        plan = preflight.plan(config.listAllImages, int(readsettings[4]),
+                              int(readsettings[5]), preflight.readcosts(cwd),
+                              config.threads, config.projection)
+        preflight.writeplan(os.path.join(imagefolder, "Preflight.csv"), plan)
+        IJ.log(preflight.report(plan))
 
       
 def getNext():
@@ -255,9 +274,11 @@ def frangifilter(self):
                                             int(IJ.getScreenSize().height * 1/14))
             self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
             pixelwidth = str(green.getCalibration().pixelWidth)
-            IJ.run(green,"Frangi Vesselness (imglib, experimental)",
-                    "number=1 minimum="+pixelwidth+" maximum="+pixelwidth)
-            g = IJ.getImage()
+            # previews may run frangi at the same time (see stages.frangi)
+            with stages.windowlock:
+                IJ.run(green,"Frangi Vesselness (imglib, experimental)",
+                        "number=1 minimum="+pixelwidth+" maximum="+pixelwidth)
+                g = IJ.getImage()
             g.setTitle("original + background subtraction + vesselness")
             g = g.duplicate()
             conv = ImageConverter(g)
@@ -277,19 +298,83 @@ def frangifilter(self):
                 IJ.run("Gray Scale Attribute Filtering", "operation=Opening attribute=[Box Diagonal] minimum="+config.greyscaleMinVal+" connectivity=4")
                 green = IJ.getImage()
                 green.setTitle("original + background subtraction + vesselness + cell body subtraction")
-            self.setCursor(Cursor.getDefaultCursor())
 
 
-basicfunctions.closeallimages()  # close any images already open
-username = []
-usernamepath = []
-# find all of the CSV files for user names (if any) - gets the name of the
-# file (user name) and the location of the file
-for root, dirs, files in os.walk(cwd):
-    for name in files:
-        if name.endswith((".csv")):
-            username.append(name)
-            usernamepath.append(os.path.join(root, name))
+def inbackground(frame, fn, key=None, then=None):
+        """ Run a dialog action in the background
+        Image processing started from the dialogs is run in order on one
+        background thread (see dialogexecutor.py), so the dialogs do not
+        freeze. A wait cursor is shown until all actions have finished
+        (see DialogExecutor.whenidle).
+        Parameters
+        ----------
+        frame: JFrame
+            dialog the action was started from.
+        fn: function
+            action taking no arguments, or None.
+        key: string
+            actions with the same key supersede each other, for actions
+            that are repeated with new values (e.g. thresholds) and
+            that start again from the unprocessed image.
+        then: function
+            called without arguments in the event dispatch thread when
+            the action has finished, e.g. to open the next dialog.
+        """
+        frame.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
+
+        def done(result):
+            if then is not None:
+                then()
+
+        if fn is None:
+            fn = lambda: None
+        dialogs.submit(fn, key, done)
+        # reset once every action has finished, including previews
+        # submitted without inbackground
+        dialogs.whenidle(lambda: frame.setCursor(Cursor.getDefaultCursor()))
+
+
+def showpreview(livepreview, frangi=True):
+        """ Live preview
+        Shows the result of the current settings for the current image
+        (see preview.py) instead of running each setting on the displayed
+        image in turn.
+        Parameters
+        ----------
+        livepreview: LivePreview
+            myelinpreview (Dialog4) or neuritepreview (Dialog5).
+        frangi: bool
+            show the myelin mask rather than the processed myelin channel.
+        """
+        if config.userimage2 is True:
+            key = "user: "+userimagename.getTitle()
+            imp = userimagename
+        else:
+            key = config.listAllImages[config.imageposition]
+            imp = None
+
+        def load():
+            if imp is None:
+                return stages.splitchannels(IJ.openImage(key), g, r)
+            return stages.splitchannels(imp, g, r)
+
+        livepreview.setsource(key, load)
+        settings = MyelinJanalysis.usersettings(config.greyscaleMinVal, g, r,
+                                                config.backgroundsubRolling, config.cellbodycb,
+                                                config.SN, config.mCLAHE,
+                                                config.backgroundsubNeurite, config.setpixels,
+                                                config.threshChoice, config.despeckle,
+                                                config.contrast, config.Min, config.Max,
+                                                config.radius, config.Min2, config.Max2,
+                                                config.threshChoice2, config.mCLAHE2,
+                                                config.Sbgcbstate)
+        livepreview.update(settings, frangi)
+
+
+# saved user names (if any), from the profiles folder rather than a walk
+# of the Fiji installation, see profiles.py
+username = profiles.names(cwd)
+startup.append(("user names", time.time()))
 
 
 class Dialog1(JFrame):
@@ -330,7 +415,7 @@ class Dialog1(JFrame):
         panel.setBackground(Color.WHITE)
         panel.setLayout(None)
         self.setTitle("Choose user name")
-        self.setSize(300, 200)
+        self.setSize(300, 260)
 
         self.selectuser = JComboBox(username)
         self.selectuser.setBounds(50, 10, 180, 20)
@@ -352,14 +437,29 @@ class Dialog1(JFrame):
         self.statcb.setSelected(False)
         panel.add(self.statcb)
 
+        self.sweepcb = JCheckBox("Parameter sweep?", True)
+        self.sweepcb.setBounds(20, 110, 170, 20)
+        self.sweepcb.setSelected(False)
+        panel.add(self.sweepcb)
+
+        self.tunecb = JCheckBox("Tune to annotated masks?", True)
+        self.tunecb.setBounds(20, 130, 200, 20)
+        self.tunecb.setSelected(False)
+        panel.add(self.tunecb)
+
+        self.dryruncb = JCheckBox("Dry run?", True)
+        self.dryruncb.setBounds(20, 150, 200, 20)
+        self.dryruncb.setSelected(False)
+        panel.add(self.dryruncb)
+
         OKbutton = JButton("OK", actionPerformed=self.onOK)
         OKbutton.setBackground(Color.BLACK)
-        OKbutton.setBounds(20, 120, 100, 30)
+        OKbutton.setBounds(20, 180, 100, 30)
         panel.add(OKbutton)
 
         Cancelbutton = JButton("Cancel", actionPerformed=self.onCancel)
         Cancelbutton.setBackground(Color.BLACK)
-        Cancelbutton.setBounds(150, 120, 100, 30)
+        Cancelbutton.setBounds(150, 180, 100, 30)
         panel.add(Cancelbutton)
 
         self.setLocationRelativeTo(None)
@@ -415,8 +515,14 @@ class Dialog1(JFrame):
         global imagefolder
         config.multi = self.multicb.isSelected()
         config.stats = self.statcb.isSelected()
+        config.sweep = self.sweepcb.isSelected()
+        config.tune = self.tunecb.isSelected()
+        config.dryrun = self.dryruncb.isSelected()
         if (config.stats is True) and (config.multi is False):
             IJ.showMessage("Error: multiple experimental conditions are required for statistical analysis")
+        elif ((config.sweep is True) or (config.tune is True) or (config.dryrun is True)) and (config.newusercb is True):
+            IJ.showMessage("Error: select an existing user name for a parameter sweep, tuning or dry run")
+            return
         else:
             # get a list of all the images in the user selected folder if .tif
             config.subfoldernames = list()
@@ -454,7 +560,13 @@ class Dialog1(JFrame):
             else:
                      config.user = self.selectuser.getSelectedItem()
                      self.dispose()
-                     if config.stats is False:
+                     if config.dryrun is True:
+                         dryrun()
+                     elif config.sweep is True:
+                         DialogSweep()
+                     elif config.tune is True:
+                         DialogTune()
+                     elif config.stats is False:
                          analysed()
                      else:
                             DialogStats()
@@ -760,6 +872,260 @@ class DialogStats(JFrame):
                 analysed()
 
 
+class DialogSweep(JFrame):
+    def __init__(self):
+        super(DialogSweep, self).__init__()
+        self.initUI()
+        """ Parameter sweep
+        Runs the selected user settings over a sample of images for every
+        combination of the values entered for Min, Max, radius, grey scale
+        filter and NLC standard deviation. The expensive stages are run
+        once per image. Results are displayed as a table and saved as
+        Sweep.csv in the selected folder.
+        Attributes
+        ----------
+        values: dictionary
+            textfield of comma separated values for each setting.
+        samplesize: textfield
+            number of images to sample from the selected folder.
+        """
+
+    def initUI(self):
+        panel = JPanel()
+        self.getContentPane().add(panel)
+        panel.setBackground(Color.WHITE)
+        panel.setLayout(None)
+        self.setTitle("Parameter sweep")
+        readsettings = MyelinJanalysis.getsettings(cwd, config.user)
+
+        self.values = {}
+        down = 10
+        import sweep
+        for name, index in sweep.parameters:
+            label = JTextArea(name+":")
+            label.setBounds(20, down, 120, 20)
+            label.setEditable(False)
+            panel.add(label)
+            self.values[name] = JTextField(readsettings[index])
+            self.values[name].setBounds(150, down, 200, 20)
+            panel.add(self.values[name])
+            down = down + 30
+
+        label = JTextArea("Number of images:")
+        label.setBounds(20, down, 120, 20)
+        label.setEditable(False)
+        panel.add(label)
+        self.samplesize = JTextField("5")
+        self.samplesize.setBounds(150, down, 50, 20)
+        panel.add(self.samplesize)
+        down = down + 40
+
+        Runbutton = JButton("Run", actionPerformed=self.onRun)
+        Runbutton.setBackground(Color.BLACK)
+        Runbutton.setBounds(60, down, 100, 30)
+        panel.add(Runbutton)
+
+        Cancelbutton = JButton("Cancel", actionPerformed=self.onCancel)
+        Cancelbutton.setBackground(Color.BLACK)
+        Cancelbutton.setBounds(200, down, 100, 30)
+        panel.add(Cancelbutton)
+
+        self.setSize(390, down + 80)
+        self.setLocationRelativeTo(None)
+        self.setLocation(int(IJ.getScreenSize().width * 0.01),
+                         int(IJ.getScreenSize().height * 3/10))
+        self.setVisible(True)
+
+    def onCancel(self, b):
+        self.dispose()
+
+    def onRun(self, b):
+        """ Run the sweep
+        Each textfield is split at commas into the values to sweep. The
+        sweep is run in the background (see inbackground) and its table
+        shown when it has finished.
+        Raises
+        ------
+        The number of images must be a whole number above 0 and every
+        setting needs at least one number (whole numbers for Min, Max
+        and greyscaleMinVal).
+        """
+        import sweep
+        integers = ("Min", "Max", "greyscaleMinVal")
+        grid = {}
+        for name, index in sweep.parameters:
+            grid[name] = [v.strip() for v in self.values[name].getText().split(",")
+                          if v.strip() != ""]
+            if len(grid[name]) == 0:
+                IJ.showMessage("Error: enter at least one value for "+name)
+                return
+            for value in grid[name]:
+                try:
+                    int(value) if name in integers else float(value)
+                except ValueError:
+                    IJ.showMessage("Error: "+name+" values must be numbers, not "+value)
+                    return
+        try:
+            samplesize = int(self.samplesize.getText())
+        except ValueError:
+            samplesize = 0
+        if samplesize < 1:
+            IJ.showMessage("Error: the number of images must be a whole number above 0")
+            return
+        outcome = {}
+
+        def run():
+            try:
+                readsettings = MyelinJanalysis.getsettings(cwd, config.user)
+                paths = sweep.sampleimages(config.listAllImages, samplesize)
+                names, rows = sweep.sweep(readsettings, paths, grid,
+                                          cache=MyelinJanalysis.getcache(cwd))
+                sweep.writesweep(os.path.join(imagefolder, "Sweep.csv"), names, rows)
+                outcome["result"] = (names, rows)
+            except (Exception, Throwable) as error:
+                outcome["error"] = error
+
+        def show():
+            if "error" in outcome:
+                IJ.showMessage("Error: parameter sweep failed: "+str(outcome["error"]))
+                return
+            names, rows = outcome["result"]
+            table = ResultsTable()
+            for row in rows:
+                table.incrementCounter()
+                for name, value in zip(names + ["% myelination", "% neurite density"], row):
+                    table.addValue(name, float(value))
+            table.show("Parameter sweep")
+
+        # the wait cursor is reset once the sweep has finished or failed
+        inbackground(self, run, then=show)
+
+
+class DialogTune(JFrame):
+    def __init__(self):
+        super(DialogTune, self).__init__()
+        self.initUI()
+        """ Tune settings to annotated masks
+        Searches threshold method and limits, remove outliers radius, grey
+        scale filter, NLC standard deviation, CLAHE and background
+        subtraction to best match hand annotated myelin and neurite masks
+        (see autotune). Channels, despeckle, pixel subtraction and sparse
+        neurite settings are taken from the selected user name. The best
+        settings are saved as a new user name.
+        Attributes
+        ----------
+        annotations: textfield
+            folder containing annotated masks.
+        newname: textfield
+            name for the tuned user settings.
+        candidates: textfield
+            number of settings to try.
+        """
+
+    def initUI(self):
+        panel = JPanel()
+        self.getContentPane().add(panel)
+        panel.setBackground(Color.WHITE)
+        panel.setLayout(None)
+        self.setTitle("Tune to annotated masks")
+
+        label = JTextArea("Annotation folder:")
+        label.setBounds(20, 10, 120, 20)
+        label.setEditable(False)
+        panel.add(label)
+        self.annotations = JTextField("")
+        self.annotations.setBounds(150, 10, 200, 20)
+        panel.add(self.annotations)
+        Browsebutton = JButton("...", actionPerformed=self.onBrowse)
+        Browsebutton.setBounds(355, 10, 30, 20)
+        panel.add(Browsebutton)
+
+        label = JTextArea("New user name:")
+        label.setBounds(20, 40, 120, 20)
+        label.setEditable(False)
+        panel.add(label)
+        self.newname = JTextField("")
+        self.newname.setBounds(150, 40, 200, 20)
+        panel.add(self.newname)
+
+        label = JTextArea("Settings to try:")
+        label.setBounds(20, 70, 120, 20)
+        label.setEditable(False)
+        panel.add(label)
+        self.candidates = JTextField("200")
+        self.candidates.setBounds(150, 70, 50, 20)
+        panel.add(self.candidates)
+
+        Runbutton = JButton("Run", actionPerformed=self.onRun)
+        Runbutton.setBackground(Color.BLACK)
+        Runbutton.setBounds(60, 110, 100, 30)
+        panel.add(Runbutton)
+
+        Cancelbutton = JButton("Cancel", actionPerformed=self.onCancel)
+        Cancelbutton.setBackground(Color.BLACK)
+        Cancelbutton.setBounds(200, 110, 100, 30)
+        panel.add(Cancelbutton)
+
+        self.setSize(410, 190)
+        self.setLocationRelativeTo(None)
+        self.setLocation(int(IJ.getScreenSize().width * 0.01),
+                         int(IJ.getScreenSize().height * 3/10))
+        self.setVisible(True)
+
+    def onBrowse(self, b):
+        folder = IJ.getDirectory("Choose annotation folder")
+        if folder is not None:
+            self.annotations.setText(folder)
+
+    def onCancel(self, b):
+        self.dispose()
+
+    def onRun(self, b):
+        """ Run tuning and save the best settings
+        Raises
+        ------
+        A new user name must be entered and must not already exist.
+        """
+        newuser = self.newname.getText()+".csv"
+        try:
+            candidates = int(self.candidates.getText())
+        except ValueError:
+            candidates = 0
+        if self.newname.getText() == "":
+            IJ.showMessage("Error: please enter a new user name")
+        elif newuser in username:
+            IJ.showMessage("Error: user name already exists")
+        elif candidates < 1:
+            IJ.showMessage("Error: the number of settings to try must be a whole number above 0")
+        else:
+            annotations = self.annotations.getText()
+            outcome = {}
+
+            def run():
+                import autotune
+                try:
+                    base = MyelinJanalysis.getsettings(cwd, config.user)
+                    readsettings, score = autotune.tune(base, config.listAllImages,
+                                                        annotations, candidates,
+                                                        cache=MyelinJanalysis.getcache(cwd))
+                    autotune.saveprofile(cwd, newuser, readsettings)
+                    outcome["score"] = score
+                except (Exception, Throwable) as error:
+                    outcome["error"] = error
+
+            def saved():
+                if "error" in outcome:
+                    IJ.showMessage("Error: "+str(outcome["error"]))
+                    return
+                username.append(newuser)
+                IJ.showMessage("Settings saved as "+newuser+" (mean Dice "
+                               +str(round(outcome["score"], 3))+")")
+                self.dispose()
+
+            # the wait cursor is reset once tuning has finished or failed
+            inbackground(self, run, then=saved)
+
+
 class Dialog2(JFrame):
     def __init__(self):
         super(Dialog2, self).__init__()
@@ -895,9 +1261,12 @@ class Dialog3(JFrame):
                 IJ.showMessage("Error: colours for myelin and neurites needs to be different")
             else:
                     self.dispose()
-                    getimage()
-                    green.show()
-                    Dialog4()
+
+                    def run():
+                        getimage()
+                        green.show()
+
+                    inbackground(self, run, then=Dialog4)
 
 
 class Dialog4(JFrame):
@@ -912,14 +1281,8 @@ class Dialog4(JFrame):
     folder and apply any analysis settings that have already been defined.
     Alternatively, the user can open a specific image and check "use
     selected image". The settings can be "Reset" back to defaul at any time.
-    
-    bug
-    ---
-    When image processing takes place a wait cursor is displayed. There is
-    a lag between when the analysis or function has finished and when the
-    image(s) is displayed. This means the wait cursor stops before the
-    analysis has finished. This is especially pronounced when several
-    images are being displayed.
+    Image processing is run in the background (see inbackground) and a
+    wait cursor is displayed until all of it has finished.
     """
     def initUI(self):
         panel = JPanel()
@@ -997,14 +1360,17 @@ class Dialog4(JFrame):
         threshlabel.setBorder(border)
         panel.add(threshlabel)
 
-        autoThresh = ("Default", "Huang", "Intermodes", "IsoData", "Li", "MaxEntropy", 
-                     "Mean", "MinError", "Minimum", "Moments", "Otsu", "Percentile", 
-                     "RenyiEntropy", "Shanbhag", "Triangle", "Yen")
-        self.autoT = JComboBox(autoThresh)
+        import thresholdexplorer
+        self.autoT = JComboBox(thresholdexplorer.methods)
         self.autoT.setBounds(125, 205, 120, 20)
         self.autoT.setEnabled(False)
         panel.add(self.autoT)
 
+        explorebutton = JButton("Explore", actionPerformed=self.onExplore)
+        explorebutton.setBackground(Color.BLACK)
+        explorebutton.setBounds(250, 205, 90, 20)
+        panel.add(explorebutton)
+
         Min1 = JTextArea("Min:")
         Min1.setBounds(90, 220, 40, 20)
         Min1.setEditable(False)
@@ -1096,6 +1462,16 @@ class Dialog4(JFrame):
         userimage.setBounds(180, 530, 170, 20)
         panel.add(userimage)
 
+        self.previewcb = JCheckBox("Live preview?", True, actionPerformed=self.onPreview)
+        self.previewcb.setFocusable(False)
+        self.previewcb.setBounds(180, 508, 110, 20)
+        panel.add(self.previewcb)
+
+        self.splitcb = JCheckBox("Before/after?", False, actionPerformed=self.onSplit)
+        self.splitcb.setFocusable(False)
+        self.splitcb.setBounds(290, 508, 100, 20)
+        panel.add(self.splitcb)
+
         Nextimagebutton = JButton("Next Image", actionPerformed=self.onNextimage)
         Nextimagebutton.setBackground(Color.BLACK)
         Nextimagebutton.setBounds(240, 560, 100, 30)
@@ -1154,28 +1530,32 @@ class Dialog4(JFrame):
         mCLAHE: bool
              state of CLAHE checkbox (bCLAHE)
         """
-        self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
         mCLAHE = cb1.getSource()
         config.mCLAHE = mCLAHE.isSelected()
-        if config.mCLAHE is True:
-            # remove unwanted images so that the number of images open
-            # does not pile up.
-            basicfunctions.toOriginal()
-            basicfunctions.green2()
-            basicfunctions.CLAHE()
-            if config.backgroundsubRolling is True:
-                basicfunctions.rollingsubtract()
-            elif config.backgroundsubNeurite is True:
-                neuritesubtract()
-        else:
-            basicfunctions.closeimage()
-            if (config.backgroundsubRolling is True) or (config.backgroundsubNeurite is True):
+        if self.previewed() is True:
+            return
+
+        def run():
+            if config.mCLAHE is True:
+                # remove unwanted images so that the number of images open
+                # does not pile up.
+                basicfunctions.toOriginal()
                 basicfunctions.green2()
-            if config.backgroundsubRolling is True:
-                basicfunctions.rollingsubtract()
-            elif config.backgroundsubNeurite is True:
-                neuritesubtract()
-        self.setCursor(Cursor.getDefaultCursor())
+                basicfunctions.CLAHE()
+                if config.backgroundsubRolling is True:
+                    basicfunctions.rollingsubtract()
+                elif config.backgroundsubNeurite is True:
+                    neuritesubtract()
+            else:
+                basicfunctions.closeimage()
+                if (config.backgroundsubRolling is True) or (config.backgroundsubNeurite is True):
+                    basicfunctions.green2()
+                if config.backgroundsubRolling is True:
+                    basicfunctions.rollingsubtract()
+                elif config.backgroundsubNeurite is True:
+                    neuritesubtract()
+
+        inbackground(self, run)
 
     def onSubtractrollingball(self, cb1):
         """ Rolling ball background subtraction
@@ -1198,18 +1578,22 @@ class Dialog4(JFrame):
         user must first deselect one before the other can be selected.
         """
         if config.backgroundsubNeurite is False:
-            self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
             bgcbstate = cb1.getSource()
             config.backgroundsubRolling = bgcbstate.isSelected()
-            if config.backgroundsubRolling is True:
-                basicfunctions.ifOriginal()
-                basicfunctions.rollingsubtract()
-            elif config.backgroundsubRolling is False:
-                 basicfunctions.closeimage()
-                 if config.mCLAHE is True:
-                     basicfunctions.green2()
-                     basicfunctions.CLAHE()
-            self.setCursor(Cursor.getDefaultCursor())
+            if self.previewed() is True:
+                return
+
+            def run():
+                if config.backgroundsubRolling is True:
+                    basicfunctions.ifOriginal()
+                    basicfunctions.rollingsubtract()
+                elif config.backgroundsubRolling is False:
+                     basicfunctions.closeimage()
+                     if config.mCLAHE is True:
+                         basicfunctions.green2()
+                         basicfunctions.CLAHE()
+
+            inbackground(self, run)
         else:
             IJ.showMessage("Error: only one background subtraction can be selected")
             self.rollingballcb.setSelected(False)
@@ -1233,18 +1617,22 @@ class Dialog4(JFrame):
         same as onSubtractrollingball()
         """
         if config.backgroundsubRolling is False:
-            self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
             bgcbstate2 = cb1.getSource()
             config.backgroundsubNeurite = bgcbstate2.isSelected()
-            if config.backgroundsubNeurite is True:
-                basicfunctions.ifOriginal()
-                neuritesubtract()
-            elif config.backgroundsubRolling is False:
-                 basicfunctions.closeimage()
-                 if config.mCLAHE is True:
-                     basicfunctions.green2()
-                     basicfunctions.CLAHE()
-            self.setCursor(Cursor.getDefaultCursor())
+            if self.previewed() is True:
+                return
+
+            def run():
+                if config.backgroundsubNeurite is True:
+                    basicfunctions.ifOriginal()
+                    neuritesubtract()
+                elif config.backgroundsubRolling is False:
+                     basicfunctions.closeimage()
+                     if config.mCLAHE is True:
+                         basicfunctions.green2()
+                         basicfunctions.CLAHE()
+
+            inbackground(self, run)
         else:
             IJ.showMessage("Error: only one background subtraction can be selected")
             self.neuriteSubcb.setSelected(False)
@@ -1264,12 +1652,18 @@ class Dialog4(JFrame):
          setpixles: string
              pixel subtraction value (has to be a string to run).
          """
-         global m
          config.setpixels = self.setpixels2.getText()
-         if m is True:
-            basicfunctions.closeimage()
-         basicfunctions.subpixels(config.setpixels)
-         m = True
+         if self.previewed() is True:
+             return
+
+         def run():
+             global m
+             if m is True:
+                basicfunctions.closeimage()
+             basicfunctions.subpixels(config.setpixels)
+             m = True
+
+         inbackground(self, run)
 
     def onRemovecellbodies(self, cb3):
         """ cell body selection
@@ -1290,12 +1684,17 @@ class Dialog4(JFrame):
             self.tMin.setEditable(True)
             self.tMax.setEditable(True)
             self.autoT.setEnabled(True)
-            basicfunctions.closeimagebg()
-            if config.setpixels != "0":
-                basicfunctions.closeimage()
-            getimage()
-            green.show()
-            
+            if self.previewed() is True:
+                return
+
+            def run():
+                basicfunctions.closeimagebg()
+                if config.setpixels != "0":
+                    basicfunctions.closeimage()
+                getimage()
+                green.show()
+
+            inbackground(self, run)
         else:
             self.setOutliers.setEditable(False)
             self.rollingballcb.setEnabled(True)
@@ -1304,11 +1703,17 @@ class Dialog4(JFrame):
             self.setpixels2.setEditable(True)
             self.tMin.setEditable(False)
             self.tMax.setEditable(False)
-            basicfunctions.closeimage()
-            getimage()
-            green.show()
-            applybackground()
             self.autoT.setEnabled(False)
+            if self.previewed() is True:
+                return
+
+            def run():
+                basicfunctions.closeimage()
+                getimage()
+                green.show()
+                applybackground()
+
+            inbackground(self, run)
 
     def onSetThreshold(self, e):
         """ Applies threshold
@@ -1336,36 +1741,65 @@ class Dialog4(JFrame):
          Raises
          ------
          cellbodycb must be selected.
+         Presses in quick succession are run once, with the latest values.
         """
         
-        global d,c
-        self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
+        global c
+        # presses are counted here rather than in run, so presses that
+        # are run once still count
+        presses = c
+        c = c + 1
         if config.cellbodycb is True:
             config.Min = int(self.tMin.getText())
             config.Max = int(self.tMax.getText())
             config.threshChoice = self.autoT.getSelectedItem()
-            # perform threshold is button has been pressed more
-            # than once.
-            if c != 0:
-                # if button has been prssed more than once close
-                # current image (stops lots of images piling up).
-                if c > 0:
-                    basicfunctions.closeimage()
+            if self.previewed() is True:
+                return
+
+            def run():
+                global d
+                # perform threshold is button has been pressed more
+                # than once.
+                if presses != 0:
+                    # if button has been prssed more than once close
+                    # current image (stops lots of images piling up).
+                    if presses > 0:
+                        basicfunctions.closeimage()
+                    getimage()
+                    ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
+                                                    int(IJ.getScreenSize().height * 1/14))
+                    green.show()
+                    IJ.setAutoThreshold(green, config.threshChoice+" dark")
+                    IJ.setRawThreshold(green, config.Min, config.Max, None)
+                    Prefs.blackBackground = True
+                    IJ.run(green, "Convert to Mask", "")
+                    basicfunctions.bgTitle2()
+                    threshResult = green.duplicate()
+                    d = 0
+
+            inbackground(self, run, "threshold")
+        else:
+            IJ.showMessage("Error: first select checkbox for: Remove cell bodies?")
+
+    def onExplore(self, e):
+        """ Threshold explorer
+         Displays the cell body masks produced by every threshold method,
+         calculated from one histogram of the unprocessed myelin channel,
+         so a method can be chosen without applying each one in turn.
+         Raises
+         ------
+         cellbodycb must be selected.
+        """
+        if config.cellbodycb is True:
+
+            def run():
                 getimage()
-                ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
-                                                int(IJ.getScreenSize().height * 1/14))
-                green.show()
-                IJ.setAutoThreshold(green, config.threshChoice+" dark")
-                IJ.setRawThreshold(green, config.Min, config.Max, None)
-                Prefs.blackBackground = True
-                IJ.run(green, "Convert to Mask", "")
-                basicfunctions.bgTitle2()
-                threshResult = green.duplicate()
-                d = 0
+                import thresholdexplorer
+                thresholdexplorer.explore(green, True)
+
+            inbackground(self, run, "explore")
         else:
             IJ.showMessage("Error: first select checkbox for: Remove cell bodies?")
-        c = c + 1
-        self.setCursor(Cursor.getDefaultCursor())
 
     def onOutlier(self, e):
             """ Remove outliers
@@ -1385,24 +1819,30 @@ class Dialog4(JFrame):
              ------
              cellbodycb must be selected.
             """
-            global d
             if config.cellbodycb is True:
                     sender = e.getSource()
                     value = sender.getText()
                     config.radius = str(value)
                     self.setOutliers.setText(config.radius)
-                    # if remove outliers has been performed previously
-                    # current image is closed (to stop images piling up).
-                    if d > 0:
-                        basicfunctions.closeimage()
-                    threshResult = IJ.getImage()
-                    threshResult = threshResult.duplicate()
-                    ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
-                                                    int(IJ.getScreenSize().height * 1/14))
-                    IJ.run(threshResult, "Remove Outliers...", "radius="+config.radius+" threshold=50 which=Bright")
-                    threshResult.show()
-                    basicfunctions.bgTitle2()
-                    d = d + 1
+                    if self.previewed() is True:
+                        return
+
+                    def run():
+                        global d
+                        # if remove outliers has been performed previously
+                        # current image is closed (to stop images piling up).
+                        if d > 0:
+                            basicfunctions.closeimage()
+                        threshResult = IJ.getImage()
+                        threshResult = threshResult.duplicate()
+                        ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
+                                                        int(IJ.getScreenSize().height * 1/14))
+                        IJ.run(threshResult, "Remove Outliers...", "radius="+config.radius+" threshold=50 which=Bright")
+                        threshResult.show()
+                        basicfunctions.bgTitle2()
+                        d = d + 1
+
+                    inbackground(self, run, "outliers")
             else:
                     IJ.showMessage("Error: Please check the remove cell bodies checkbox first")
 
@@ -1417,10 +1857,16 @@ class Dialog4(JFrame):
                  value for removing outliers.
         """
         config.frangicb = self.frangicb.isSelected()
-        if config.frangicb is True:
-             frangifilter(self)
-        else:
-            basicfunctions.closeimage()
+        if self.previewed() is True:
+            return
+
+        def run():
+            if config.frangicb is True:
+                 frangifilter(self)
+            else:
+                basicfunctions.closeimage()
+
+        inbackground(self, run)
 
     def onGreyscale(self, e):
         """ grey scale morphology filter
@@ -1433,20 +1879,24 @@ class Dialog4(JFrame):
          Frangi vesselness must be performed first.
         """
         if config.frangicb is True:
-            self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
             sender = e.getSource()
             attrival2 = sender.getText()
             config.greyscaleMinVal = str(attrival2)
             self.greyscale.setText(config.greyscaleMinVal)
-            ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
-                                                int(IJ.getScreenSize().height * 1/14))
-            
-            # if title of image does not contain vesselness then close
-            basicfunctions.ifVesselness()
-            IJ.run("Gray Scale Attribute Filtering", "operation=Opening attribute=[Box Diagonal] minimum="+config.greyscaleMinVal+" connectivity=4")
-            g = IJ.getImage()
-            g.setTitle("grey scale")
-            self.setCursor(Cursor.getDefaultCursor())
+            if self.previewed() is True:
+                return
+
+            def run():
+                ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
+                                                    int(IJ.getScreenSize().height * 1/14))
+
+                # if title of image does not contain vesselness then close
+                basicfunctions.ifVesselness()
+                IJ.run("Gray Scale Attribute Filtering", "operation=Opening attribute=[Box Diagonal] minimum="+config.greyscaleMinVal+" connectivity=4")
+                g = IJ.getImage()
+                g.setTitle("grey scale")
+
+            inbackground(self, run, "greyscale")
         else:
             IJ.showMessage("Error: Please apply frangi analysis first")
 
@@ -1462,20 +1912,56 @@ class Dialog4(JFrame):
         config.userimage2 = True
         userimagename = IJ.getImage()
         if sender.isSelected() is True:
-            getimage()
-            green.show()
+
+            def run():
+                getimage()
+                green.show()
+
+            inbackground(self, run)
         else:
             config.userimage2 = False
 
+    def onPreview(self, e):
+        """ Live preview
+        Shows the result of the current settings on a downsampled copy of
+        the current image, followed by the full resolution result (see
+        preview.py). Each change of settings updates the preview.
+        """
+        if self.previewed() is False:
+            myelinpreview.close()
+
+    def onSplit(self, e):
+        """ Before/after split view
+        Shows the unprocessed myelin channel to the left of the live
+        preview (see previewsurface.py).
+        """
+        myelinpreview.surface.splitview = self.splitcb.isSelected()
+        self.previewed()
+
+    def previewed(self):
+        """ Update the live preview if it is selected
+        Returns
+        -------
+        previewed: bool
+            False if the live preview is not selected, so the setting
+            should be run on the displayed image instead.
+        """
+        if self.previewcb.isSelected() is False:
+            return False
+        showpreview(myelinpreview, config.frangicb)
+        return True
+
     def onCancel(self, e):
-        basicfunctions.closeallimages()
+        myelinpreview.close()
         self.dispose()
+        inbackground(self, basicfunctions.closeallimages)
 
     def onNextdialog(self, e):
         config.userimage2 = False
+        myelinpreview.close()
         self.dispose()
-        basicfunctions.closeallimages()
-        Dialog5()
+        # Dialog5 opens the neurite channel, after any pending actions
+        inbackground(self, basicfunctions.closeallimages, then=Dialog5)
 
     def onReset(self, e):
         """
@@ -1483,9 +1969,13 @@ class Dialog4(JFrame):
         Open unprocessed myelin channel image.
            """
         global c, d, m
-        basicfunctions.closeallimages()
-        getimage()
-        green.show()
+
+        def run():
+            basicfunctions.closeallimages()
+            getimage()
+            green.show()
+
+        inbackground(self, run)
         self.setOutliers.setEditable(False)
         self.cellbodycb.setSelected(False)
         self.rollingballcb.setEnabled(True)
@@ -1517,31 +2007,36 @@ class Dialog4(JFrame):
         c = 0
         d = 0
         m = False
+        self.previewed()
 
     def onNextimage(self, e):
             """ Next image
             Dislays the next image in folder. Any settings that have been
             defined will be performed.
             """
-            self.setCursor(Cursor.getPredefinedCursor(Cursor.WAIT_CURSOR))
             getNext()
-            getimage()
-            green2 = green.duplicate()
-            green.show()
-            if (config.cellbodycb is False) and (config.frangicb is False):
-                ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
-                                                int(IJ.getScreenSize().height * 1/14))
-                green2.show()
-                applybackground()
-            if (config.cellbodycb is True) and (config.frangicb is False):
-                removecellbodies()
-            elif config.frangicb is True:
-                if config.cellbodycb is False:
-                    frangifilter(self)
-                if config.cellbodycb is True:
-                        removecellbodies()
+            if self.previewed() is True:
+                return
+
+            def run():
+                getimage()
+                green2 = green.duplicate()
+                green.show()
+                if (config.cellbodycb is False) and (config.frangicb is False):
+                    ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
+                                                    int(IJ.getScreenSize().height * 1/14))
+                    green2.show()
+                    applybackground()
+                if (config.cellbodycb is True) and (config.frangicb is False):
+                    removecellbodies()
+                elif config.frangicb is True:
+                    if config.cellbodycb is False:
                         frangifilter(self)
-            self.setCursor(Cursor.getDefaultCursor())
+                    if config.cellbodycb is True:
+                            removecellbodies()
+                            frangifilter(self)
+
+            inbackground(self, run)
 
 
 class Dialog5(JFrame):
@@ -1563,12 +2058,16 @@ class Dialog5(JFrame):
         # show neuite channel and run NLC if sparse neurite (SN) settings
         # have not been defined (Dialog6).
         if config.SN is False:
-              getimage()
-              red.show()
-              IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
-              Prefs.blackBackground = True
-              IJ.run(red, "Make Binary", "")
-              IJ.run(red, "Invert LUT", "")
+
+              def run():
+                  getimage()
+                  red.show()
+                  IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
+                  Prefs.blackBackground = True
+                  IJ.run(red, "Make Binary", "")
+                  IJ.run(red, "Invert LUT", "")
+
+              inbackground(self, run)
 
         Title = JTextArea("Normalise local contrast:")
         Title.setBounds(30, 0, 320, 20)
@@ -1636,6 +2135,18 @@ class Dialog5(JFrame):
         userimage.setFocusable(False)
         userimage.setBounds(260, 185, 170, 20)
         panel.add(userimage)
+
+        self.previewcb = JCheckBox("Live preview?", config.SN is False, actionPerformed=self.onPreview)
+        self.previewcb.setFocusable(False)
+        self.previewcb.setBounds(260, 165, 170, 20)
+        self.splitcb = JCheckBox("Before/after?", False, actionPerformed=self.onSplit)
+        self.splitcb.setFocusable(False)
+        self.splitcb.setBounds(260, 145, 140, 20)
+        if config.SN is True:
+            self.previewcb.setEnabled(False)
+            self.splitcb.setEnabled(False)
+        panel.add(self.previewcb)
+        panel.add(self.splitcb)
         
         self.setSize(410, 250)
 
@@ -1648,40 +2159,77 @@ class Dialog5(JFrame):
         """
         sender = e.getSource()
         config.contrast = sender.getText()
-        basicfunctions.closeimage()
-        getimage()
-        red.show()
-        IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
-        IJ.run(red, "Auto Threshold", "method=default white")
-        IJ.run(red, "Invert LUT", "")
+        if self.previewed() is True:
+            return
+
+        def run():
+            basicfunctions.closeimage()
+            getimage()
+            red.show()
+            IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
+            IJ.run(red, "Auto Threshold", "method=default white")
+            IJ.run(red, "Invert LUT", "")
+
+        inbackground(self, run, "contrast")
 
     def onDespeckle(self, cb1):
         despecklecbstate = cb1.getSource()
         config.despeckle = despecklecbstate.isSelected()
-        if config.despeckle is True:
-                IJ.run("Despeckle", "")
-        else:
-                basicfunctions.closeimage()
-                getimage()
-                IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
-                IJ.run(red, "Auto Threshold", "method=default white")
-                IJ.run(red, "Invert LUT", "")
-                red.show()
+        if self.previewed() is True:
+            return
+
+        def run():
+            if config.despeckle is True:
+                    IJ.run("Despeckle", "")
+            else:
+                    basicfunctions.closeimage()
+                    getimage()
+                    IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
+                    IJ.run(red, "Auto Threshold", "method=default white")
+                    IJ.run(red, "Invert LUT", "")
+                    red.show()
+
+        inbackground(self, run)
 
     def onSN(self, setb):
         """ Open dialog for sparse neurite settings.
         """
 
         config.userimage2 = False
+        neuritepreview.close()
         self.dispose()
-        basicfunctions.closeallimages()
-        getimage()
-        red.show()
-        Dialog6()
+
+        def run():
+            basicfunctions.closeallimages()
+            getimage()
+            red.show()
+
+        inbackground(self, run, then=Dialog6)
+
+    def onPreview(self, e):
+        """ Live preview, see Dialog4.onPreview
+        """
+        if self.previewed() is False:
+            neuritepreview.close()
+
+    def onSplit(self, e):
+        """ Before/after split view, see Dialog4.onSplit
+        """
+        neuritepreview.surface.splitview = self.splitcb.isSelected()
+        self.previewed()
+
+    def previewed(self):
+        """ Update the live preview if it is selected, see Dialog4.previewed
+        """
+        if self.previewcb.isSelected() is False:
+            return False
+        showpreview(neuritepreview)
+        return True
 
     def onCancel(self, setb):
+         neuritepreview.close()
          self.dispose()
-         basicfunctions.closeimage()
+         inbackground(self, basicfunctions.closeimage)
 
     def onNextimage(self, setb):
          """ Get next image in selected folder
@@ -1693,17 +2241,25 @@ class Dialog5(JFrame):
               "standard deviations" for NLC.
         """
          getNext()
-         getimage()
-         red.show()
-         IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
-         IJ.run(red, "Invert LUT", "")
-         if config.despeckle is True:
-             IJ.run(red, "Despeckle", "")
+         if self.previewed() is True:
+             return
+
+         def run():
+             getimage()
+             red.show()
+             IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+config.contrast+" center stretch")
+             IJ.run(red, "Invert LUT", "")
+             if config.despeckle is True:
+                 IJ.run(red, "Despeckle", "")
+
+         inbackground(self, run)
 
     def onStartanalysis(self, b):
+        neuritepreview.close()
         self.dispose()
         start_time = time.time()
-        analysed()
+        # the analysis closes all images, so start it after pending actions
+        inbackground(self, None, then=analysed)
 
     def onUserimage(self, e):
         """
@@ -1717,8 +2273,12 @@ class Dialog5(JFrame):
         config.userimage2 = True
         userimagename = IJ.getImage()
         if sender.isSelected() is True:
-            getimage()
-            red.show()
+
+            def run():
+                getimage()
+                red.show()
+
+            inbackground(self, run)
         else:
             config.userimage2 = False
 
@@ -1782,12 +2342,15 @@ class Dialog6(JFrame):
             test.setBorder(border)
             panel.add(test)
 
-            autoThresh = ("Default", "Huang", "Intermodes", "IsoData", "Li", "MaxEntropy", 
-                          "Mean", "MinError", "Minimum", "Moments", "Otsu", "Percentile", 
-                          "RenyiEntropy", "Shanbhag", "Triangle", "Yen")
-            self.autoT2 = JComboBox(autoThresh)
+            import thresholdexplorer
+            self.autoT2 = JComboBox(thresholdexplorer.methods)
             self.autoT2.setBounds(125, 90, 120, 20)
             panel.add(self.autoT2)
+
+            explorebutton = JButton("Explore", actionPerformed=self.onExplore)
+            explorebutton.setBackground(Color.BLACK)
+            explorebutton.setBounds(250, 90, 90, 20)
+            panel.add(explorebutton)
             
             panel.repaint()
             Min = JTextArea("Min:")
@@ -1877,14 +2440,18 @@ class Dialog6(JFrame):
             
             CLAHEcbstate = cb1.getSource()
             config.mCLAHE2 = CLAHEcbstate.isSelected()
-            if config.mCLAHE2 is True:
-                IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
-            else:
-                basicfunctions.closeimage()
-                getimage()
-                red.show()
-                if config.Sbgcbstate is True:
-                    IJ.run("Subtract Background...", "rolling=50")
+
+            def run():
+                if config.mCLAHE2 is True:
+                    IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+                else:
+                    basicfunctions.closeimage()
+                    getimage()
+                    red.show()
+                    if config.Sbgcbstate is True:
+                        IJ.run("Subtract Background...", "rolling=50")
+
+            inbackground(self, run)
 
     def onbg(self, cb1):
             """ rolling ball background subtraction. 
@@ -1895,19 +2462,23 @@ class Dialog6(JFrame):
             
             bgcbstate2 = cb1.getSource()
             config.Sbgcbstate = bgcbstate2.isSelected()
-            if config.Sbgcbstate is True:
-                if w.getImageCount() == 0:
+
+            def run():
+                if config.Sbgcbstate is True:
+                    if w.getImageCount() == 0:
+                        getimage()
+                        red.show()
+                        IJ.run("Subtract Background...", "rolling=50")
+                    else:
+                        IJ.run("Subtract Background...", "rolling=50")
+                else:
+                    basicfunctions.closeimage()
                     getimage()
                     red.show()
-                    IJ.run("Subtract Background...", "rolling=50")
-                else:
-                    IJ.run("Subtract Background...", "rolling=50")
-            else:
-                basicfunctions.closeimage()
-                getimage()
-                red.show()
-                if config.mCLAHE2 is True:
-                    IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+                    if config.mCLAHE2 is True:
+                        IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+
+            inbackground(self, run)
 
     def onCancel(self, e):
         """ Cancel and close dialog box. 
@@ -1915,44 +2486,74 @@ class Dialog6(JFrame):
         """
 
         config.userimage2 = False
-        basicfunctions.closeallimages()
         self.dispose()
         config.SN = False
-        Dialog5()
+        inbackground(self, basicfunctions.closeallimages, then=Dialog5)
 
     def onSet(self, e):
-            current = IJ.getImage()
+            """ Apply threshold
+            Presses in quick succession are run once, with the latest
+            values.
+            """
             global c
             config.Min2 = int(self.tMin.getText())
             config.Max2 = int(self.tMax.getText())
             config.threshChoice2 = self.autoT2.getSelectedItem()
-            if c != 0:
-                basicfunctions.closeimage()
+            # counted here rather than in run, see Dialog4.onSetThreshold
+            presses = c
+            c = c + 1
+
+            def run():
+                if presses != 0:
+                    basicfunctions.closeimage()
+                    getimage()
+                    red.show()
+                    if config.mCLAHE2 is True:
+                        IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+                    if config.Sbgcbstate is True:
+                        IJ.run("Subtract Background...", "rolling=50")
+                    IJ.setAutoThreshold(red, config.threshChoice2)
+                    IJ.run(red, "Invert LUT", "")
+                    IJ.setRawThreshold(red, config.Min2, config.Max2, None)
+                    IJ.run(red, "Convert to Mask", "")
+
+            inbackground(self, run, "threshold")
+
+    def onExplore(self, e):
+            """ Threshold explorer
+            Displays the neurite masks produced by every threshold method,
+            after any CLAHE and background subtraction selected, so a
+            method can be chosen without applying each one in turn.
+            """
+
+            def run():
                 getimage()
-                red.show()
                 if config.mCLAHE2 is True:
-                    IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+                    IJ.run(red, "Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
                 if config.Sbgcbstate is True:
-                    IJ.run("Subtract Background...", "rolling=50")
-                IJ.setAutoThreshold(red, config.threshChoice2)
-                IJ.run(red, "Invert LUT", "")
-                IJ.setRawThreshold(red, config.Min2, config.Max2, None)
-                IJ.run(red, "Convert to Mask", "")
-            c = c + 1
+                    IJ.run(red, "Subtract Background...", "rolling=50")
+                import thresholdexplorer
+                thresholdexplorer.explore(red, True)
+
+            inbackground(self, run, "explore")
 
     def onNext(self, cb1):
-        basicfunctions.closeimage()
         getNext()
-        getimage()
-        red.show()
-        if config.mCLAHE2 is True:
-                IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
-        if config.Sbgcbstate is True:
-            IJ.run("Subtract Background...", "rolling=50")
-        if (config.Min2 != "0") or (config.Max2 != "0"):
-                IJ.setAutoThreshold(red, config.threshChoice2)
-                IJ.setRawThreshold(red, config.Min2, config.Max2, None)
-                IJ.run("Convert to Mask", "")
+
+        def run():
+            basicfunctions.closeimage()
+            getimage()
+            red.show()
+            if config.mCLAHE2 is True:
+                    IJ.run("Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+            if config.Sbgcbstate is True:
+                IJ.run("Subtract Background...", "rolling=50")
+            if (config.Min2 != "0") or (config.Max2 != "0"):
+                    IJ.setAutoThreshold(red, config.threshChoice2)
+                    IJ.setRawThreshold(red, config.Min2, config.Max2, None)
+                    IJ.run("Convert to Mask", "")
+
+        inbackground(self, run)
 
     def onUserimage(self, e):
         """
@@ -1966,8 +2567,15 @@ class Dialog6(JFrame):
         config.userimage2 = True
         userimagename = IJ.getImage()
         if sender.isSelected() is True:
-            getimage()
-            red.show()
+
+            def run():
+                getimage()
+                red.show()
+
+            inbackground(self, run)
         else:
             config.userimage2 = False
 Dialog1()
+startup.append(("first dialog", time.time()))
+if config.startupreport is True:
+    IJ.log(basicfunctions.startupreport(startup))
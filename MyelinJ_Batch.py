@@ -0,0 +1,90 @@
+#@ File (label="Image folder", style="directory") folder
+#@ String (label="User name (.csv)") user
+#@ Boolean (label="Multiple experimental conditions?", value=false) multi
+#@ Integer (label="Shard index (-1: from SLURM_ARRAY_TASK_ID)", value=-1) shard
+#@ Integer (label="Number of shards (0: from SLURM_ARRAY_TASK_COUNT)", value=0) shards
+#@ String (label="Divide between shards", choices={"images", "folders"}) by
+#@ Boolean (label="Merge shards", value=false) merge
+#@ String (label="Experimental conditions (name: folder, folder; ...)", value="") conditions
+#@ String (label="Rscript location", value="") Rscript
+#@ Integer (label="Images analysed at once", value=1) threads
+#@ Boolean (label="Dry run (check images and predict run time only)", value=false) dryrun
+#@ String (label="Z-stacks and time-lapse", choices={"max", "mean", "planes"}) projection
+
+"""MyelinJ batch analysis without dialogs
+Runs one shard of a sharded analysis, or merges the partial results of
+all shards, for a folder of images and a saved user name. Intended for
+headless use on a cluster, e.g. as a SLURM job array:
+
+    ImageJ --headless --run MyelinJ_Batch.py \
+        'folder="/data/plate1",user="alice.csv",multi=true,merge=false'
+
+followed by a single task with merge=true once every shard has finished.
+If statistical analysis is wanted, the experimental conditions are given
+as "name: folder, folder; name: folder, ..." together with the location
+of Rscript. With threads above 1 images are analysed in parallel within
+the memory budget of the Fiji instance, see scheduler.py. A dry run
+checks every image header and predicts the run time without analysing,
+see preflight.py.
+"""
+
+import os
+import sys
+from ij import IJ
+
+cwd = os.path.join(os.getcwd(), "plugins", "MyelinJ-master")
+cwdR = os.path.join(cwd, "MyelinJstats.R")
+if " " in cwdR:
+    cwdR = '"'+cwdR+'"'
+sys.path.append(cwd)
+
+import MyelinJanalysis
+import config
+import sharding
+import preflight
+
+imagefolder = os.path.join(folder.getAbsolutePath(), "")
+config.projection = projection
+
+if multi is True:
+    subfoldernames = sorted(next(os.walk(imagefolder))[1])
+    subfoldernames = [s for s in subfoldernames
+                      if s not in ("shards", "statistical analysis")]
+else:
+    subfoldernames = [1]
+
+# experimental conditions for statistical analysis
+names, experiments = MyelinJanalysis.parseconditions(conditions)
+stats = len(names) > 0 and Rscript != "" and multi is True
+statsfolderPath = os.path.join(imagefolder, "statistical analysis")
+if stats is True:
+    for name in names:
+        if not os.path.exists(os.path.join(statsfolderPath, name)):
+            os.makedirs(os.path.join(statsfolderPath, name))
+
+if dryrun is False:
+    # values not given are read from the SLURM job array, a merge only
+    # needs the number of shards
+    if shard < 0 or shards <= 0:
+        slurmshard, slurmshards = sharding.fromenvironment()
+        if shard < 0:
+            shard = slurmshard
+        if shards <= 0:
+            shards = slurmshards
+    if shards is None or (shard is None and merge is False):
+        raise ValueError("shard index and count must be given or set by SLURM")
+
+if dryrun is True:
+    readsettings = MyelinJanalysis.getsettings(cwd, user)
+    paths = [os.path.join(root, name) for root, name in MyelinJanalysis.listimages(imagefolder)]
+    plan = preflight.plan(paths, int(readsettings[4]), int(readsettings[5]),
+                          preflight.readcosts(cwd), threads, projection)
+    preflight.writeplan(os.path.join(imagefolder, "Preflight.csv"), plan)
+    IJ.log(preflight.report(plan))
+elif merge is True:
+    MyelinJanalysis.mergeshards(imagefolder, shards, stats, experiments, multi, Rscript,
+                                subfoldernames, names, statsfolderPath, cwdR)
+else:
+    MyelinJanalysis.analyse(cwd, user, imagefolder, stats, experiments, multi, Rscript,
+                            subfoldernames, names, statsfolderPath, cwdR,
+                            shard=shard, shards=shards, by=by, threads=threads)
@@ -0,0 +1,49 @@
+#@ File (label="Acquisition folder", style="directory") folder
+#@ String (label="User name (.csv)") user
+#@ Boolean (label="Multiple experimental conditions?", value=false) multi
+#@ String (label="Completion marker file", value="acquisition.done") marker
+#@ Integer (label="Seconds between polls", value=10) interval
+#@ String (label="Experimental conditions (name: folder, folder; ...)", value="") conditions
+#@ String (label="Rscript location", value="") Rscript
+
+"""MyelinJ analysis of images as they are acquired
+Polls the acquisition folder and analyses each new .tif image once its
+size is stable, using a saved user name. Results.csv of each folder is
+kept up to date. When the completion marker file is written to the
+acquisition folder (e.g. by the microscope software at the end of the
+plate) the summary and statistical analysis are saved and the script
+ends:
+
+    ImageJ --headless --run MyelinJ_Watch.py \
+        'folder="/data/plate1",user="alice.csv",multi=true'
+
+Images already analysed are listed in Watch-state.csv, so the script
+can be restarted during acquisition.
+"""
+
+import os
+import sys
+
+cwd = os.path.join(os.getcwd(), "plugins", "MyelinJ-master")
+cwdR = os.path.join(cwd, "MyelinJstats.R")
+if " " in cwdR:
+    cwdR = '"'+cwdR+'"'
+sys.path.append(cwd)
+
+import MyelinJanalysis
+import watchfolder
+
+imagefolder = os.path.join(folder.getAbsolutePath(), "")
+
+# experimental conditions for statistical analysis
+names, experiments = MyelinJanalysis.parseconditions(conditions)
+stats = len(names) > 0 and Rscript != "" and multi is True
+statsfolderPath = os.path.join(imagefolder, "statistical analysis")
+if stats is True:
+    for name in names:
+        if not os.path.exists(os.path.join(statsfolderPath, name)):
+            os.makedirs(os.path.join(statsfolderPath, name))
+
+watcher = watchfolder.WatchFolder(cwd, user, imagefolder, multi, marker, interval,
+                                  stats, experiments, names, Rscript, statsfolderPath, cwdR)
+watcher.run()
@@ -0,0 +1,26 @@
+#@ File (label="Spool folder", style="directory") spool
+#@ Integer (label="Seconds between polls", value=1) interval
+
+"""MyelinJ worker service
+Starts Fiji and MyelinJ once and analyses the jobs written to the spool
+folder until Fiji is closed, so each job only costs its analysis:
+
+    ImageJ --headless --run MyelinJ_Worker.py 'spool="/data/spool"'
+
+Jobs give a folder of images, a user name .csv file and options (see
+workerservice.py) and are submitted from any python with
+workerservice.submit. Results.csv is saved in each folder analysed and
+the results of every image in the done folder of the spool. Jobs left
+running by a worker that died are requeued when a worker starts.
+"""
+
+import os
+import sys
+
+cwd = os.path.join(os.getcwd(), "plugins", "MyelinJ-master")
+sys.path.append(cwd)
+
+import workerservice
+
+service = workerservice.WorkerService(cwd, spool.getAbsolutePath(), interval)
+service.run()
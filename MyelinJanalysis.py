@@ -5,40 +5,31 @@ Refer to comments in function.
 """
 
 from __future__ import with_statement, division
-from ij import IJ, ImagePlus, WindowManager, Prefs
-from ij.plugin import ImageCalculator, ChannelSplitter, Duplicator
-from ij.process import ImageConverter, ImageProcessor
 import os
 import csv
-from ij import IJ, ImagePlus
-from ij.gui import DialogListener, GenericDialog, ImageWindow, \
-                   MessageDialog, YesNoCancelDialog
-from java.awt.event import ActionListener, ActionEvent, \
-     ItemListener, ItemEvent, WindowAdapter
-from ij.plugin.frame.Editor import actionPerformed
-from java.awt import Button, Checkbox, TextField, \
-                     BorderLayout, Font, Color, \
-                     Dimension, Cursor
-from java.util import Random, Vector
-from java.lang import String
-from javax.swing import JFrame, JButton, JOptionPane, \
-                        BorderFactory, JFrame, JLabel, JPanel, \
-                        JTextArea, JSlider, JCheckBox, JComboBox, \
-                        JTextField, JScrollBar
-from loci.common.DebugTools import enableIJLogging
-from ij.plugin.filter import RankFilters
-from javax.swing.AbstractButton import setBorderPainted
-from ij.io import FileSaver
 import time
-from javax.swing import ImageIcon
-import sys
-from ij.macro import Interpreter as IJ1
-import mpicbg.ij.clahe.Flat
+import threading
+from ij import IJ, WindowManager
+from java.awt import Color
 from java.lang import Runtime, System
-from inra.ijpb.morphology.attrfilt import BoxDiagonalOpeningQueue
-from inra.ijpb.morphology import Morphology
+from javax.swing import JFrame, JButton, JPanel, JTextArea
+import stages
+import frangicache
+import config
+import sharding
+import scheduler
+import tiffheader
+import hyperstack
+import qualitygate
+import maskarchive
+import metrics
+import pipeline
+import profiles
 w = WindowManager
 OS = System.getProperty("os.name")
+# guards the timings dictionaries shared by the threads analysing images,
+# see stopwatch
+timingslock = threading.Lock()
 
 
 def closeimage():
@@ -59,6 +50,30 @@ def closeallimages():
                 IJ.run("Close All")
 
 
+def usersettings(greyscaleMinVal, g, r, backgroundsubRolling, cellbodycb, SN, mCLAHE,
+                 backgroundsubNeurite, setpixels, threshChoice, despeckle, contrast, Min, Max,
+                 radius, Min2, Max2, threshChoice2, mCLAHE2, Sbgcbstate):
+            """ User settings as a flat list of strings
+            The same list as getsettings returns after newUser has saved
+            the settings, so settings can be used before they are saved
+            (e.g. by preview.py).
+            """
+            imagesettings = [Min, Max, threshChoice, despeckle, g, r, backgroundsubRolling]
+            if cellbodycb is True:
+                imagesettings.append(radius)
+            else:
+                imagesettings.append("0")
+            imagesettings.extend([mCLAHE, backgroundsubNeurite, setpixels, greyscaleMinVal])
+            if SN is False:
+                imagesettings.append(contrast)
+            else:
+                imagesettings.append("0")
+            imagesettings.append(cellbodycb)
+            if SN is True:
+                imagesettings.extend([Sbgcbstate, mCLAHE2, threshChoice2, Min2, Max2, "0", "0"])
+            return [str(setting) for setting in imagesettings]
+
+
 def newUser(cwd, greyscaleMinVal, g, r, backgroundsubRolling, cellbodycb, user, SN, mCLAHE, backgroundsubNeurite, setpixels,
             statcb, threshChoice, despeckle, contrast, Min, Max, radius, Min2, Max2, 
             threshChoice2, mCLAHE2, Sbgcbstate):
@@ -66,53 +81,18 @@ def newUser(cwd, greyscaleMinVal, g, r, backgroundsubRolling, cellbodycb, user,
             """ Save user settings
             Creates a comma separated values (csv) file called "username".csv which contains
             all of the image analysis settings defines by the user. The file is saved in the
-            MyelinJ folder within ImageJ.
+            profiles folder of the MyelinJ folder within ImageJ, see profiles.py.
             """
            
             closeimage()
             # get all user defined settings and make a CSV file, where its name is the user name
-            imagesettings1 = []
-            imagesettings1.append(Min)
-            imagesettings1.append(Max)
-            imagesettings1.append(threshChoice)
-            imagesettings1.append(despeckle)
-            imagesettings1.append(g)
-            imagesettings1.append(r)
-            imagesettings1.append(backgroundsubRolling)
-            imagesettings2 = []
-            if cellbodycb is True:
-                imagesettings2.append(radius)
-            else:
-                imagesettings2.append("0")
-            imagesettings2.append(mCLAHE)
-            imagesettings2.append(backgroundsubNeurite)
-            imagesettings2.append(setpixels)
-            imagesettings2.append(greyscaleMinVal)
-            if SN is False:
-                imagesettings2.append(contrast)
-            else:
-                imagesettings2.append("0")
-            imagesettings2.append(cellbodycb)
+            settings = usersettings(greyscaleMinVal, g, r, backgroundsubRolling, cellbodycb, SN,
+                                    mCLAHE, backgroundsubNeurite, setpixels, threshChoice,
+                                    despeckle, contrast, Min, Max, radius, Min2, Max2,
+                                    threshChoice2, mCLAHE2, Sbgcbstate)
+            totalsettings = [settings[x:x+7] for x in range(0, len(settings), 7)]
             
-            if SN is True:
-                imagesettings3 = []
-                imagesettings3.append(Sbgcbstate)
-                imagesettings3.append(mCLAHE2)
-                imagesettings3.append(threshChoice2)
-                imagesettings3.append(Min2)
-                imagesettings3.append(Max2)
-                imagesettings3.append("0")
-                imagesettings3.append("0")
-            
-            totalsettings = []
-            totalsettings.append(imagesettings1)
-            totalsettings.append(imagesettings2)
-            if SN is True:
-                totalsettings.append(imagesettings3)
-            
-            root = cwd
-            filename = user
-            fullpath = os.path.join(root, filename)
+            fullpath = profiles.path(cwd, user, create=True)
             f = open(fullpath, 'wb')
             writer = csv.writer(f)
             with open(user, "wb"):
@@ -121,6 +101,60 @@ def newUser(cwd, greyscaleMinVal, g, r, backgroundsubRolling, cellbodycb, user,
             f.close()
 
 
+def getsettings(cwd, user):
+        """ Read user settings
+        Reads the user name .csv file made by newUser and flattens its
+        rows into a single list (readsettings), indexed as follows:
+        0 Min, 1 Max, 2 threshChoice, 3 despeckle, 4 g, 5 r,
+        6 backgroundsubRolling, 7 radius, 8 mCLAHE, 9 backgroundsubNeurite,
+        10 setpixels, 11 greyscaleMinVal, 12 contrast, 13 cellbodycb and,
+        for sparse neurite settings, 14 Sbgcbstate, 15 mCLAHE2,
+        16 threshChoice2, 17 Min2, 18 Max2.
+        Parameters
+        ----------
+        cwd : string
+            Path for the MyelinJ folder in Fiji.
+        user: string
+            User name (.csv file name).
+        Returns
+        -------
+        readsettings: list of strings
+            user settings, a new list each time.
+        The file is read and validated once by profiles.registry and
+        only read again when it changes, so getsettings may be called
+        for every image. .json profiles (see profiles.py) are read in
+        the same way.
+        """
+        return profiles.registry.get(profiles.path(cwd, user)).aslist()
+
+
+def getcache(cwd):
+        """ Frangi vesselness disk cache
+        The cache is kept in the folder "frangicache" within the MyelinJ
+        folder, limited to config.frangicachebytes.
+        Returns
+        -------
+        cache: FrangiCache
+            None if the cache is disabled.
+        """
+        if config.frangicachebytes <= 0:
+            return None
+        return frangicache.FrangiCache(os.path.join(cwd, "frangicache"),
+                                       config.frangicachebytes)
+
+
+def writesettings(fullpath, readsettings):
+        """ Save user settings
+        Writes a flat list of user settings (as returned by getsettings)
+        as a user name .csv file with seven settings per row, the same
+        layout as newUser.
+        """
+        f = open(fullpath, 'wb')
+        writer = csv.writer(f)
+        writer.writerows([readsettings[x:x+7] for x in range(0, len(readsettings), 7)])
+        f.close()
+
+
 class Finished(JFrame):
 
                 def __init__(self):
@@ -158,7 +192,554 @@ class Finished(JFrame):
                         closeallimages()
 
 
-def analyse(cwd, user, imagefolder, stats, experiments, multi, Rloc2, subfoldernames, names, statsfolderPath, cwdR):
+def listimages(folder):
+        """ All .tif images in a folder and its subfolders
+        Images are sorted so that every run (and every shard of a
+        sharded run) sees them in the same order.
+        Returns
+        -------
+        images: list of (string, string)
+            folder containing each image and the image name.
+        """
+        images = []
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                if name.endswith((".tif")):
+                    images.append((root, name))
+        images.sort()
+        return images
+
+
+def folderpath(imagefolder, subfolder, multi):
+        """ Path to the folder of images analysed together
+        If multiple experiments are being analysed the file path is
+        changed to the current subfolder.
+        """
+        if multi is True:
+            return os.path.join(imagefolder, subfolder) + os.sep
+        return imagefolder
+
+
+def parseconditions(conditions):
+        """ Experimental conditions given as text
+        Parameters
+        ----------
+        conditions: string
+            "name: folder, folder; name: folder, ...".
+        Returns
+        -------
+        names: list of strings
+            name of each condition.
+        experiments: list of lists
+            subfolders of each condition.
+        """
+        names = []
+        experiments = []
+        for condition in conditions.split(";"):
+            if ":" in condition:
+                name, subfolders = condition.split(":", 1)
+                names.append(name.strip())
+                experiments.append([s.strip() for s in subfolders.split(",") if s.strip() != ""])
+        return names, experiments
+
+
+def stopwatch(timings):
+        """ Function adding the time since it was last called to a stage
+        Parameters
+        ----------
+        timings: dictionary
+            seconds spent in each stage, or None. It may be shared by
+            several threads, updates hold timingslock so none are lost.
+        """
+        clock = [time.time()]
+
+        def timed(stage):
+            now = time.time()
+            if timings is not None:
+                with timingslock:
+                    timings[stage] = timings.get(stage, 0) + now - clock[0]
+            clock[0] = now
+        return timed
+
+
+def checkquality(green, red, timed):
+        """ Quality gate of one image or plane
+        Checked as set by config.qualitygate (see qualitygate.py): "off",
+        "flag" to record failed fields or "skip" to also leave them out
+        of the analysis.
+        Returns
+        -------
+        quality: string
+            "", "flagged: " or "skipped: " and the reason the field
+            failed.
+        """
+        if config.qualitygate == "off":
+            return ""
+        quality = qualitygate.check(green, red, config.minfocus,
+                                    config.mincoverage, config.maxsaturation)
+        timed("quality")
+        if quality == "":
+            return ""
+        if config.qualitygate == "skip":
+            return "skipped: "+quality
+        return "flagged: "+quality
+
+
+def finalmasks(green, red, readsettings, cache, timed):
+        """ Final myelin and neurite masks of one image or plane
+        The channels are processed in place.
+        Returns
+        -------
+        green, red: ImagePlus
+            8bit myelin and neurite masks, foreground 255.
+        """
+        # thresholding to select cell bodies
+        green2 = stages.cellbodymask(green, readsettings)
+        timed("cell bodies")
+
+        # CLAHE and background subtraction
+        green = stages.preprocessmyelin(green, red, readsettings)
+        timed("preprocess")
+
+        # run frangi vesselness, convert to a mask, remove cell
+        # bodies and run grey scale morphology filter from MorpholibJ
+        green = stages.frangi(green, cache)
+        timed("frangi")
+        green = stages.myelinmask(green, green2, readsettings)
+        stages.release(green2)
+        timed("myelin")
+
+        # dense or sparse neurite image analysis
+        red = stages.neuritemask(red, readsettings)
+        timed("neurites")
+        return green, red
+
+
+def measuremasks(green, red):
+        """ Pixel counts and measures of the final masks
+        Returns
+        -------
+        myelinpixels, neuritepixels, totalpixels: int
+            number of myelin and neurite pixels and pixel total.
+        measures: tuple
+            measures of the masks in the order of metrics.names.
+        myelinpacked, neuritepacked: byte arrays
+            the masks packed by maskarchive.pack.
+        """
+        neuritepixels, totalpixels = stages.countpixels(red)
+        myelinpixels, total = stages.countpixels(green)
+        # measures of the packed masks, which are also archived
+        myelinpacked = maskarchive.pack(green.getProcessor())
+        neuritepacked = maskarchive.pack(red.getProcessor())
+        measures = metrics.measure(green, red, myelinpacked, neuritepacked,
+                                   config.colocalisationtolerance)
+        return myelinpixels, neuritepixels, totalpixels, measures, myelinpacked, neuritepacked
+
+
+def analysechannels(green, red, savename, readsettings, cache, timed, archive=None):
+        """ Analyse the myelin and neurite channels of one image or plane
+        Saves the processed neurite and myelin channel images as
+        savename+"neurites" and savename+"myelinFinal" .jpg, and the
+        final masks in archive (see maskarchive.py) if it is not None.
+        Measures of the final masks (colocalised myelin, myelin
+        segments, neurite length and branch points) are calculated from
+        the masks in memory, see metrics.py.
+        The quality gate is checked first, see checkquality.
+        Returns
+        -------
+        myelinpixels, neuritepixels, totalpixels: int
+            number of myelin and neurite pixels and pixel total, 0 if
+            skipped.
+        quality: string
+            "" or the reason the field was flagged or skipped.
+        measures: tuple
+            measures of the final masks in the order of metrics.names.
+        """
+        quality = checkquality(green, red, timed)
+        if quality.startswith("skipped"):
+            return 0, 0, 0, quality, metrics.empty()
+
+        green, red = finalmasks(green, red, readsettings, cache, timed)
+        IJ.saveAs(red, "Jpeg", savename+"neurites")
+        IJ.saveAs(green, "Jpeg", savename+"myelinFinal")
+        timed("save")
+
+        (myelinpixels, neuritepixels, totalpixels, measures,
+         myelinpacked, neuritepacked) = measuremasks(green, red)
+        if archive is not None:
+            archive.putpacked(os.path.basename(savename), green.getWidth(), green.getHeight(),
+                              myelinpacked, neuritepacked)
+        stages.release(green)
+        timed("metrics")
+        return myelinpixels, neuritepixels, totalpixels, quality, measures
+
+
+def ishyperstack(fullpath):
+        """ True if the image has more than one slice or frame
+        """
+        try:
+            return tiffheader.readheader(fullpath).hyperstack()
+        except (IOError, KeyError):
+            return False
+
+
+def analyseimage(fullpath, settings2, readsettings, cache=None, timings=None, archive=None):
+        """ Analyse one image
+        Saves the processed neurite and myelin channel images as .jpg
+        in settings2.
+        Z-stacks and time-lapse images are read one plane at a time (see
+        hyperstack.py) and analysed as set by config.projection: the
+        maximum or mean projection is analysed, or with "planes" every
+        plane is analysed, its pixel counts are saved in
+        name+"planes.csv" and the image counts are the sums over planes
+        that were not skipped.
+        Parameters
+        ----------
+        fullpath: string
+            path to .tif image.
+        settings2: string
+            folder (ending with a separator) where processed images are
+            saved.
+        readsettings: list of strings
+            user settings.
+        cache: FrangiCache
+            frangi vesselness disk cache or None.
+        timings: dictionary
+            seconds spent in each stage are added to it, or None.
+        archive: MaskArchive
+            archive the final masks are added to, or None.
+        Returns
+        -------
+        myelinpixels, neuritepixels, totalpixels: int
+            number of myelin and neurite pixels and pixel total of image.
+        quality: string
+            "" or the reason the image was flagged or skipped by the
+            quality gate.
+        measures: tuple
+            measures of the final masks, see metrics.py.
+        """
+        timed = stopwatch(timings)
+        name = os.path.basename(fullpath)
+        g = int(readsettings[4])
+        r = int(readsettings[5])
+        if not ishyperstack(fullpath):
+            # open .tiff image, split channels and
+            # convert to 8bit grey scale.
+            imp = IJ.openImage(fullpath)
+            green, red = stages.splitchannels(imp, g, r)
+            timed("open")
+            pixels = analysechannels(green, red, settings2+name, readsettings, cache, timed,
+                                     archive)
+        elif config.projection in ("max", "mean"):
+            imp = hyperstack.openvirtual(fullpath)
+            green, red = hyperstack.projection(imp, g, r, config.projection)
+            timed("open")
+            pixels = analysechannels(green, red, settings2+name, readsettings, cache, timed,
+                                     archive)
+        else:
+            imp = hyperstack.openvirtual(fullpath)
+            timed("open")
+            rows = []
+            for z, t, green, red in hyperstack.planes(imp, g, r):
+                timed("open")
+                counts = analysechannels(green, red, settings2+name+"-z%d-t%d" % (z, t),
+                                         readsettings, cache, timed, archive)
+                rows.append((z, t) + counts)
+            writeplanes(settings2+name+"planes.csv", rows)
+            pixels = sumplanes([row[2:] for row in rows])
+        with stages.windowlock:
+            closeallimages()
+        return pixels
+
+
+def sumplanes(rows):
+        """ Counts of a z-stack or time-lapse image analysed by plane
+        Parameters
+        ----------
+        rows: list of tuples
+            myelinpixels, neuritepixels, totalpixels, quality and
+            measures of each plane, see analyseimage.
+        Returns
+        -------
+        myelinpixels, neuritepixels, totalpixels: int
+            sums over the planes that were not skipped.
+        quality: string
+            "skipped: every plane", "flagged: " and the number of planes
+            flagged or skipped, or "".
+        measures: tuple
+            sums over the planes that were not skipped.
+        """
+        kept = [row for row in rows if not row[3].startswith("skipped")]
+        measures = metrics.add([row[4] for row in kept])
+        failed = len([row for row in rows if row[3] != ""])
+        if len(kept) == 0:
+            quality = "skipped: every plane"
+        elif failed > 0:
+            quality = "flagged: %d of %d planes" % (failed, len(rows))
+        else:
+            quality = ""
+        return tuple([sum([row[i] for row in kept]) for i in (0, 1, 2)]) + (quality, measures)
+
+
+def decodeimage(fullpath, readsettings, timings=None):
+        """ Decode stage of the pipelined analysis, see pipeline.py
+        Returns
+        -------
+        green, red: ImagePlus
+            8bit myelin and neurite channels, None for z-stacks and
+            time-lapse images, which are read plane by plane by
+            analyseimage in the compute stage.
+        """
+        if ishyperstack(fullpath):
+            return None
+        timed = stopwatch(timings)
+        green, red = stages.splitchannels(IJ.openImage(fullpath), int(readsettings[4]),
+                                          int(readsettings[5]))
+        timed("open")
+        return green, red
+
+
+def computeimage(fullpath, settings2, channels, readsettings, cache=None, timings=None,
+                 archive=None):
+        """ Compute stage of the pipelined analysis, see pipeline.py
+        Parameters
+        ----------
+        channels: tuple
+            green and red channel from decodeimage, or None.
+        Returns
+        -------
+        pixels: tuple
+            as analyseimage returns, for images analysed completely
+            (z-stacks, time-lapse and skipped images).
+        masks: tuple
+            (green, red, pixels, myelinpacked, neuritepacked) for the
+            write stage, or None.
+        """
+        if channels is None:
+            return analyseimage(fullpath, settings2, readsettings, cache, timings, archive), None
+        timed = stopwatch(timings)
+        green, red = channels
+        quality = checkquality(green, red, timed)
+        if quality.startswith("skipped"):
+            stages.release(green, red)
+            return (0, 0, 0, quality, metrics.empty()), None
+        green, red = finalmasks(green, red, readsettings, cache, timed)
+        (myelinpixels, neuritepixels, totalpixels, measures,
+         myelinpacked, neuritepacked) = measuremasks(green, red)
+        timed("metrics")
+        pixels = (myelinpixels, neuritepixels, totalpixels, quality, measures)
+        return None, (green, red, pixels, myelinpacked, neuritepacked)
+
+
+def writeimage(fullpath, settings2, computed, timings=None, archive=None):
+        """ Write stage of the pipelined analysis, see pipeline.py
+        Saves the processed neurite and myelin channel images as .jpg in
+        settings2 and the final masks in archive, as analysechannels.
+        Returns
+        -------
+        pixels: tuple
+            as analyseimage returns.
+        """
+        pixels, masks = computed
+        if masks is None:
+            return pixels
+        timed = stopwatch(timings)
+        green, red, pixels, myelinpacked, neuritepacked = masks
+        savename = settings2+os.path.basename(fullpath)
+        IJ.saveAs(red, "Jpeg", savename+"neurites")
+        IJ.saveAs(green, "Jpeg", savename+"myelinFinal")
+        if archive is not None:
+            archive.putpacked(os.path.basename(savename), green.getWidth(), green.getHeight(),
+                              myelinpacked, neuritepacked)
+        stages.release(green, red)
+        with stages.windowlock:
+            closeallimages()
+        timed("save")
+        return pixels
+
+
+def writeplanes(fullpath, rows):
+        """ Save the pixel counts and percentages of each plane
+        Parameters
+        ----------
+        rows: list of tuples
+            (slice, frame, myelin pixels, neurite pixels, pixel total,
+            quality, measures).
+        """
+        f = open(fullpath, 'wb')
+        writer = csv.writer(f)
+        writer.writerow(["Slice", "Frame", "Myelin pixels", "Neurite pixels", "Total pixels",
+                         "% neurite density", "% myelination", "Quality"] + list(metrics.names))
+        for z, t, m, n, total, quality, measures in rows:
+            if quality.startswith("skipped"):
+                writer.writerow([z, t, "", "", "", "", "", quality] + [""] * len(measures))
+            else:
+                writer.writerow([z, t, m, n, total, n/total*100, m/n*100 if n else 0, quality]
+                                + list(measures))
+        f.close()
+
+
+def folderresults(imagenames, myelinoverlay, neuritedensity, totalpixels, quality=None,
+                  measures=None):
+        """ % myelination and % neurite density for a folder of images
+        Parameters
+        ----------
+        imagenames: list of strings
+            name of each image.
+        myelinoverlay: list of int
+            number of myelin pixels in each image.
+        neuritedensity: list of int
+            number of neurite pixels in each image.
+        totalpixels: list of int
+            pixel total of each image.
+        quality: list of strings
+            "" or the reason each image was flagged or skipped by the
+            quality gate. Skipped images have empty percentages and are
+            left out of the averages. A "Quality" row is added if any
+            image was flagged or skipped.
+        measures: list of tuples
+            measures of the final masks of each image (see metrics.py),
+            their rows are added after % myelination.
+        Returns
+        -------
+        result: 2D list
+            rows of Results.csv.
+        myelinaverage, neuriteaverage: float
+            average % myelination and % neurite density, "" if every
+            image was skipped.
+        """
+        if quality is None:
+            quality = [""] * len(imagenames)
+        analysed = [not q.startswith("skipped") for q in quality]
+        neuritepixels = neuritedensity
+
+        # for each image calculate % myelination as number of myelin pixels
+        # divided by the number of neurite pixels * 100
+        myelinoverlay = [x1/x2*100 if a else "" for (x1, x2, a) in
+                         zip(myelinoverlay, neuritedensity, analysed)]
+
+        # for each image calculate % neurite density as neurite pixels divided
+        # by the total number of pixels in the image * 100.
+        neuritedensity = [x1/x2*100 if a else "" for (x1, x2, a) in
+                          zip(neuritedensity, totalpixels, analysed)]
+        kept = analysed.count(True)
+        if kept > 0:
+            myelinaverage = sum([x for (x, a) in zip(myelinoverlay, analysed) if a])/kept
+            neuriteaverage = sum([x for (x, a) in zip(neuritedensity, analysed) if a])/kept
+        else:
+            myelinaverage = ""
+            neuriteaverage = ""
+        result = []
+        result.append(["Image names"]+imagenames)
+        result.append(["% neurite density"]+neuritedensity)
+        result.append(["% myelination"]+myelinoverlay)
+        if measures is not None:
+            result.extend(metrics.resultrows(neuritepixels, measures, analysed))
+        if any(quality):
+            result.append(["Quality"]+list(quality))
+        return result, myelinaverage, neuriteaverage
+
+
+def statsresult(result):
+        """ Rows of Results.csv for statistical analysis
+        The R script reads the first two rows below the image names as
+        numbers, so skipped images and the quality row are left out.
+        """
+        columns = [j for j in range(len(result[0])) if j == 0 or result[1][j] != ""]
+        return [[row[j] for j in columns] for row in result[:3]]
+
+
+def writeresult(fullpath, result):
+        """ Save rows of results as a .csv file
+        """
+        f = open(fullpath, 'wb')
+        writer = csv.writer(f)
+        for d in range(len(result)):
+            row = [result[d]]
+            writer.writerows(row)
+        f.close()
+
+
+def conditionname(name):
+        """ Name of an experimental condition
+        names are textfields from DialogStats or plain strings.
+        """
+        if hasattr(name, "getText"):
+            return name.getText()
+        return name
+
+
+def writefolder(imagefolder, settings2, subfolder, result, stats, experiments, names):
+        """ Save Results.csv for a folder of images
+        If statistical analysis is being performed the results .csv file
+        is also saved to a subfolder within the statistical analysis folder
+        which denotes the experimental condition the results belong to.
+        """
+        writeresult(os.path.join(settings2, "Results.csv"), result)
+        if stats is True:
+            # nested for loop to identify correct experimental condition
+            # for the current subfolder being analysed.
+            for y in range(0, len(experiments)):
+                if subfolder in experiments[y]:
+                    root = os.path.join(imagefolder, "statistical analysis",
+                                        conditionname(names[y]))
+                    writeresult(os.path.join(root, subfolder+".csv"), statsresult(result))
+                    break
+
+
+def writesummary(imagefolder, subfoldernames, neuriteaverage2, myelinaverage2):
+        """ Save Result-Summary.csv
+        .csv summary sheet with average % neurite density and average
+        % myelination for each subfolder (experiment).
+        """
+        result = []
+        result.append(["Folder name"]+list(subfoldernames))
+        result.append(["% neurite density"]+neuriteaverage2)
+        result.append(["% myelination"]+myelinaverage2)
+        writeresult(os.path.join(imagefolder, "Result-Summary.csv"), result)
+
+
+def finishfolders(imagefolder, stats, experiments, multi, Rloc2, subfoldernames,
+                  names, statsfolderPath, cwdR, counts):
+        """ Save results for all folders and run statistical analysis
+        Parameters
+        ----------
+        counts: list
+            for each subfolder a list of (image name, myelin pixels,
+            neurite pixels, pixel total, quality, measures).
+        Remaining parameters as for analyse.
+        """
+        myelinaverage2 = []
+        neuriteaverage2 = []
+        for i in range(len(subfoldernames)):
+            settings2 = folderpath(imagefolder, subfoldernames[i], multi)
+            rows = counts[i]
+            result, myelinaverage, neuriteaverage = folderresults(
+                [row[0] for row in rows], [row[1] for row in rows],
+                [row[2] for row in rows], [row[3] for row in rows],
+                [row[4] for row in rows], [row[5] for row in rows])
+            myelinaverage2.append(myelinaverage)
+            neuriteaverage2.append(neuriteaverage)
+            writefolder(imagefolder, settings2, subfoldernames[i], result,
+                        stats, experiments, names)
+
+        # remove any empty user name files left in the working directory
+        cwd2 = os.getcwd()
+        for files in os.listdir(cwd2):
+                if files.endswith(".csv"):
+                    os.remove(os.path.join(cwd2, files))
+
+        if multi is True:
+            writesummary(imagefolder, subfoldernames, neuriteaverage2, myelinaverage2)
+
+        # Run Rscript for statistical analysis via the command line
+        if stats is True:
+            cmd = Rloc2+" "+cwdR+" "+statsfolderPath
+            Runtime.getRuntime().exec(cmd)
+
+
+def analyse(cwd, user, imagefolder, stats, experiments, multi, Rloc2, subfoldernames, names, statsfolderPath, cwdR,
+            shard=None, shards=None, by="images", progress=None, threads=None):
         """ Main image analysis
         Gets user image analysis settings from the .csv file.
         If multiple experiments have been selected by the user
@@ -178,6 +759,10 @@ def analyse(cwd, user, imagefolder, stats, experiments, multi, Rloc2, subfoldern
         myelin channel image and a processed neurite channel
         image will be saved. The images can be any number of
         subdirectories (folders within folders).
+        If shards is given only this node's slice of the images (or
+        subfolders) is analysed and the pixel counts are saved as a
+        partial result file, see sharding.py. Results.csv, the summary
+        and statistics are then made by mergeshards.
         Parameters
         ----------
         cwd : string
@@ -206,249 +791,155 @@ def analyse(cwd, user, imagefolder, stats, experiments, multi, Rloc2, subfoldern
             file path to the create statsfolder.
         cwdR: string
             file path to MyelinJstats.R
+        shard: int
+            index of this node's shard (0 to shards - 1).
+        shards: int
+            number of shards, None analyses all images.
+        by: string
+            "images" or "folders", what is divided between shards.
+        progress: Progress
+            updated as images are analysed, see progress.py. If it is
+            cancelled the analysis stops after the current image and
+            results are saved for the images already analysed, without
+            statistical analysis.
+        threads: int
+            number of images analysed at once, defaults to
+            config.threads. With more than one thread images are only
+            started while their estimated memory use fits under
+            config.memoryfraction of the Java heap, see scheduler.py.
+        If config.maskarchive is True the final masks of each folder are
+        also saved in a mask archive (see maskarchive.py), so results
+        can be recalculated without analysing the images again.
+        If config.pipeline is True images are opened, analysed (by
+        threads worker threads) and saved at the same time, see
+        pipeline.py. The number of images in memory is then bounded by
+        config.queuedepth rather than by the memory scheduler.
         """
         # read settings from the user name CSV
-        bg = False
-        readsettings = []
-        imagenames = []
-        neuritedensity = []
-        myelinoverlay = []
-        myelinaverage2 = []
-        neuriteaverage2 = []
-        root = cwd
-        filename = user
-        fullpath = os.path.join(root, filename)
-        f = open(fullpath, 'rb')
-        readCSV = csv.reader(f)
-        for row in readCSV:
-                readsettings.append(row[0])
-                readsettings.append(row[1])
-                readsettings.append(row[2])
-                readsettings.append(row[3])
-                readsettings.append(row[4])
-                readsettings.append(row[5])
-                readsettings.append(row[6])
-        f.close()
-        i = 0
-        
+        readsettings = getsettings(cwd, user)
+        cache = getcache(cwd)
+
+        # if multiple experimental conditions has been selected each folder is treated as a
+        # separate experiment and looped through separately otherwise all folders will be
+        # treated as one experiment this only works for sub directories within the main folder.
+        # Further folders will be ignored (each image can be in its own folder for example)
+        work = []
         for i in range(len(subfoldernames)):
-            # if multiple experimental conditions has been selected each folder is treated as a
-            # separate experiment and looped through separately otherwise all folders will be
-            # treated as one experiment this only works for sub directories within the main folder.
-            # Further folders will be ignored (each image can be in its own folder for example)
-            if multi is True:
-                 # if multiple experiments are being analysed the file path is changed to the
-                 # current subfolder
-                 settings2 = os.path.join(imagefolder, subfoldernames[i])
-                 if "Windows" in OS:
-                     settings2 = settings2 + "\\"
-                 elif "Mac" in OS:
-                    settings2 = settings2 + "/"
+            settings2 = folderpath(imagefolder, subfoldernames[i], multi)
+            for root, name in listimages(settings2):
+                work.append((len(work), i, settings2, os.path.join(root, name)))
+        if shards is not None:
+            work = sharding.select(work, shard, shards, by)
+
+        timings = {}
+        if progress is not None:
+            progress.start(len(work))
+            timings = progress.timings
+
+        # one mask archive for each folder of images analysed together
+        archives = {}
+        if config.maskarchive is True:
+            for settings2 in set([item[2] for item in work]):
+                archives[settings2] = maskarchive.MaskArchive(
+                    os.path.join(settings2, maskarchive.archivename(shard, shards)), "w")
+
+        def decodework(item):
+            if progress is not None and progress.cancelled:
+                return None
+            return decodeimage(item[3], readsettings, timings)
+
+        def computework(item, channels):
+            position, i, settings2, fullpath = item
+            if progress is not None:
+                if progress.cancelled:
+                    stages.release(*(channels or ()))
+                    return None
+                progress.begin(subfoldernames[i], os.path.basename(fullpath))
+            return computeimage(fullpath, settings2, channels, readsettings, cache, timings,
+                                archives.get(settings2))
+
+        def writework(item, computed):
+            if computed is None:
+                return None
+            pixels = writeimage(item[3], item[2], computed, timings, archives.get(item[2]))
+            if progress is not None:
+                progress.end()
+            return pixels
+
+        def analysework(item):
+            position, i, settings2, fullpath = item
+            if progress is not None:
+                if progress.cancelled:
+                    return None
+                progress.begin(subfoldernames[i], os.path.basename(fullpath))
+            pixels = analyseimage(fullpath, settings2, readsettings, cache, timings,
+                                  archives.get(settings2))
+            if progress is not None:
+                progress.end()
+            return pixels
+
+        if threads is None:
+            threads = config.threads
+        try:
+            if config.pipeline is True:
+                listener = progress.setqueues if progress is not None else None
+                pipelined = pipeline.Pipeline(config.queuedepth, threads, listener)
+                results = pipelined.run(work, decodework, computework, writework)
+            elif threads > 1:
+                memory = scheduler.MemoryScheduler(config.memoryfraction)
+                results = memory.map(analysework, work, [w[3] for w in work], threads)
             else:
-                 settings2 = imagefolder
-             # loop through all .tiff files in location
-            for root, dirs, files in os.walk(settings2):
-              for name in files:
-                if name.endswith((".tif")):
-                    imagenames.append(os.path.join(name))
-                    # open .tiff image, split channels and
-                    # convert to 8bit grey scale.
-                    imp = IJ.openImage(os.path.join(root, name))
-                    g = int(readsettings[4])
-                    r = int(readsettings[5])
-                    imp = ChannelSplitter.split(imp)
-                    green = imp[g]
-                    red = imp[r]
-                    conv = ImageConverter(red)
-                    conv.convertToGray8()
-                    conv = ImageConverter(green)
-                    conv.convertToGray8()
-                    
-                    # thresholding to select cell bodies
-                    green2 = green.duplicate()
-                    if (readsettings[0] != "0") or (readsettings[1] != "0"):
-                        bg = True    
-                        IJ.setAutoThreshold(green2, readsettings[2])
-                        IJ.setRawThreshold(green2, int(readsettings[0]), int(readsettings[1]), None)
-                        Prefs.blackBackground = True
-                        IJ.run(green2, "Convert to Mask", "")
-                        IJ.run(green2, "Invert LUT", "")
-                        if readsettings[7] != "0":
-                               IJ.run(green2, "Make Binary", "")
-                               IJ.run(green2, "Remove Outliers...", "radius="+readsettings[7]+" threshold=50 which=Dark")
-                    
-                    # CLAHE and background subtraction
-                    if readsettings[8] == "True":
-                        mpicbg.ij.clahe.Flat.getFastInstance().run(green, 127, 256, 3, None, False)
-                    if readsettings[9] == "True":
-                        calc = ImageCalculator()
-                        green = calc.run("Subtract create", green, red)
-                    elif readsettings[6] == "True":
-                        IJ.run(green, "Subtract Background...", "rolling=50")
-                    if readsettings[10] != "0":
-                    	IJ.run(green, "Subtract...", "value="+readsettings[10])
-                      
-                    # run frangi vesselness
-                    pixelwidth = str(green.getCalibration().pixelWidth)
-                    IJ.run(green,"Frangi Vesselness (imglib, experimental)",
-                          "number=1 minimum="+pixelwidth+" maximum="+pixelwidth)
-                    green = IJ.getImage()
-                    
-                    # convert frangi vesselness image to 8bit grey scale
-                    conv = ImageConverter(green)
-                    conv.convertToGray8()
-                    IJ.run(green, "Convert to Mask", "")
-                    
-                    # remove cell bodies
-                    if bg is True:
-                        green = ImageCalculator().run("Subtract create", green, green2)
-                    
-                    # run grey scale morphology filter from MorpholibJ
-                    if readsettings[11] != "0":
-                        green = green.getProcessor()
-                        algo = BoxDiagonalOpeningQueue()
-                        algo.setConnectivity(4)
-                        result = algo.process(green, int(readsettings[11]))
-                        green = ImagePlus("result", result)
-                    IJ.run(green, "Invert LUT", "")
-                    
-                    
-                    if len(readsettings) > 14:
-                        # sparse neurite image analysis
-                        if readsettings[15] == "True":                        
-                            IJ.run(red, "Enhance Local Contrast (CLAHE)", "blocksize=127 histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
-                        if readsettings[14] == "True":
-                            IJ.run(red, "Subtract Background...", "rolling=50")
-                        IJ.setAutoThreshold(red, readsettings[16])
-                        IJ.setRawThreshold(red, int(readsettings[17]), int(readsettings[18]), None)
-                        IJ.run(red, "Convert to Mask", "")
-                        IJ.run(red, "Invert LUT", "")
-                    else:
-                        # dense neurite image analysis
-                        IJ.run(red, "Normalize Local Contrast", "block_radius_x=40 block_radius_y=40 standard_deviations="+readsettings[12]+" center stretch")
-                        IJ.run(red, "Auto Threshold", "method=Default white")
-                        IJ.run(red, "Invert LUT", "")
-                    if readsettings[3] == "True":
-                            IJ.run(red, "Despeckle", "")
-                            
-                    IJ.saveAs(red, "Jpeg", settings2+name+"neurites")
-                    # get number of neurite pixels
-                    
-                    # get number of neurite pixels
-                    statsneurite = red.getProcessor()
-                    statsneurite = statsneurite.getHistogram()
-                    neuritedensity.append(statsneurite[255])
-                    IJ.saveAs(green, "Jpeg", settings2+name+"myelinFinal")
-                    
-                    # get number of myelin pixels
-                    statsmyelin = green.getProcessor()
-                    statsmyelin = statsmyelin.getHistogram()
-                    myelinoverlay.append(statsmyelin[255])
-                    closeallimages()
-                    
-                    # get pixel total of image
-                    whitepixels = (statsneurite[0])
-                    blackpixels = (statsneurite[255])
-                    
-            totalpixels = whitepixels + blackpixels
-            totalpixels = [totalpixels]*len(neuritedensity)
-            
-            # for each image calculate % myelination as number of myelin pixels
-            # divided by the number of neurite pixels * 100
-            myelinoverlay = [x1/x2*100 for (x1, x2) in zip(myelinoverlay, neuritedensity)]
-            myelinaverage = sum(myelinoverlay)/len(myelinoverlay)
-            myelinaverage2.append(myelinaverage)
-            
-            # for each image calculate % neurite density as neurite pixels divided
-            # by the total number of pixels in the image * 100.
-            neuritedensity = [x1/x2*100 for (x1, x2) in zip(neuritedensity, totalpixels)]
-            neuriteaverage = sum(neuritedensity)/len(neuritedensity)
-            neuriteaverage2.append(neuriteaverage)
-            name = "Image names"
-            green = "% myelination"
-            red = "% neurite density"
-            imagenames = [name]+imagenames
-            neuritedensity = [red]+neuritedensity
-            myelinoverlay = [green]+myelinoverlay
-            result = []
-            result.append(imagenames)
-            result.append(neuritedensity)
-            result.append(myelinoverlay)
-            
-            root = settings2
-            filename = "Results.csv"
-            fullpath = os.path.join(root, filename)
-            f = open(fullpath, 'wb')
-            writer = csv.writer(f)
-            for d in range(len(result)):
-                row = [result[d]]
-                writer.writerows(row)
-            f.close()
-            
-            # must be reset to 0 for each iteration.
-            y = 0
-            r = 0
-            
-            # if statistical analysis is being performed the results .csv file
-            # is also saved to a subfolder within the statistical analysis folder
-            # which denotes the experimental condition the results belong to.
-            if stats is True:
-                # nested for loop to identify correct experimental condition
-                # for the current subfolder being analysed.
-                for y in range(0, len(experiments)):
-                    for r in range(0, len(experiments[0])):
-                        if experiments[y][r] == subfoldernames[i]:
-                            if "Windows" in OS:
-                                root = imagefolder+"\\statistical analysis\\"+names[y].getText()
-                            elif "Mac" in OS:
-                                root = imagefolder+"/statistical analysis/"+names[y].getText()
-                            filename = subfoldernames[i]+".csv"
-                            fullpath = os.path.join(root, filename)
-                            f = open(fullpath, 'wb')
-                            writer = csv.writer(f)
-                            for e in range(len(result)):
-                                row = [result[e]]
-                                writer.writerows(row)
-                            f.close()
-            
-                            break
-            cwd2 = os.getcwd()
-            for files in os.listdir(cwd2):
-                    if files.endswith(".csv"):
-                        os.remove(os.path.join(cwd2, files))
-            imagenames = []
-            myelinoverlay = []
-            neuritedensity = []
-            
-        # create .csv summary sheet with average % neurite density
-        # and average % myelination for each subfolder (experiment).
-        if multi is True:
-            name = "Folder name"
-            imagenames = [name]+subfoldernames
-            neuritedensity = [red]+neuriteaverage2
-            myelinoverlay = [green]+myelinaverage2
-            result = []
-            result.append(imagenames)
-            result.append(neuritedensity)
-            result.append(myelinoverlay)
-            if "Windows" in OS:
-                root = imagefolder+"\\"
-            elif "Mac" in OS:
-                root = imagefolder+"/"
-            filename = "Result-Summary.csv"
-            fullpath = os.path.join(root, filename)
-            f = open(fullpath, 'wb')
-            writer = csv.writer(f)
-            for p in range(len(result)):
-                row = [result[p]]
-                writer.writerows(row)
-            f.close()
-            imagenames = []
-            myelinoverlay = []
-            neuritedensity = []
-            
-        # Run Rscript for statistical analysis via the command line
-        if stats is True:
-            cmd = Rloc2+" "+cwdR+" "+statsfolderPath
-            Runtime.getRuntime().exec(cmd)
+                results = [analysework(item) for item in work]
+        finally:
+            for archive in archives.values():
+                archive.close()
+
+        counts = [[] for i in range(len(subfoldernames))]
+        partial = []
+        for (position, i, settings2, fullpath), pixels in zip(work, results):
+            if pixels is None:
+                continue
+            myelinpixels, neuritepixels, totalpixels, quality, measures = pixels
+            counts[i].append((os.path.basename(fullpath), myelinpixels,
+                              neuritepixels, totalpixels, quality, measures))
+            partial.append((position, i, fullpath, myelinpixels, neuritepixels,
+                            totalpixels, quality, measures))
+
+        if shards is not None:
+            sharding.writepartial(imagefolder, shard, shards, partial)
+            return
+        # update the stage costs used to predict run time by preflight
+        import preflight
+        preflight.calibrate(cwd, timings, [row[2] for row in partial
+                                           if not row[6].startswith("skipped")],
+                            config.projection)
+
+        if progress is not None and progress.cancelled:
+            # partial results for the folders with analysed images
+            analysed = [i for i in range(len(subfoldernames)) if len(counts[i]) > 0]
+            finishfolders(imagefolder, False, experiments, multi, Rloc2,
+                          [subfoldernames[i] for i in analysed], names, statsfolderPath,
+                          cwdR, [counts[i] for i in analysed])
+            return
+
+        finishfolders(imagefolder, stats, experiments, multi, Rloc2, subfoldernames,
+                      names, statsfolderPath, cwdR, counts)
         Finished()
+
+
+def mergeshards(imagefolder, shards, stats, experiments, multi, Rloc2, subfoldernames, names, statsfolderPath, cwdR):
+        """ Merge partial results of a sharded analysis
+        Reads the partial result file of every shard and produces the
+        usual Results.csv for each folder, Result-Summary.csv and the
+        statistical analysis .csv files, as analyse would have.
+        Parameters as for analyse.
+        Raises
+        ------
+        IOError if the partial result of any shard is missing.
+        """
+        counts = [[] for i in range(len(subfoldernames))]
+        for position, i, fullpath, myelinpixels, neuritepixels, totalpixels, quality, measures in sharding.readpartials(imagefolder, shards):
+            counts[i].append((os.path.basename(fullpath), myelinpixels,
+                              neuritepixels, totalpixels, quality, measures))
+        finishfolders(imagefolder, stats, experiments, multi, Rloc2, subfoldernames,
+                      names, statsfolderPath, cwdR, counts)
@@ -0,0 +1,226 @@
+""" Automatic tuning of user settings for MyelinJ_.py
+
+Searches the space of user settings to maximise the Dice coefficient
+between the myelin and neurite masks produced by MyelinJ and hand
+annotated masks of a reference set of images. The upstream stages
+(decoding, CLAHE, background subtraction and frangi vesselness) are run
+once for each combination of CLAHE and background setting and cached,
+candidate settings are then evaluated in parallel. The best settings
+are saved as a normal user name .csv file.
+
+Annotated masks are .tif (or .png) images in an annotation folder named
+after the image they annotate, e.g. for "field1.tif" the masks are
+"field1_myelin.tif" and "field1_neurites.tif". Any non-zero pixel is
+foreground.
+
+"""
+
+from __future__ import with_statement, division
+import os
+import random
+import jarray
+from ij import IJ
+from ij.process import Blitter
+import stages
+import sweep
+import thresholdexplorer
+import workers
+import MyelinJanalysis
+import profiles
+
+# candidate values for each setting searched
+radii = ("0", "2", "5", "10")
+greyscaleMinVals = ("0", "5", "10", "20", "40")
+contrasts = ("0.5", "1", "2", "3", "5")
+CLAHEs = ("False", "True")
+# background subtraction: none, rolling ball or neurite subtraction
+backgrounds = (("False", "False"), ("True", "False"), ("False", "True"))
+
+binarylut = jarray.array([0] + [255] * 255, 'i')
+
+
+def findannotation(annotationfolder, imagepath, kind):
+    """ Path to the annotated mask of kind ("myelin" or "neurites")
+    Returns None if the image has not been annotated.
+    """
+    name = os.path.splitext(os.path.basename(imagepath))[0]
+    for extension in (".tif", ".png"):
+        fullpath = os.path.join(annotationfolder, name+"_"+kind+extension)
+        if os.path.exists(fullpath):
+            return fullpath
+    return None
+
+
+def openannotation(fullpath):
+    """ Open an annotated mask as an 8bit processor with values 0 and 255
+    """
+    imp = IJ.openImage(fullpath)
+    ip = imp.getProcessor().convertToByte(False)
+    ip.applyTable(binarylut)
+    return ip
+
+
+def dice(mask, annotation):
+    """ Dice coefficient of two masks with values 0 and 255
+    Parameters
+    ----------
+    mask: ImagePlus
+        mask produced by MyelinJ.
+    annotation: ImageProcessor
+        annotated mask.
+    """
+    ip = mask.getProcessor()
+    both = stages.pool.copy(ip)
+    both.copyBits(annotation, 0, 0, Blitter.AND)
+    overlap = both.getHistogram()[255]
+    stages.pool.release(both)
+    total = ip.getHistogram()[255] + annotation.getHistogram()[255]
+    if total == 0:
+        return 1.0
+    return 2 * overlap / total
+
+
+def thresholdlimits(greens):
+    """ Candidate cell body thresholds
+    For each threshold method the lower limit is the median threshold
+    level of the method over the reference images, the upper limit is 255.
+    Min and Max of 0 do not remove cell bodies.
+    Returns
+    -------
+    limits: list of (string, string, string)
+        threshChoice, Min and Max.
+    """
+    levels = [thresholdexplorer.allthresholds(green.getProcessor().getHistogram())
+              for green in greens]
+    limits = [("Default", "0", "0")]
+    for m in range(len(thresholdexplorer.methods)):
+        method = thresholdexplorer.methods[m]
+        values = sorted([image[m][1] for image in levels])
+        level = values[len(values) // 2]
+        if 0 <= level < 255:
+            limits.append((method, str(level + 1), "255"))
+    return limits
+
+
+def makesettings(base, candidate):
+    """ User settings for a candidate
+    Parameters
+    ----------
+    base: list of strings
+        user settings providing channels, despeckle and pixel subtraction,
+        and for sparse neurite settings the sparse neurite settings,
+        which are kept as they are.
+    candidate: tuple
+        (threshold limits, radius, greyscaleMinVal, contrast, CLAHE,
+        background).
+    Returns
+    -------
+    readsettings: list of strings
+        user settings, sparse neurite settings if base is.
+    """
+    (method, Min, Max), radius, greyscale, contrast, clahe, background = candidate
+    cellbodycb = str(Min != "0" or Max != "0")
+    if cellbodycb == "False":
+        radius = "0"
+    if len(base) > 14:
+        # the NLC standard deviation is not used for sparse neurites
+        contrast = base[12]
+    return [Min, Max, method, base[3], base[4], base[5], background[0],
+            radius, clahe, background[1], base[10], greyscale, contrast,
+            cellbodycb] + list(base[14:])
+
+
+def tune(base, imagepaths, annotationfolder, candidates=200, seed=0, threads=None,
+         cache=None):
+    """ Search user settings maximising Dice against annotated masks
+    A random search over the settings is followed by one pass of
+    coordinate refinement around the best candidate.
+    Parameters
+    ----------
+    base: list of strings
+        user settings providing channels, despeckle and pixel subtraction.
+    imagepaths: list of strings
+        .tif images, only those with annotated masks are used.
+    annotationfolder: string
+        folder of annotated masks.
+    candidates: int
+        number of random candidates.
+    seed: int
+        seed for the random search, so that tuning is repeatable.
+    threads: int
+        number of worker threads, defaults to the number of processors.
+    cache: FrangiCache
+        disk cache of vesselness images or None.
+    Returns
+    -------
+    readsettings: list of strings
+        best user settings.
+    score: float
+        mean Dice of the myelin and neurite masks for the best settings.
+    """
+    reference = []
+    for path in imagepaths:
+        myelin = findannotation(annotationfolder, path, "myelin")
+        neurites = findannotation(annotationfolder, path, "neurites")
+        if myelin is not None and neurites is not None:
+            reference.append((path, openannotation(myelin), openannotation(neurites)))
+    if len(reference) == 0:
+        raise ValueError("no annotated images found in "+annotationfolder)
+
+    # upstream stages for each combination of CLAHE and background subtraction
+    upstreams = {}
+    for clahe in CLAHEs:
+        for background in backgrounds:
+            settings = makesettings(base, (("Default", "0", "0"), "0", "0",
+                                           "0.5", clahe, background))
+            upstreams[(clahe, background)] = [sweep.upstream(path, settings, cache)
+                                              for (path, m, n) in reference]
+
+    limits = thresholdlimits([images["green"] for images in upstreams[(CLAHEs[0], backgrounds[0])]])
+    # sparse neurite settings do not use the NLC standard deviation
+    space = [limits, radii, greyscaleMinVals, contrasts if len(base) <= 14 else (base[12],),
+             CLAHEs, backgrounds]
+
+    def evaluate(candidate):
+        settings = makesettings(base, candidate)
+        total = 0
+        for images, (path, myelin, neurites) in zip(upstreams[(candidate[4], candidate[5])], reference):
+            cellbodies = stages.cellbodymask(images["green"], settings)
+            vesselness = stages.duplicate(images["vesselness"])
+            buffer = vesselness.getProcessor()
+            green = stages.myelinmask(vesselness, cellbodies, settings)
+            red = stages.neuritemask(stages.duplicate(images["red"]), settings)
+            total = total + (dice(green, myelin) + dice(red, neurites)) / 2
+            stages.pool.release(buffer)
+            stages.release(cellbodies, red)
+        return total / len(reference)
+
+    generator = random.Random(seed)
+    tried = []
+    for i in range(candidates):
+        candidate = tuple([generator.choice(values) for values in space])
+        if candidate not in tried:
+            tried.append(candidate)
+    scores = workers.parallelmap(evaluate, tried, threads)
+    best = max(zip(scores, tried))
+
+    # coordinate refinement: vary one setting at a time around the best
+    for position in range(len(space)):
+        neighbours = []
+        for value in space[position]:
+            candidate = list(best[1])
+            candidate[position] = value
+            if tuple(candidate) not in tried:
+                neighbours.append(tuple(candidate))
+        if len(neighbours) > 0:
+            scores = workers.parallelmap(evaluate, neighbours, threads)
+            tried.extend(neighbours)
+            best = max([best] + list(zip(scores, neighbours)))
+
+    return makesettings(base, best[1]), best[0]
+
+
+def saveprofile(cwd, user, readsettings):
+    """ Save tuned settings as a user name .csv file
+    """
+    MyelinJanalysis.writesettings(profiles.path(cwd, user, create=True), readsettings)
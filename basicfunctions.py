@@ -1,7 +1,11 @@
 
+import sys
 from ij import IJ, WindowManager
 from ij.gui import ImageWindow
 w = WindowManager
+# modules only imported once they are used, listed by startupreport if
+# starting MyelinJ imported them anyway
+lazymodules = ("preflight", "sweep", "autotune", "thresholdexplorer", "mpicbg", "inra")
 
 def closeimage():
         """
@@ -112,3 +116,26 @@ def bgTitle2():
     """
     g = IJ.getImage()
     g.setTitle("original + cell body selection")
+
+
+def startupreport(startup):
+    """ Time taken by each step of starting MyelinJ
+    Parameters
+    ----------
+    startup: list of (string, float)
+        name of each step and the time it finished, after ("start",
+        time started).
+    Returns
+    -------
+    report: string
+        one line per step and the total, in seconds, and the lazily
+        imported modules (lazymodules) that have been imported.
+    """
+    lines = ["MyelinJ startup:"]
+    for (name, finished), (previous, started) in zip(startup[1:], startup[:-1]):
+        lines.append("  %s: %.3f s" % (name, finished - started))
+    lines.append("  total: %.3f s" % (startup[-1][1] - startup[0][1]))
+    loaded = [lazy for lazy in lazymodules
+              if [name for name in sys.modules if name == lazy or name.startswith(lazy+".")]]
+    lines.append("  on-demand modules already loaded: "+(", ".join(loaded) or "none"))
+    return "\n".join(lines)
@@ -0,0 +1,115 @@
+""" Reusable pixel buffers for MyelinJ
+
+Processing one image after another allocates the same sized buffers
+for every image (duplicates for the cell body mask, images created by
+the ImageCalculator etc.), so long runs spend much of their time in
+garbage collection. A BufferPool keeps released image processors keyed
+by dimensions and bit depth and hands them out again, and the in-place
+functions below replace the steps that created new images.
+
+"""
+
+from __future__ import with_statement
+import threading
+import jarray
+from ij.process import Blitter, ByteProcessor, ShortProcessor, FloatProcessor
+from java.lang import System
+
+
+class BufferPool(object):
+    """ Pool of image processors keyed by width, height and bit depth
+
+    Safe to share between worker threads.
+    Attributes
+    ----------
+    limit: int
+        maximum number of free buffers kept for each key.
+    """
+
+    def __init__(self, limit=8):
+        self.limit = limit
+        self.free = {}
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self, width, height, bitdepth=8):
+        """ Get a processor, reusing a released one if possible
+        The contents of a reused processor are not cleared.
+        """
+        key = (width, height, bitdepth)
+        with self.lock:
+            buffers = self.free.get(key)
+            if buffers:
+                ip = buffers.pop()
+                if ip.isInvertedLut():
+                    ip.invertLut()
+                ip.resetRoi()
+                return ip
+            self.allocated = self.allocated + 1
+        if bitdepth == 8:
+            return ByteProcessor(width, height)
+        elif bitdepth == 16:
+            return ShortProcessor(width, height)
+        elif bitdepth == 32:
+            return FloatProcessor(width, height)
+        raise ValueError("unsupported bit depth: "+str(bitdepth))
+
+    def release(self, ip):
+        """ Return a processor to the pool
+        The processor must no longer be used by the caller.
+        """
+        if ip is None:
+            return
+        key = (ip.getWidth(), ip.getHeight(), ip.getBitDepth())
+        with self.lock:
+            buffers = self.free.setdefault(key, [])
+            if len(buffers) < self.limit:
+                buffers.append(ip)
+
+    def copy(self, ip):
+        """ Pooled duplicate of a processor
+        """
+        target = self.acquire(ip.getWidth(), ip.getHeight(), ip.getBitDepth())
+        System.arraycopy(ip.getPixels(), 0, target.getPixels(), 0,
+                         ip.getWidth() * ip.getHeight())
+        if ip.isInvertedLut():
+            target.invertLut()
+        return target
+
+    def clear(self):
+        with self.lock:
+            self.free = {}
+
+
+def subtract(target, other):
+    """ In-place version of ImageCalculator "Subtract create"
+    target = target - other, clamped at 0 for 8bit images.
+    Parameters
+    ----------
+    target: ImagePlus
+        image that is changed.
+    other: ImagePlus
+        image subtracted.
+    """
+    target.getProcessor().copyBits(other.getProcessor(), 0, 0, Blitter.SUBTRACT)
+
+
+def thresholdlut(lower, upper):
+    """ Lookup table giving 255 for pixels between lower and upper
+    """
+    return jarray.array([255 if lower <= i <= upper else 0 for i in range(256)], 'i')
+
+
+def threshold(imp, lower, upper):
+    """ In-place threshold of an 8bit image to a mask
+    Same result as IJ.setRawThreshold followed by "Convert to Mask" with
+    black background: pixels between lower and upper become 255, all
+    others 0.
+    """
+    imp.getProcessor().applyTable(thresholdlut(lower, upper))
+
+
+def invertlut(imp):
+    """ In-place version of "Invert LUT"
+    """
+    imp.getProcessor().invertLut()
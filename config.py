@@ -32,6 +32,9 @@ newuser = False
 user = ""
 multi = False
 stats = False
+sweep = False
+tune = False
+dryrun = False
 subfoldernames = list()
 width1 = 500
 height1 = 200
@@ -45,3 +48,44 @@ frangicb = False
 Sbgcbstate = False
 greyscaleMinVal = "0"
 names = ""
+# byte budget for the frangi vesselness disk cache, which is kept in the
+# MyelinJ folder; 0 disables the cache (e.g. 512 * 1024 * 1024 enables it)
+frangicachebytes = 0
+# number of images analysed at once and the fraction of the Java heap
+# their estimated working sets may use (see scheduler.py)
+threads = 1
+memoryfraction = 0.6
+# open, analyse and save images at the same time, with at most
+# queuedepth images waiting between stages (see pipeline.py). Off by
+# default: images are then opened and saved while others are analysed,
+# and the memory scheduler (memoryfraction) is not used.
+pipeline = False
+queuedepth = 2
+# most fields of the same size analysed as one batch by engine.py, within
+# the memory budget (see stackbatch.py), 1 analyses fields one at a time
+maxbatch = 16
+# z-stacks and time-lapse images: "max" or "mean" projection, or
+# "planes" to analyse every plane (see hyperstack.py)
+projection = "max"
+# quality gate for blank, out of focus and saturated fields: "off",
+# "flag" or "skip", and its limits (see qualitygate.py)
+qualitygate = "flag"
+minfocus = 2.0
+mincoverage = 0.005
+maxsaturation = 0.1
+# width of the downsampled image used by live previews (see preview.py)
+previewwidth = 1024
+# seconds a dialog action waits before it is run, so a burst of changes
+# to one setting is run once (see dialogexecutor.py)
+debounce = 0.15
+# save the final masks of each folder in a bit-packed archive, so results
+# can be recalculated without reanalysing (see maskarchive.py)
+maskarchive = True
+# radius in pixels the neurite mask is dilated by before myelin on
+# neurites is counted for % colocalised myelination (see metrics.py)
+colocalisationtolerance = 0
+# folder within the MyelinJ folder where user names are saved (see
+# profiles.py)
+profilesfolder = "profiles"
+# log the time taken by each step of starting MyelinJ
+startupreport = False
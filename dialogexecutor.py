@@ -0,0 +1,198 @@
+""" Background execution of dialog actions
+
+Image processing started from the dialogs (CLAHE, thresholds, frangi,
+previews etc.) is run on a single background thread rather than in the
+Swing event dispatch thread, so the dialogs stay responsive. Actions are
+run in the order they are submitted, because most of them work on the
+image displayed by the action before.
+
+Actions submitted with a key are debounced and superseded: an action is
+started after a short delay and only if no newer action with the same
+key has been submitted in the meantime, so a burst of changes to one
+setting runs once with the latest value. A long running action can
+check stale() between steps and give up once it has been superseded.
+Results are published in the event dispatch thread, and only for the
+latest action of each key. Functions waiting for the executor to become
+idle (e.g. to reset a wait cursor) are called in the event dispatch
+thread whenever the last outstanding action finishes or is cancelled,
+whoever submitted it.
+
+"""
+
+from __future__ import with_statement
+import threading
+from java.lang import Runnable, Throwable
+from java.util.concurrent import Executors, TimeUnit
+from javax.swing import SwingUtilities
+from ij import IJ
+from workers import Daemon
+
+
+class Action(Runnable):
+    """ An action submitted to a DialogExecutor
+    """
+
+    def __init__(self, executor, fn, key, generation, publish):
+        self.executor = executor
+        self.fn = fn
+        self.key = key
+        self.generation = generation
+        self.publish = publish
+
+    def run(self):
+        self.executor.execute(self)
+
+
+class Publish(Runnable):
+    """ Pass the result of an action to its publish function in the event
+    dispatch thread, unless a newer action with the same key exists
+    """
+
+    def __init__(self, action, result):
+        self.action = action
+        self.result = result
+
+    def run(self):
+        if self.action.executor.current(self.action):
+            self.action.publish(self.result)
+
+
+class Call(Runnable):
+    """ Call a function without arguments, for SwingUtilities.invokeLater
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def run(self):
+        self.fn()
+
+
+class DialogExecutor(object):
+    """ Runs dialog actions in order on one background thread
+    Attributes
+    ----------
+    delay: float
+        seconds an action waits before it is started (debouncing).
+    generations: dictionary
+        number of actions submitted for each key, an action is only run
+        (and its result published) if it is the latest for its key.
+    outstanding: int
+        actions submitted that have not finished or been cancelled.
+    waiting: list of functions
+        called when outstanding drops to 0, see whenidle.
+    """
+
+    def __init__(self, delay=0.15, name="MyelinJ dialog"):
+        self.delay = delay
+        self.pool = Executors.newSingleThreadScheduledExecutor(Daemon(name))
+        self.lock = threading.RLock()
+        self.generations = {}
+        self.queued = {}
+        self.outstanding = 0
+        self.waiting = []
+        self.running = None
+
+    def submit(self, fn, key=None, publish=None):
+        """ Run fn in the background
+        Parameters
+        ----------
+        fn: function
+            action taking no arguments.
+        key: string
+            actions with the same key supersede each other: queued older
+            actions are cancelled and a running older action is stale.
+            Actions without a key are always run.
+        publish: function
+            called in the event dispatch thread with the result of fn
+            (None if it failed) if the action is still the latest.
+        """
+        with self.lock:
+            # counted before an older action is cancelled, so the executor
+            # does not become idle in between
+            self.outstanding = self.outstanding + 1
+            generation = self.supersede(key)
+            action = Action(self, fn, key, generation, publish)
+            # all actions have the same delay so they are run in order
+            future = self.pool.schedule(action, int(self.delay * 1000), TimeUnit.MILLISECONDS)
+            if key is not None:
+                self.queued[key] = (generation, future)
+
+    def supersede(self, key):
+        """ Make any submitted action with key stale
+        Returns
+        -------
+        generation: int
+            generation of the next action with key.
+        """
+        with self.lock:
+            if key is None:
+                return 0
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            if key in self.queued and self.queued.pop(key)[1].cancel(False):
+                self.finished()
+            return generation
+
+    def current(self, action):
+        """ True unless a newer action with the same key has been submitted
+        """
+        if action.key is None:
+            return True
+        with self.lock:
+            return self.generations.get(action.key) == action.generation
+
+    def stale(self):
+        """ True if the running action has been superseded
+        For long actions to check between steps.
+        """
+        action = self.running
+        return action is not None and not self.current(action)
+
+    def idle(self):
+        """ True when no actions are queued or running
+        """
+        return self.outstanding == 0
+
+    def whenidle(self, fn):
+        """ Call fn in the event dispatch thread once no actions are queued
+        or running, straight away if the executor is idle
+        """
+        with self.lock:
+            if self.outstanding > 0:
+                self.waiting.append(fn)
+                return
+        SwingUtilities.invokeLater(Call(fn))
+
+    def finished(self):
+        """ Count an action as finished or cancelled
+        """
+        with self.lock:
+            self.outstanding = self.outstanding - 1
+            if self.outstanding > 0:
+                return
+            waiting = self.waiting
+            self.waiting = []
+        for fn in waiting:
+            SwingUtilities.invokeLater(Call(fn))
+
+    def execute(self, action):
+        with self.lock:
+            if action.key in self.queued and self.queued[action.key][0] == action.generation:
+                del self.queued[action.key]
+        result = None
+        try:
+            if self.current(action):
+                self.running = action
+                try:
+                    result = action.fn()
+                except (Exception, Throwable) as error:
+                    IJ.log("MyelinJ: "+str(error))
+        finally:
+            self.running = None
+            self.finished()
+        if action.publish is not None and self.current(action):
+            SwingUtilities.invokeLater(Publish(action, result))
+
+    def shutdown(self):
+        self.pool.shutdownNow()
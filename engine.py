@@ -0,0 +1,326 @@
+""" Analysis of images from python scripts, without dialogs
+
+MyelinJanalysis.analyse is driven by the dialogs: it reads a user name
+from the MyelinJ folder, saves .jpg images, Results.csv and statistics
+and shows a dialog when it has finished. This module runs the same
+stages (quality gate, cell bodies, CLAHE and background subtraction,
+frangi, myelin and neurite masks and the measures of metrics.py) for
+scripts, notebooks and other tools run in Fiji:
+
+    import engine
+    settings = engine.settings("/path/to/MyelinJ-master/alice.csv")
+    result = engine.analyseimage(myelin, neurites, settings)
+    for result in engine.analysebatch(paths, settings, threads=4):
+        print(result.name, result.myelination())
+
+analyseimage does not change its channels or save anything, the masks
+are returned with the result. analysebatch analyses images of the same
+size in batches (see stackbatch.py) and yields results as batches
+finish, which with more than one thread is not the order of paths.
+
+"""
+
+from __future__ import division
+import os
+from java.lang import Runtime
+from java.util.concurrent import ExecutorCompletionService
+from ij import IJ
+import MyelinJanalysis
+import config
+import hyperstack
+import metrics
+import profiles
+import stackbatch
+import stages
+import workers
+
+
+class Result(object):
+    """ Result of the analysis of one image or plane
+    Attributes
+    ----------
+    name: string
+        image name (with the plane for planes of z-stacks), None for
+        analyseimage.
+    path: string
+        .tif image, None for analyseimage.
+    myelinpixels, neuritepixels, totalpixels: int
+        number of myelin and neurite pixels and pixel total, 0 if
+        skipped.
+    quality: string
+        "" or the reason the field was flagged or skipped by the quality
+        gate.
+    measures: dictionary
+        measures of the final masks by name, see metrics.py.
+    myelin, neurites: ImageProcessor
+        final 8bit masks, foreground 255, None if skipped or not kept.
+    """
+
+    def __init__(self, myelinpixels, neuritepixels, totalpixels, quality, measures,
+                 myelin=None, neurites=None, name=None, path=None):
+        self.name = name
+        self.path = path
+        self.myelinpixels = myelinpixels
+        self.neuritepixels = neuritepixels
+        self.totalpixels = totalpixels
+        self.quality = quality
+        self.measures = dict(zip(metrics.names, measures))
+        self.myelin = myelin
+        self.neurites = neurites
+
+    def skipped(self):
+        return self.quality.startswith("skipped")
+
+    def myelination(self):
+        """ % myelination, None if skipped
+        """
+        if self.skipped():
+            return None
+        return self.myelinpixels/self.neuritepixels*100 if self.neuritepixels else 0
+
+    def neuritedensity(self):
+        """ % neurite density, None if skipped
+        """
+        if self.skipped():
+            return None
+        return self.neuritepixels/self.totalpixels*100 if self.totalpixels else 0
+
+    def counts(self):
+        """ Pixel counts, quality and measures as a tuple, in the order of
+        the counts rows of MyelinJanalysis.finishfolders
+        """
+        return (self.name, self.myelinpixels, self.neuritepixels, self.totalpixels,
+                self.quality, tuple([self.measures[name] for name in metrics.names]))
+
+
+def settings(profile):
+    """ User settings from a saved user name .csv or .json file
+    The file is read once, see profiles.registry.
+    Parameters
+    ----------
+    profile: string or list
+        path to the .csv file saved by MyelinJ or to a .json profile,
+        or user settings already read (returned as they are).
+    Returns
+    -------
+    readsettings: list of strings
+        user settings, see MyelinJanalysis.getsettings.
+    """
+    if isinstance(profile, (list, tuple)):
+        return list(profile)
+    return profiles.registry.get(profile).aslist()
+
+
+def analyseimage(myelin, neurites, readsettings, cache=None, keepmasks=True, timings=None):
+    """ Analyse a myelin and a neurite channel
+    Parameters
+    ----------
+    myelin, neurites: ImagePlus
+        8bit myelin and neurite channels, not changed.
+    readsettings: list of strings or string
+        user settings or a user name .csv file, see settings.
+    cache: FrangiCache
+        frangi vesselness disk cache or None.
+    keepmasks: bool
+        return the final masks with the result, otherwise their buffers
+        are released to stages.pool.
+    timings: dictionary
+        seconds spent in each stage are added to it, or None.
+    Returns
+    -------
+    result: Result
+    """
+    return analysefield(stages.duplicate(myelin), stages.duplicate(neurites),
+                        settings(readsettings), cache, keepmasks,
+                        MyelinJanalysis.stopwatch(timings))
+
+
+def analysefield(green, red, readsettings, cache, keepmasks, timed):
+    """ Analyse a myelin and a neurite channel in place, see analyseimage
+    """
+    quality = MyelinJanalysis.checkquality(green, red, timed)
+    if quality.startswith("skipped"):
+        stages.release(green, red)
+        return Result(0, 0, 0, quality, metrics.empty())
+    green, red = MyelinJanalysis.finalmasks(green, red, readsettings, cache, timed)
+    return measured(green, red, quality, keepmasks, timed)
+
+
+def measured(green, red, quality, keepmasks, timed):
+    """ Result of the final masks of a field
+    """
+    myelinpixels, neuritepixels, totalpixels, measures = \
+        MyelinJanalysis.measuremasks(green, red)[:4]
+    timed("metrics")
+    if keepmasks is False:
+        stages.release(green, red)
+        return Result(myelinpixels, neuritepixels, totalpixels, quality, measures)
+    return Result(myelinpixels, neuritepixels, totalpixels, quality, measures,
+                  green.getProcessor(), red.getProcessor())
+
+
+def fields(fullpath, g, r):
+    """ Channels of each field of an image
+    Z-stacks and time-lapse images are projected or split into planes as
+    set by config.projection, as MyelinJanalysis.analyseimage does.
+    Yields
+    ------
+    name: string
+        image name, with the plane for planes of z-stacks.
+    green, red: ImagePlus
+        8bit myelin and neurite channels.
+    """
+    name = os.path.basename(fullpath)
+    if not MyelinJanalysis.ishyperstack(fullpath):
+        green, red = stages.splitchannels(IJ.openImage(fullpath), g, r)
+        yield name, green, red
+    elif config.projection in ("max", "mean"):
+        green, red = hyperstack.projection(hyperstack.openvirtual(fullpath), g, r,
+                                           config.projection)
+        yield name, green, red
+    else:
+        for z, t, green, red in hyperstack.planes(hyperstack.openvirtual(fullpath), g, r):
+            yield name+"-z%d-t%d" % (z, t), green, red
+
+
+def analysepath(fullpath, readsettings, cache, keepmasks, timings):
+    """ Results of every field of an image, see fields
+    """
+    timed = MyelinJanalysis.stopwatch(timings)
+    results = []
+    for name, green, red in fields(fullpath, int(readsettings[4]), int(readsettings[5])):
+        timed("open")
+        result = analysefield(green, red, readsettings, cache, keepmasks, timed)
+        result.name = name
+        result.path = fullpath
+        results.append(result)
+    return results
+
+
+def analysegroup(paths, readsettings, cache, keepmasks, timings):
+    """ Results of a batch of images of the same size, see stackbatch.py
+    A batch of one image is analysed by analysepath.
+    """
+    if len(paths) == 1:
+        return analysepath(paths[0], readsettings, cache, keepmasks, timings)
+    timed = MyelinJanalysis.stopwatch(timings)
+    g = int(readsettings[4])
+    r = int(readsettings[5])
+    results = []
+    kept = []
+    for fullpath in paths:
+        green, red = stages.splitchannels(IJ.openImage(fullpath), g, r)
+        timed("open")
+        quality = MyelinJanalysis.checkquality(green, red, timed)
+        result = Result(0, 0, 0, quality, metrics.empty(), name=os.path.basename(fullpath),
+                        path=fullpath)
+        if result.skipped():
+            stages.release(green, red)
+        else:
+            kept.append((len(results), quality, green, red))
+        results.append(result)
+    if kept:
+        masks = stackbatch.finalmasks([k[2] for k in kept], [k[3] for k in kept],
+                                      readsettings, cache, timed)
+        for (x, quality), (green, red) in zip([k[:2] for k in kept], masks):
+            result = measured(green, red, quality, keepmasks, timed)
+            result.name = results[x].name
+            result.path = results[x].path
+            results[x] = result
+    return results
+
+
+def perimage(results):
+    """ One result per image
+    The results of the planes of a z-stack or time-lapse image analysed
+    by plane are added up as MyelinJanalysis.analyseimage does (see
+    MyelinJanalysis.sumplanes), other results are kept as they are.
+    Parameters
+    ----------
+    results: list of Result
+        results of analysebatch.
+    Returns
+    -------
+    results: list of Result
+        in the order each image first appears in results.
+    """
+    order = []
+    planes = {}
+    for result in results:
+        if result.path not in planes:
+            order.append(result.path)
+            planes[result.path] = []
+        planes[result.path].append(result)
+    combined = []
+    for path in order:
+        name = os.path.basename(path)
+        group = planes[path]
+        if len(group) == 1 and group[0].name == name:
+            combined.append(group[0])
+            continue
+        m, n, t, quality, measures = MyelinJanalysis.sumplanes(
+            [(r.myelinpixels, r.neuritepixels, r.totalpixels, r.quality,
+              tuple([r.measures[x] for x in metrics.names])) for r in group])
+        combined.append(Result(m, n, t, quality, measures, name=name, path=path))
+    return combined
+
+
+def analysebatch(paths, readsettings, threads=1, cache=None, keepmasks=False, timings=None,
+                 maxbatch=None):
+    """ Analyse .tif images, yielding results as images finish
+    Images of the same size are analysed in batches (see stackbatch.py)
+    whose size fits in config.memoryfraction of the Java heap.
+    Parameters
+    ----------
+    paths: list of strings
+        .tif images.
+    readsettings: list of strings or string
+        user settings or a user name .csv file, see settings.
+    threads: int
+        number of batches analysed at once. At most twice as many
+        batches are started as there are threads, so memory use stays
+        bounded however long paths is.
+    cache: FrangiCache
+        frangi vesselness disk cache or None.
+    keepmasks: bool
+        keep the final masks with each result.
+    timings: dictionary
+        seconds spent in each stage are added to it, or None.
+    maxbatch: int
+        maximum number of images of a batch, defaults to config.maxbatch.
+    Yields
+    ------
+    result: Result
+        one for each image, or for each plane of z-stacks analysed by
+        plane.
+    """
+    readsettings = settings(readsettings)
+    if maxbatch is None:
+        maxbatch = config.maxbatch
+    threads = max(threads, 1)
+    inflight = 1 if threads == 1 else 2 * threads
+    budget = Runtime.getRuntime().maxMemory() * config.memoryfraction / inflight
+    groups = stackbatch.batches(paths, budget, maxbatch)
+    if threads == 1:
+        for group in groups:
+            for result in analysegroup(group, readsettings, cache, keepmasks, timings):
+                yield result
+        return
+    completion = ExecutorCompletionService(workers.sharedpool(threads))
+    futures = []
+    try:
+        groups.reverse()
+        running = 0
+        while groups or running:
+            while groups and running < inflight:
+                futures.append(completion.submit(workers.Task(
+                    analysegroup, (groups.pop(), readsettings, cache, keepmasks, timings))))
+                running = running + 1
+            results = completion.take().get()
+            running = running - 1
+            for result in results:
+                yield result
+    finally:
+        # stop batches still running if the caller stops early
+        for future in futures:
+            future.cancel(True)
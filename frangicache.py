@@ -0,0 +1,157 @@
+""" Disk cache of frangi vesselness images
+
+Frangi vesselness is the most expensive stage of the analysis and its
+output depends only on the processed myelin channel (after CLAHE,
+background and pixel subtraction) and the scale. Vesselness images are
+saved compressed in a cache folder, keyed by a hash of the processed
+myelin channel pixels and the scale, so re-analysis with different
+downstream settings (cell body threshold, grey scale filter, neurite
+settings) does not rerun frangi. The total size of the cache is kept
+under a byte budget by deleting the least recently used files.
+
+"""
+
+from __future__ import with_statement
+import os
+import threading
+import jarray
+from ij import ImagePlus
+from ij.process import FloatProcessor
+from java.io import BufferedInputStream, BufferedOutputStream, \
+                    DataInputStream, DataOutputStream, \
+                    FileInputStream, FileOutputStream
+from java.lang import String
+from java.nio import ByteBuffer
+from java.security import MessageDigest
+from java.util.zip import GZIPInputStream, GZIPOutputStream
+
+# changed if the cached format or the frangi settings change
+version = "2"
+extension = ".frangi.gz"
+
+
+class FrangiCache(object):
+    """ Size bounded, least recently used cache of vesselness images
+    Attributes
+    ----------
+    folder: string
+        folder containing cached files.
+    maxbytes: int
+        byte budget for all cached files.
+    """
+
+    def __init__(self, folder, maxbytes):
+        self.folder = folder
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def key(self, green):
+        """ Hash of the processed myelin channel and frangi scale
+        Parameters
+        ----------
+        green: ImagePlus
+            8bit myelin channel, as passed to frangi vesselness.
+        """
+        ip = green.getProcessor()
+        digest = MessageDigest.getInstance("SHA-1")
+        digest.update(String(version+" "+str(ip.getWidth())+" "+str(ip.getHeight())+" "
+                             + str(green.getCalibration().pixelWidth)).getBytes("US-ASCII"))
+        digest.update(ip.getPixels())
+        return "".join(["%02x" % (b & 0xff) for b in digest.digest()])
+
+    def path(self, key):
+        return os.path.join(self.folder, key+extension)
+
+    def get(self, key, calibration=None):
+        """ Cached vesselness image or None
+        A hit marks the file as recently used.
+        """
+        fullpath = self.path(key)
+        if not os.path.exists(fullpath):
+            self.misses = self.misses + 1
+            return None
+        try:
+            stream = DataInputStream(GZIPInputStream(BufferedInputStream(FileInputStream(fullpath))))
+            try:
+                width = stream.readInt()
+                height = stream.readInt()
+                displaymin = stream.readDouble()
+                displaymax = stream.readDouble()
+                data = jarray.zeros(width * height * 4, 'b')
+                stream.readFully(data)
+            finally:
+                stream.close()
+        except Exception:
+            # truncated or corrupt file
+            self.remove(fullpath)
+            self.misses = self.misses + 1
+            return None
+        fp = FloatProcessor(width, height)
+        ByteBuffer.wrap(data).asFloatBuffer().get(fp.getPixels())
+        fp.setMinAndMax(displaymin, displaymax)
+        os.utime(fullpath, None)
+        self.hits = self.hits + 1
+        vesselness = ImagePlus("vesselness", fp)
+        if calibration is not None:
+            vesselness.setCalibration(calibration)
+        return vesselness
+
+    def put(self, key, vesselness):
+        """ Save a vesselness image and evict old files over the budget
+        """
+        ip = vesselness.getProcessor()
+        width = ip.getWidth()
+        height = ip.getHeight()
+        data = ByteBuffer.allocate(width * height * 4)
+        data.asFloatBuffer().put(ip.getPixels())
+        fullpath = self.path(key)
+        temporary = fullpath+"."+str(threading.currentThread().getName())+".tmp"
+        stream = DataOutputStream(GZIPOutputStream(BufferedOutputStream(FileOutputStream(temporary))))
+        try:
+            stream.writeInt(width)
+            stream.writeInt(height)
+            stream.writeDouble(ip.getMin())
+            stream.writeDouble(ip.getMax())
+            stream.write(data.array())
+        finally:
+            stream.close()
+        with self.lock:
+            if os.path.exists(fullpath):
+                os.remove(temporary)
+            else:
+                os.rename(temporary, fullpath)
+            self.evict()
+
+    def remove(self, fullpath):
+        try:
+            os.remove(fullpath)
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Delete least recently used files until under the byte budget
+        """
+        files = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if name.endswith(extension):
+                fullpath = os.path.join(self.folder, name)
+                size = os.path.getsize(fullpath)
+                files.append((os.path.getmtime(fullpath), size, fullpath))
+                total = total + size
+        files.sort()
+        for modified, size, fullpath in files:
+            if total <= self.maxbytes:
+                break
+            self.remove(fullpath)
+            total = total - size
+
+    def clear(self):
+        with self.lock:
+            for name in os.listdir(self.folder):
+                if name.endswith(extension):
+                    self.remove(os.path.join(self.folder, name))
@@ -0,0 +1,114 @@
+""" Z-stacks and time-lapse images, one plane at a time
+
+Hyperstacks are opened as virtual stacks, so planes are read from disk
+only when they are needed and memory use is proportional to one plane
+rather than to the whole file. The myelin and neurite channels are
+either projected (maximum or mean, accumulated plane by plane) and the
+projection analysed as a single image, or every plane is analysed
+separately (see MyelinJanalysis.analyseimage).
+
+"""
+
+from __future__ import division
+from ij import IJ, ImagePlus
+from ij.process import Blitter, FloatProcessor, ImageConverter
+
+# how hyperstacks are analysed
+modes = ("max", "mean", "planes")
+
+
+def openvirtual(path):
+    """ Open an image as a virtual stack
+    """
+    imp = IJ.openVirtual(path)
+    if imp is None:
+        raise IOError("cannot open "+path)
+    return imp
+
+
+def positions(imp):
+    """ (slice, frame) of every plane, both starting at 1
+    """
+    return [(z, t) for t in range(1, imp.getNFrames() + 1)
+            for z in range(1, imp.getNSlices() + 1)]
+
+
+def plane(imp, channel, z, t):
+    """ Processor of one channel of one plane, read from disk
+    Parameters
+    ----------
+    channel: int
+        position of the channel, starting at 0 as in readsettings.
+    """
+    return imp.getStack().getProcessor(imp.getStackIndex(channel + 1, z, t))
+
+
+def gray8(ip, title, calibration):
+    """ 8bit ImagePlus of a plane, scaled over its range of pixel values
+    """
+    if ip.getBitDepth() != 8:
+        ip.resetMinAndMax()
+    imp = ImagePlus(title, ip)
+    imp.setCalibration(calibration)
+    ImageConverter(imp).convertToGray8()
+    return imp
+
+
+def planes(imp, g, r):
+    """ Myelin and neurite channels of each plane in turn
+    Yields
+    ------
+    z, t: int
+        slice and frame.
+    green, red: ImagePlus
+        8bit myelin and neurite channels.
+    """
+    calibration = imp.getCalibration()
+    for z, t in positions(imp):
+        yield (z, t, gray8(plane(imp, g, z, t), "green", calibration),
+               gray8(plane(imp, r, z, t), "red", calibration))
+
+
+def project(imp, channel, mode):
+    """ Maximum or mean projection of one channel over all planes
+    The projection is accumulated one plane at a time. The mean is kept
+    as a float sum and converted back to the original bit depth without
+    scaling.
+    Returns
+    -------
+    projection: ImageProcessor
+        at the bit depth of the image.
+    """
+    projection = None
+    count = 0
+    for z, t in positions(imp):
+        ip = plane(imp, channel, z, t)
+        if mode == "max":
+            if projection is None:
+                projection = ip.duplicate()
+            else:
+                projection.copyBits(ip, 0, 0, Blitter.MAX)
+        else:
+            if projection is None:
+                projection = FloatProcessor(ip.getWidth(), ip.getHeight())
+            projection.copyBits(ip.convertToFloat(), 0, 0, Blitter.ADD)
+        count = count + 1
+    if mode == "mean":
+        projection.multiply(1.0 / count)
+        if imp.getBitDepth() == 8:
+            projection = projection.convertToByteProcessor(False)
+        elif imp.getBitDepth() == 16:
+            projection = projection.convertToShortProcessor(False)
+    return projection
+
+
+def projection(imp, g, r, mode):
+    """ Projected myelin and neurite channels
+    Returns
+    -------
+    green, red: ImagePlus
+        8bit projections of the myelin and neurite channels.
+    """
+    calibration = imp.getCalibration()
+    return (gray8(project(imp, g, mode), "green", calibration),
+            gray8(project(imp, r, mode), "red", calibration))
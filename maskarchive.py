@@ -0,0 +1,263 @@
+""" Bit-packed archive of the final masks of a folder of images
+
+The processed images saved by the analysis are lossy .jpg files, so
+they cannot be used to recalculate results. The final myelin and
+neurite masks of every image are therefore also saved in one archive
+per folder (Masks.masks, next to Results.csv). Each mask is packed to
+one bit per pixel (rows padded to whole bytes) and deflated, which is
+typically a few kB per image.
+
+Layout of an archive:
+
+    magic               8 bytes
+    records             deflated packed myelin mask, then neurite mask
+    index               number of images, then for each image its
+                        name, width, height, offset of its record and
+                        the deflated length of both masks
+    index offset        8 bytes
+    magic               8 bytes
+
+The index is read when an archive is opened, so any mask can be read
+without reading the rest of the file. Masks are returned as BitSets for
+counting (cardinality) and combining (and, or) pixels, see counts.
+
+"""
+
+from __future__ import with_statement
+import os
+import threading
+import jarray
+from java.awt.image import BufferedImage
+from java.io import ByteArrayOutputStream, IOException, RandomAccessFile
+from java.lang import String, System
+from java.util import BitSet
+from java.util.zip import Deflater, DeflaterOutputStream, Inflater
+from ij.process import ByteProcessor
+
+# changed if the layout changes
+magic = "MYJMASK1"
+extension = ".masks"
+
+
+def archivename(shard=None, shards=None):
+    """ File name of the archive, one per shard for sharded analyses
+    """
+    if shards is None:
+        return "Masks"+extension
+    return "Masks-shard-%03d-of-%03d%s" % (shard, shards, extension)
+
+
+def pack(ip):
+    """ One bit per pixel of a mask, set for pixels with value 255
+    Returns
+    -------
+    packed: byte array
+        rows of ceil(width / 8) bytes, most significant bit first.
+    """
+    width = ip.getWidth()
+    height = ip.getHeight()
+    gray = BufferedImage(width, height, BufferedImage.TYPE_BYTE_GRAY)
+    # pixel values, not the LUT, which is inverted for the final masks
+    System.arraycopy(ip.getPixels(), 0, gray.getRaster().getDataBuffer().getData(),
+                     0, width * height)
+    binary = BufferedImage(width, height, BufferedImage.TYPE_BYTE_BINARY)
+    graphics = binary.createGraphics()
+    graphics.drawImage(gray, 0, 0, None)
+    graphics.dispose()
+    return binary.getRaster().getDataBuffer().getData()
+
+
+def unpack(packed, width, height):
+    """ 8bit mask (0 and 255) from packed bits
+    """
+    binary = BufferedImage(width, height, BufferedImage.TYPE_BYTE_BINARY)
+    data = binary.getRaster().getDataBuffer().getData()
+    System.arraycopy(packed, 0, data, 0, len(data))
+    gray = BufferedImage(width, height, BufferedImage.TYPE_BYTE_GRAY)
+    graphics = gray.createGraphics()
+    graphics.drawImage(binary, 0, 0, None)
+    graphics.dispose()
+    ip = ByteProcessor(width, height)
+    System.arraycopy(gray.getRaster().getDataBuffer().getData(), 0, ip.getPixels(),
+                     0, width * height)
+    return ip
+
+
+def deflate(data):
+    buffer = ByteArrayOutputStream()
+    deflater = Deflater(Deflater.BEST_SPEED)
+    stream = DeflaterOutputStream(buffer, deflater)
+    try:
+        stream.write(data)
+        stream.close()
+    finally:
+        deflater.end()
+    return buffer.toByteArray()
+
+
+def inflate(data, size):
+    inflater = Inflater()
+    inflater.setInput(data)
+    packed = jarray.zeros(size, 'b')
+    done = 0
+    try:
+        while done < size and not inflater.finished():
+            done = done + inflater.inflate(packed, done, size - done)
+    finally:
+        inflater.end()
+    return packed
+
+
+class MaskArchive(object):
+    """ Archive of the myelin and neurite masks of a folder of images
+    Open with mode "w" to write a new archive (masks are added with put
+    from any thread and the index is written by close) or "r" to read.
+    Attributes
+    ----------
+    index: dictionary
+        (width, height, offset, myelin length, neurite length) of each
+        image name.
+    names: list of strings
+        image names in the order they were added.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.index = {}
+        self.names = []
+        if mode == "w":
+            self.file = RandomAccessFile(path, "rw")
+            self.file.setLength(0)
+            self.file.write(String(magic).getBytes("US-ASCII"))
+        else:
+            try:
+                self.file = RandomAccessFile(path, "r")
+                self.readindex()
+            except IOException as error:
+                raise IOError("cannot read mask archive "+path+": "+str(error))
+
+    def readmagic(self):
+        data = jarray.zeros(len(magic), 'b')
+        self.file.readFully(data)
+        if "".join([chr(b & 0xff) for b in data]) != magic:
+            raise IOError("not a mask archive or not closed: "+self.path)
+
+    def readindex(self):
+        self.file.seek(self.file.length() - 8 - len(magic))
+        indexoffset = self.file.readLong()
+        self.readmagic()
+        self.file.seek(indexoffset)
+        for x in range(self.file.readInt()):
+            name = self.file.readUTF()
+            self.index[name] = (self.file.readInt(), self.file.readInt(), self.file.readLong(),
+                                self.file.readInt(), self.file.readInt())
+            self.names.append(name)
+
+    def put(self, name, myelin, neurites):
+        """ Add the masks of an image
+        Parameters
+        ----------
+        name: string
+            image name (with the plane for z-stacks, as in the names of
+            the saved .jpg images).
+        myelin, neurites: ImagePlus
+            final 8bit masks, foreground 255.
+        """
+        ip = myelin.getProcessor()
+        self.putpacked(name, ip.getWidth(), ip.getHeight(), pack(ip),
+                       pack(neurites.getProcessor()))
+
+    def putpacked(self, name, width, height, myelinpacked, neuritepacked):
+        """ Add the masks of an image, already packed by pack
+        """
+        records = [deflate(myelinpacked), deflate(neuritepacked)]
+        with self.lock:
+            offset = self.file.getFilePointer()
+            for record in records:
+                self.file.write(record)
+            self.index[name] = (width, height, offset, len(records[0]), len(records[1]))
+            self.names.append(name)
+
+    def packed(self, name, kind):
+        """ Packed bits of the "myelin" or "neurites" mask of an image
+        """
+        width, height, offset, myelinlength, neuritelength = self.index[name]
+        length = myelinlength
+        if kind == "neurites":
+            offset = offset + myelinlength
+            length = neuritelength
+        data = jarray.zeros(length, 'b')
+        with self.lock:
+            self.file.seek(offset)
+            self.file.readFully(data)
+        return inflate(data, (width + 7) // 8 * height)
+
+    def bits(self, name, kind):
+        """ Mask as a BitSet, with one bit set for each foreground pixel
+        Bits are in the order of the packed bytes (with the padding at
+        the end of each row), so they can be counted and combined with
+        the same mask of other images of the same size.
+        """
+        return BitSet.valueOf(self.packed(name, kind))
+
+    def mask(self, name, kind):
+        """ Mask as an 8bit ByteProcessor, foreground 255
+        """
+        width, height = self.index[name][:2]
+        return unpack(self.packed(name, kind), width, height)
+
+    def counts(self, name):
+        """ Pixel counts of an image, as stages.countpixels
+        Returns
+        -------
+        myelinpixels, neuritepixels, totalpixels: int
+        """
+        width, height = self.index[name][:2]
+        return (self.bits(name, "myelin").cardinality(),
+                self.bits(name, "neurites").cardinality(), width * height)
+
+    def close(self):
+        with self.lock:
+            if self.mode == "w":
+                indexoffset = self.file.getFilePointer()
+                self.file.writeInt(len(self.names))
+                for name in self.names:
+                    width, height, offset, myelinlength, neuritelength = self.index[name]
+                    self.file.writeUTF(name)
+                    self.file.writeInt(width)
+                    self.file.writeInt(height)
+                    self.file.writeLong(offset)
+                    self.file.writeInt(myelinlength)
+                    self.file.writeInt(neuritelength)
+                self.file.writeLong(indexoffset)
+                self.file.write(String(magic).getBytes("US-ASCII"))
+            self.file.close()
+
+
+def counts(path):
+    """ Pixel counts of every image in an archive
+    Returns
+    -------
+    rows: list of tuples
+        (image name, myelin pixels, neurite pixels, pixel total), the
+        counts rows of MyelinJanalysis.finishfolders without quality.
+    """
+    archive = MaskArchive(path)
+    try:
+        return [(name,) + archive.counts(name) for name in archive.names]
+    finally:
+        archive.close()
+
+
+def archives(folder):
+    """ Paths of all mask archives in a folder and its subfolders
+    """
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if name.endswith(extension):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths
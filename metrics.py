@@ -0,0 +1,234 @@
+""" Measures of the final myelin and neurite masks
+
+% myelination is the number of myelin pixels divided by the number of
+neurite pixels, counted separately, so it includes myelin that does not
+lie on a neurite. The colocalised myelin is counted from the bitwise
+AND of the packed masks (see maskarchive.pack), optionally after
+dilating the neurite mask by config.colocalisationtolerance pixels so
+that myelin wrapped around a neurite is counted. The masks are packed
+for the mask archive anyway, so the AND and the count (BitSet
+cardinality) add little to the analysis of an image.
+
+Myelin segments are the 8-connected components of the myelin mask,
+labelled with MorphoLibJ. Lengths are measured on skeletons of the masks
+(ImageJ skeletonize) as the number of skeleton pixels, so diagonal steps
+count as one pixel rather than sqrt(2): the length of each myelin
+segment is the number of skeleton pixels with its (32bit) label.
+Neurite branch points are the junctions of the neurite skeleton: skeleton
+pixels with three or more skeleton neighbours are found with a 3x3
+convolution, and as a junction is usually several such pixels next to
+each other, their 8-connected clusters are counted. These are all whole
+image operations in Java, so nothing is done per pixel in Jython.
+The distribution of segment lengths is kept as the number of segments
+in each of the length bins set by segmentbins.
+
+Measures are kept as a tuple in the order of names and are all sums
+(of pixels or segments), so the measures of the planes of a z-stack can
+be added up.
+
+"""
+
+from __future__ import division
+import jarray
+from java.util import BitSet
+from ij.measure import Measurements
+from ij.plugin.filter import Convolver, RankFilters
+from ij.process import Blitter, ImageStatistics
+import maskarchive
+
+# upper limits in pixels of the myelin segment length bins, the last bin
+# has no upper limit. Changing them changes the columns of saved files.
+segmentbins = (10, 25, 50, 100, 200)
+
+
+def binnames():
+    """ Names of the myelin segment length bins
+    """
+    lower = (0,) + segmentbins
+    names = ["Myelin segments %d-%d pixels long" % (x1, x2) for (x1, x2) in
+             zip(lower, segmentbins)]
+    return names + ["Myelin segments over %d pixels long" % segmentbins[-1]]
+
+
+# measures of each image, in the order they are saved
+names = ("Colocalised myelin pixels", "Myelin segments", "Myelin segment length",
+         "Neurite length", "Neurite branch points") + tuple(binnames())
+
+# neighbours of a pixel
+neighbours = [1, 1, 1, 1, 0, 1, 1, 1, 1]
+
+
+def empty():
+    """ Measures of a skipped image
+    """
+    return (0,) * len(names)
+
+
+def parse(values):
+    """ Measures read back from a .csv file
+    Missing values (files saved before a measure was added) are 0.
+    """
+    measures = [float(value) if value != "" else 0 for value in values[:len(names)]]
+    return tuple(measures + [0] * (len(names) - len(measures)))
+
+
+def add(measures):
+    """ Sum of the measures of several images or planes
+    """
+    return tuple([sum(values) for values in zip(*measures)]) if measures else empty()
+
+
+def dilate(ip, tolerance):
+    """ Copy of a mask dilated by tolerance pixels
+    """
+    ip = ip.duplicate()
+    RankFilters().rank(ip, tolerance, RankFilters.MAX)
+    return ip
+
+
+def colocalised(myelinpacked, neuritepacked):
+    """ Number of pixels set in both of two packed masks
+    """
+    overlap = BitSet.valueOf(myelinpacked)
+    # "and" is a python keyword
+    getattr(overlap, "and")(BitSet.valueOf(neuritepacked))
+    return overlap.cardinality()
+
+
+def skeleton(ip):
+    """ Skeleton of a copy of a mask, foreground 255
+    """
+    ip = ip.duplicate()
+    ip.skeletonize(255)
+    return ip
+
+
+def branchpoints(skeleton):
+    """ Number of junctions of a skeleton
+    A junction is a cluster of 8-connected skeleton pixels each with
+    three or more skeleton neighbours, e.g. a T junction has three such
+    pixels and a cross five, but both are one branch point.
+    """
+    counts = skeleton.convertToFloat()
+    counts.multiply(1/255)
+    convolver = Convolver()
+    convolver.setNormalize(False)
+    convolver.convolve(counts, neighbours, 3, 3)
+    counts = counts.convertToByte(False)
+    # 255 for three or more neighbours
+    counts.threshold(2)
+    counts.copyBits(skeleton, 0, 0, Blitter.AND)
+    if counts.getHistogram()[255] == 0:
+        return 0
+    # MorpholibJ is only loaded once an image is measured
+    from inra.ijpb.binary import BinaryImages
+    # 32bit labels, a noisy mask can have more than 65535 components
+    labels = BinaryImages.componentsLabeling(counts, 8, 32)
+    return int(ImageStatistics.getStatistics(labels, Measurements.MIN_MAX, None).max)
+
+
+def segmentlengths(ip, skeleton):
+    """ Skeleton length in pixels of each segment (connected component)
+    of a mask, diagonal steps counting as one pixel
+    Parameters
+    ----------
+    ip: ImageProcessor
+        8bit mask, foreground 255, not changed.
+    skeleton: ImageProcessor
+        skeleton of ip, not changed.
+    Returns
+    -------
+    lengths: list of int
+        one for each segment.
+    """
+    from inra.ijpb.binary import BinaryImages
+    from inra.ijpb.label import LabelImages
+    # 32bit (float) labels, a noisy mask can have more than 65535 segments
+    labels = BinaryImages.componentsLabeling(ip, 8, 32)
+    segments = int(ImageStatistics.getStatistics(labels, Measurements.MIN_MAX, None).max)
+    if segments == 0:
+        return []
+    # keep the labels of skeleton pixels only (skeleton 0 or 1)
+    mask = skeleton.convertToFloat()
+    mask.multiply(1/255)
+    labels.copyBits(mask, 0, 0, Blitter.MULTIPLY)
+    return list(LabelImages.pixelCount(labels, jarray.array(range(1, segments + 1), 'i')))
+
+
+def binned(lengths):
+    """ Number of lengths in each bin of segmentbins
+    """
+    bins = [0] * (len(segmentbins) + 1)
+    for length in lengths:
+        x = 0
+        while x < len(segmentbins) and length >= segmentbins[x]:
+            x = x + 1
+        bins[x] = bins[x] + 1
+    return bins
+
+
+def measure(myelin, neurites, myelinpacked, neuritepacked, tolerance=0):
+    """ Measures of the final masks of an image
+    Parameters
+    ----------
+    myelin, neurites: ImagePlus
+        final 8bit masks, foreground 255, not changed.
+    myelinpacked, neuritepacked: byte arrays
+        the masks packed by maskarchive.pack.
+    tolerance: int
+        radius in pixels the neurite mask is dilated by before myelin
+        pixels on neurites are counted.
+    Returns
+    -------
+    measures: tuple
+        in the order of names.
+    """
+    myelin = myelin.getProcessor()
+    neurites = neurites.getProcessor()
+    if tolerance > 0:
+        neuritepacked = maskarchive.pack(dilate(neurites, tolerance))
+    lengths = segmentlengths(myelin, skeleton(myelin))
+    neuriteskeleton = skeleton(neurites)
+    return tuple([colocalised(myelinpacked, neuritepacked), len(lengths), sum(lengths),
+                  neuriteskeleton.getHistogram()[255], branchpoints(neuriteskeleton)]
+                 + binned(lengths))
+
+
+def column(measures, analysed, x):
+    """ One measure of each image, as an int, "" for skipped images
+    """
+    return [int(m[x]) if a else "" for (m, a) in zip(measures, analysed)]
+
+
+def resultrows(neuritepixels, measures, analysed):
+    """ Rows of Results.csv for the measures of a folder of images
+    Parameters
+    ----------
+    neuritepixels: list of int
+        number of neurite pixels in each image.
+    measures: list of tuples
+        measures of each image.
+    analysed: list of bool
+        False for images skipped by the quality gate.
+    Returns
+    -------
+    rows: 2D list
+        "% colocalised myelination": colocalised myelin pixels divided
+        by neurite pixels * 100, the number and mean length of myelin
+        segments, neurite length and branch points and the number of
+        myelin segments in each length bin. Lengths are numbers of
+        skeleton pixels.
+    """
+    colocalisation = [m[0]/n*100 if (a and n) else (0 if a else "") for (n, m, a) in
+                      zip(neuritepixels, measures, analysed)]
+    meanlength = [m[2]/m[1] if (a and m[1]) else (0 if a else "") for (m, a) in
+                  zip(measures, analysed)]
+    rows = [["% colocalised myelination"]+colocalisation]
+    rows.append(["Myelin segments"]+column(measures, analysed, 1))
+    rows.append(["Mean myelin segment length (skeleton pixels)"]+meanlength)
+    rows.append(["Neurite length (skeleton pixels)"]+column(measures, analysed, 3))
+    rows.append(["Neurite branch points"]+column(measures, analysed, 4))
+    for x, name in enumerate(binnames()):
+        rows.append([name]+column(measures, analysed, 5 + x))
+    return rows
+
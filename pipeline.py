@@ -0,0 +1,170 @@
+""" Overlapped decoding, analysis and saving of images
+
+Without a pipeline each image is opened, analysed and its results saved
+before the next image is opened, so the disk and the processors take
+turns to sit idle. A Pipeline runs three stages at once, connected by
+bounded queues:
+
+    decode      one thread opening images and splitting channels
+    compute     worker threads analysing the channels
+    write       the calling thread saving images, masks and results
+
+The queues hold at most depth items each, so the number of images in
+memory is capped at about 2 * depth + threads + 2 however many images
+there are. The depth of each queue is sampled as items pass: a full
+decoded queue means the compute stage is the bottleneck, a full computed
+queue means saving is, and empty queues mean decoding is.
+
+"""
+
+from __future__ import with_statement, division
+import threading
+from java.lang import Throwable
+from java.util.concurrent import ArrayBlockingQueue
+import workers
+
+# put in a queue after the last item
+finished = ("finished",)
+
+
+class Pipeline(object):
+    """ Decode, compute and write stages connected by bounded queues
+    Attributes
+    ----------
+    depth: int
+        capacity of each queue.
+    threads: int
+        number of compute threads.
+    decoded, computed: ArrayBlockingQueue
+        items waiting to be computed and written.
+    sums: dictionary
+        sum of the sampled depths of each queue.
+    samples: int
+        number of times the depths were sampled.
+    listener: function
+        called with the pipeline each time the depths are sampled (e.g.
+        Progress.setqueues), or None.
+    """
+
+    def __init__(self, depth=2, threads=1, listener=None):
+        self.depth = max(depth, 1)
+        self.threads = workers.threadcount(threads)
+        self.decoded = ArrayBlockingQueue(self.depth)
+        self.computed = ArrayBlockingQueue(self.depth)
+        self.lock = threading.Lock()
+        self.sums = {"decoded": 0, "computed": 0}
+        self.samples = 0
+        self.listener = listener
+        self.error = None
+
+    def depths(self):
+        """ Number of items in each queue
+        """
+        return {"decoded": self.decoded.size(), "computed": self.computed.size()}
+
+    def meandepths(self):
+        """ Mean sampled number of items in each queue
+        """
+        with self.lock:
+            if self.samples == 0:
+                return dict([(name, 0) for name in self.sums])
+            return dict([(name, total / self.samples) for (name, total) in self.sums.items()])
+
+    def sample(self):
+        depths = self.depths()
+        with self.lock:
+            for name in depths:
+                self.sums[name] = self.sums[name] + depths[name]
+            self.samples = self.samples + 1
+        if self.listener is not None:
+            self.listener(self)
+
+    def fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def decodeall(self, items, decode):
+        try:
+            for position, item in enumerate(items):
+                if self.error is not None:
+                    break
+                try:
+                    payload = decode(item)
+                except (Exception, Throwable) as error:
+                    self.fail(error)
+                    break
+                self.decoded.put((position, item, payload))
+                self.sample()
+        finally:
+            for x in range(self.threads):
+                self.decoded.put(finished)
+
+    def computeall(self, compute):
+        try:
+            while True:
+                entry = self.decoded.take()
+                if entry is finished:
+                    break
+                position, item, payload = entry
+                if self.error is not None:
+                    continue
+                try:
+                    output = compute(item, payload)
+                except (Exception, Throwable) as error:
+                    self.fail(error)
+                    continue
+                self.computed.put((position, item, output))
+                self.sample()
+        finally:
+            self.computed.put(finished)
+
+    def run(self, items, decode, compute, write):
+        """ Pass every item through the three stages
+        Parameters
+        ----------
+        items: list
+            items to process.
+        decode: function
+            decode(item), run in order in the decode thread.
+        compute: function
+            compute(item, decoded), run in the compute threads.
+        write: function
+            write(item, computed), run in the calling thread.
+        Returns
+        -------
+        results: list
+            write(item, computed) for each item, in the order of items.
+        Raises
+        ------
+        The first error raised by any stage, once all stages have
+        stopped.
+        """
+        results = [None] * len(items)
+        threads = [threading.Thread(target=self.decodeall, args=(items, decode),
+                                    name="MyelinJ decode")]
+        threads.extend([threading.Thread(target=self.computeall, args=(compute,),
+                                         name="MyelinJ compute %d" % (x + 1))
+                        for x in range(self.threads)])
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        running = self.threads
+        while running > 0:
+            entry = self.computed.take()
+            if entry is finished:
+                running = running - 1
+                continue
+            position, item, output = entry
+            self.sample()
+            if self.error is not None:
+                continue
+            try:
+                results[position] = write(item, output)
+            except (Exception, Throwable) as error:
+                self.fail(error)
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        return results
@@ -0,0 +1,207 @@
+""" Dry run of a batch analysis
+
+Reads the header of every image in parallel (see tiffheader.py) before
+anything is analysed, checks that the myelin and neurite channels of
+the user name exist in every file and reports files that are truncated,
+unreadable, not 8bit, or of a different size to most of the batch. The
+run time is predicted from the seconds per megapixel of each stage,
+which are calibrated from the timings of every completed analysis (see
+MyelinJanalysis.analyse) and saved in Preflight-costs.csv in the
+MyelinJ folder, which is left out of the user names listed by the
+dialogs.
+
+"""
+
+from __future__ import division
+import os
+import csv
+import tiffheader
+import workers
+
+costsfile = "Preflight-costs.csv"
+# seconds per megapixel of each stage until an analysis has been timed
+defaultcosts = {"open": 0.05, "cell bodies": 0.05, "preprocess": 0.15,
+                "frangi": 1.5, "myelin": 0.1, "neurites": 0.3, "save": 0.05,
+                "metrics": 0.08}
+# weight of the latest analysis when updating calibrated costs
+smoothing = 0.5
+
+
+def readcosts(cwd):
+    """ Calibrated seconds per megapixel of each stage
+    """
+    costs = dict(defaultcosts)
+    fullpath = os.path.join(cwd, costsfile)
+    if os.path.exists(fullpath):
+        f = open(fullpath, 'rb')
+        for row in csv.reader(f):
+            costs[row[0]] = float(row[1])
+        f.close()
+    return costs
+
+
+def analysedmegapixels(info, projection):
+    """ Megapixels analysed for an image
+    With projection "planes" every plane of a hyperstack is analysed.
+    """
+    if projection == "planes":
+        return info.megapixels() * info.slices * info.frames
+    return info.megapixels()
+
+
+def calibrate(cwd, timings, paths, projection="max"):
+    """ Update the saved costs from the timings of an analysis
+    Parameters
+    ----------
+    timings: dictionary
+        seconds spent in each stage, from MyelinJanalysis.analyseimage.
+    paths: list of strings
+        images analysed.
+    projection: string
+        config.projection used for the analysis.
+    """
+    megapixels = 0
+    for path in paths:
+        try:
+            megapixels = megapixels + analysedmegapixels(tiffheader.readheader(path), projection)
+        except (IOError, KeyError):
+            pass
+    if megapixels == 0 or len(timings) == 0:
+        return
+    costs = readcosts(cwd)
+    for stage, seconds in timings.items():
+        costs[stage] = (1 - smoothing) * costs.get(stage, 0) + smoothing * seconds / megapixels
+    f = open(os.path.join(cwd, costsfile), 'wb')
+    writer = csv.writer(f)
+    for stage in sorted(costs):
+        writer.writerow([stage, costs[stage]])
+    f.close()
+
+
+def inspect(path, g, r):
+    """ Header and problems of one image
+    Parameters
+    ----------
+    g, r: int
+        position of the myelin and neurite channels.
+    Returns
+    -------
+    info: TiffInfo
+        header of the image or None if it cannot be read.
+    problems: list of strings
+    """
+    try:
+        info = tiffheader.readheader(path)
+    except (IOError, KeyError) as error:
+        return None, ["unreadable: "+str(error)]
+    problems = []
+    if info.truncated:
+        problems.append("truncated")
+    if max(g, r) >= info.channels:
+        problems.append("%d channel(s), channel %d requested" % (info.channels, max(g, r) + 1))
+    if info.bitdepth != 8:
+        problems.append("%d bit, scaled to 8 bit" % info.bitdepth)
+    return info, problems
+
+
+class Plan(object):
+    """ Result of a dry run
+    Attributes
+    ----------
+    rows: list of tuples
+        (path, TiffInfo or None, list of problems) for each image.
+    seconds: dictionary
+        predicted seconds of each stage for the whole batch.
+    total: float
+        predicted run time in seconds.
+    """
+
+    def __init__(self, rows, seconds, total):
+        self.rows = rows
+        self.seconds = seconds
+        self.total = total
+
+    def problems(self):
+        return [(path, problems) for (path, info, problems) in self.rows if problems]
+
+    def megapixels(self):
+        return sum([info.megapixels() for (path, info, problems) in self.rows if info])
+
+    def bytes(self):
+        return sum([info.filesize for (path, info, problems) in self.rows if info])
+
+
+def plan(paths, g, r, costs=None, threads=None, projection="max"):
+    """ Dry run over a batch of images
+    Parameters
+    ----------
+    paths: list of strings
+        .tif images to analyse.
+    g, r: int
+        position of the myelin and neurite channels (readsettings[4]
+        and readsettings[5]).
+    costs: dictionary
+        seconds per megapixel of each stage, see readcosts.
+    threads: int
+        number of images analysed at once. Frangi runs one image at a
+        time, so it does not get faster with more threads.
+    projection: string
+        config.projection, with "planes" every plane of z-stacks and
+        time-lapse images is analysed.
+    Returns
+    -------
+    plan: Plan
+    """
+    if costs is None:
+        costs = defaultcosts
+    results = workers.parallelmap(lambda path: inspect(path, g, r), paths)
+    rows = [(path, info, problems) for path, (info, problems) in zip(paths, results)]
+
+    # images of a different size to most of the batch
+    sizes = {}
+    for path, info, problems in rows:
+        if info is not None:
+            sizes[(info.width, info.height)] = sizes.get((info.width, info.height), 0) + 1
+    if len(sizes) > 1:
+        common = max([(n, size) for (size, n) in sizes.items()])[1]
+        for path, info, problems in rows:
+            if info is not None and (info.width, info.height) != common:
+                problems.append("%dx%d, most images are %dx%d" % ((info.width, info.height) + common))
+
+    megapixels = sum([analysedmegapixels(info, projection)
+                      for (path, info, problems) in rows if info])
+    seconds = dict([(stage, cost * megapixels) for (stage, cost) in costs.items()])
+    threads = workers.threadcount(threads) if threads and threads > 1 else 1
+    total = max(sum(seconds.values()) / threads, seconds.get("frangi", 0))
+    return Plan(rows, seconds, total)
+
+
+def writeplan(fullpath, plan):
+    """ Save the dry run as a .csv file with one row per image
+    """
+    f = open(fullpath, 'wb')
+    writer = csv.writer(f)
+    writer.writerow(["Image", "Width", "Height", "Channels", "Slices", "Frames",
+                     "Bit depth", "Bytes", "Problems"])
+    for path, info, problems in plan.rows:
+        if info is None:
+            writer.writerow([path, "", "", "", "", "", "", "", "; ".join(problems)])
+        else:
+            writer.writerow([path, info.width, info.height, info.channels, info.slices,
+                             info.frames, info.bitdepth, info.filesize, "; ".join(problems)])
+    f.close()
+
+
+def report(plan):
+    """ Summary of a dry run as text
+    """
+    lines = ["%d images, %.1f megapixels, %.1f MB" % (len(plan.rows), plan.megapixels(),
+                                                      plan.bytes() / 1e6)]
+    lines.append("Predicted run time: %d min %d s" % (plan.total // 60, plan.total % 60))
+    for stage in sorted(plan.seconds, key=lambda s: -plan.seconds[s]):
+        lines.append("    %s: %d s" % (stage, plan.seconds[stage]))
+    problems = plan.problems()
+    lines.append("%d image(s) with problems" % len(problems))
+    for path, problem in problems:
+        lines.append("    %s: %s" % (path, "; ".join(problem)))
+    return "\n".join(lines)
@@ -0,0 +1,185 @@
+""" Live preview of the analysis settings in Dialog4 and Dialog5
+
+The current settings are run on a copy of the image downsampled to
+config.previewwidth, with radii scaled to match (see stages.py), so the
+preview follows each change almost at once. The same settings are then
+run on the full resolution image in a separate background thread and
+the result replaces the preview when it is ready. Both are run by
+DialogExecutors (see dialogexecutor.py), so a change of settings
+supersedes any preview still being calculated and only the preview of
+the latest settings is displayed. Previews are shown in a PreviewSurface
+(see previewsurface.py), one window per kind of result that is updated
+in place.
+
+"""
+
+from __future__ import with_statement, division
+from ij import ImagePlus
+import stages
+import dialogexecutor
+import previewsurface
+
+
+def downsample(imp, width):
+    """ Copy of an 8bit image no wider than width
+    Returns
+    -------
+    small: ImagePlus
+        with the calibration scaled so that sizes in calibrated units
+        (e.g. the frangi scale) match the original.
+    scale: float
+        width of the copy divided by the width of the original.
+    """
+    scale = min(1.0, width / imp.getWidth())
+    calibration = imp.getCalibration().copy()
+    if scale == 1.0:
+        small = ImagePlus(imp.getTitle(), imp.getProcessor().duplicate())
+    else:
+        ip = imp.getProcessor().resize(int(imp.getWidth() * scale),
+                                       int(imp.getHeight() * scale), True)
+        small = ImagePlus(imp.getTitle(), ip)
+        calibration.pixelWidth = calibration.pixelWidth / scale
+        calibration.pixelHeight = calibration.pixelHeight / scale
+    small.setCalibration(calibration)
+    return small, scale
+
+
+def copy(imp):
+    duplicate = ImagePlus(imp.getTitle(), imp.getProcessor().duplicate())
+    duplicate.setCalibration(imp.getCalibration())
+    return duplicate
+
+
+def render(kind, green, red, readsettings, scale, frangi=True, stale=None):
+    """ Result of the current settings
+    Parameters
+    ----------
+    kind: string
+        "myelin" or "neurites".
+    green, red: ImagePlus
+        unprocessed 8bit myelin and neurite channels, not changed.
+    scale: float
+        size of green and red relative to the full resolution image.
+    frangi: bool
+        for "myelin", run frangi and show the myelin mask, otherwise
+        show the cell body mask (if cell bodies are removed) or the
+        processed myelin channel.
+    stale: function
+        returns True once the result is no longer wanted, checked between
+        stages.
+    Returns
+    -------
+    ip: ImageProcessor
+        or None if the result was no longer wanted.
+    """
+    if stale is None:
+        stale = lambda: False
+    if kind == "neurites":
+        return stages.neuritemask(copy(red), readsettings, scale).getProcessor()
+    cellbodies = stages.cellbodymask(green, readsettings, scale)
+    if frangi is False and cellbodies is not None and readsettings[13] == "True":
+        return cellbodies.getProcessor()
+    if stale():
+        return None
+    processed = stages.preprocessmyelin(copy(green), red, readsettings, scale)
+    if frangi is False:
+        return processed.getProcessor()
+    if stale():
+        return None
+    vesselness = stages.frangi(processed)
+    if stale():
+        return None
+    return stages.myelinmask(vesselness, cellbodies, readsettings, scale).getProcessor()
+
+
+class LivePreview(object):
+    """ Preview window for one kind of result
+    Attributes
+    ----------
+    kind: string
+        "myelin" or "neurites", also the key of previews submitted to
+        the executors.
+    executor: DialogExecutor
+        runs the downsampled previews, in order with the other dialog
+        actions.
+    full: DialogExecutor
+        runs the full resolution previews.
+    surface: PreviewSurface
+        window the previews are shown in.
+    """
+
+    def __init__(self, kind, width=1024, executor=None):
+        self.kind = kind
+        self.width = width
+        if executor is None:
+            executor = dialogexecutor.DialogExecutor()
+        self.executor = executor
+        self.full = dialogexecutor.DialogExecutor(0, "MyelinJ full resolution preview")
+        self.source = None
+        self.load = None
+        self.surface = previewsurface.PreviewSurface(kind+" preview")
+
+    def setsource(self, key, load):
+        """ Image to preview
+        Parameters
+        ----------
+        key: string
+            identifies the image, it is only loaded and downsampled again
+            when the key changes.
+        load: function
+            returns the unprocessed 8bit myelin and neurite channels,
+            called by the next update in the background.
+        """
+        self.load = (key, load)
+
+    def loadsource(self):
+        key, load = self.load
+        if self.source is None or self.source[0] != key:
+            green, red = load()
+            smallgreen, scale = downsample(green, self.width)
+            smallred, scale = downsample(red, self.width)
+            self.source = (key, green, red, smallgreen, smallred, scale)
+        return self.source
+
+    def display(self, ip, before, stale):
+        """ Show a result at the size of the full resolution image
+        Parameters
+        ----------
+        before: ImagePlus
+            unprocessed channel the result was calculated from.
+        """
+        if ip is None or stale():
+            return
+        green = self.source[1]
+        self.surface.show(ip, before.getProcessor(), green.getWidth(), green.getHeight())
+
+    def channel(self, green, red):
+        if self.kind == "neurites":
+            return red
+        return green
+
+    def update(self, readsettings, frangi=True):
+        """ Show the downsampled result soon and the full result when ready
+        Supersedes any preview that has not been displayed yet.
+        """
+        self.full.supersede(self.kind)
+
+        def small():
+            key, green, red, smallgreen, smallred, scale = self.loadsource()
+            ip = render(self.kind, smallgreen, smallred, readsettings, scale, frangi,
+                        self.executor.stale)
+            self.display(ip, self.channel(smallgreen, smallred), self.executor.stale)
+            if scale != 1.0 and not self.executor.stale():
+                self.full.submit(lambda: full(green, red), self.kind)
+
+        def full(green, red):
+            ip = render(self.kind, green, red, readsettings, 1, frangi, self.full.stale)
+            self.display(ip, self.channel(green, red), self.full.stale)
+
+        self.executor.submit(small, self.kind)
+
+    def close(self):
+        self.executor.supersede(self.kind)
+        self.full.supersede(self.kind)
+
+        self.executor.submit(self.surface.close)
@@ -0,0 +1,103 @@
+""" A persistent preview window for one channel
+
+Each result is shown by swapping the processor of the same window in
+place, so repeated changes of settings do not open, close or retitle
+image windows. Results that are smaller than the window (e.g. the
+downsampled previews, see preview.py) are scaled up to the size of the
+window. Optionally the window shows a before/after split view: the
+unprocessed channel to the left of a dividing line and the result to
+the right.
+
+"""
+
+from __future__ import with_statement
+from ij import ImagePlus
+from ij.process import ImageProcessor
+import stages
+
+
+def split(before, after, fraction=0.5):
+    """ Before/after split view of two processors of the same size
+    Parameters
+    ----------
+    before: ImageProcessor
+        unprocessed image, not changed.
+    after: ImageProcessor
+        result, not changed.
+    fraction: float
+        position of the dividing line as a fraction of the width.
+    Returns
+    -------
+    ip: ImageProcessor
+        8bit, before to the left of the line and after to the right.
+    """
+    ip = after.convertToByte(True)
+    if ip is after:
+        ip = after.duplicate()
+    x = int(ip.getWidth() * fraction)
+    if x > 0:
+        left = before.convertToByte(True)
+        left.setRoi(0, 0, x, ip.getHeight())
+        ip.insert(left.crop(), 0, 0)
+        left.resetRoi()
+    ip.setValue(255)
+    ip.drawLine(x, 0, x, ip.getHeight() - 1)
+    return ip
+
+
+class PreviewSurface(object):
+    """ One persistent window showing the latest result for a channel
+    Attributes
+    ----------
+    title: string
+        window title, it does not change with the result shown.
+    splitview: bool
+        show the unprocessed channel and the result side by side.
+    fraction: float
+        position of the dividing line of the split view.
+    imp: ImagePlus
+        the displayed image, None until the first result is shown.
+    """
+
+    def __init__(self, title, splitview=False, fraction=0.5):
+        self.title = title
+        self.splitview = splitview
+        self.fraction = fraction
+        self.imp = None
+
+    def visible(self):
+        return self.imp is not None and self.imp.getWindow() is not None
+
+    def show(self, ip, before=None, width=None, height=None):
+        """ Show a result in the window
+        Parameters
+        ----------
+        ip: ImageProcessor
+            result, not changed.
+        before: ImageProcessor
+            unprocessed channel of the same size as ip, shown next to the
+            result if splitview is selected.
+        width, height: int
+            size of the window, ip is scaled up to it if it is smaller
+            (defaults to the size of ip).
+        """
+        if self.splitview is True and before is not None:
+            ip = split(before, ip, self.fraction)
+        if width is not None and (ip.getWidth() != width or ip.getHeight() != height):
+            # nearest neighbour, so masks stay binary
+            ip.setInterpolationMethod(ImageProcessor.NONE)
+            ip = ip.resize(width, height)
+        # frangi takes its result from the active window
+        with stages.windowlock:
+            if self.visible() is False:
+                self.imp = ImagePlus(self.title, ip)
+                self.imp.show()
+            else:
+                self.imp.setProcessor(ip)
+                self.imp.updateAndDraw()
+
+    def close(self):
+        with stages.windowlock:
+            if self.imp is not None:
+                self.imp.close()
+                self.imp = None
@@ -0,0 +1,295 @@
+""" Saved user names (profiles)
+
+User name .csv files are saved in the folder config.profilesfolder
+within the MyelinJ folder. Older versions saved them in the MyelinJ
+folder itself, where they are still found. Only these two folders are
+listed (not their subfolders), so listing user names does not depend on
+the size of the Fiji installation.
+
+The .csv files are positional: their rows are flattened into readsettings
+whose layout depends on whether the neurite settings are dense or
+sparse. They are read into typed Profiles (named settings with their
+types, validated when they are read) and can also be saved as
+versioned .json profiles:
+
+    {"format": "MyelinJ profile", "version": 1, "name": "alice",
+     "sparse": false, "settings": {"Min": 0, "Max": 40, ...}}
+
+Profiles are read through registry, which keeps them in memory and only
+reads a file again once it has changed. Profile.aslist gives the
+readsettings used by the analysis stages.
+
+"""
+
+from __future__ import with_statement
+import os
+import csv
+import json
+import threading
+import config
+
+# .csv files in the MyelinJ folder that are not user names: the costs of
+# preflight.costsfile, named here so listing user names does not load
+# preflight
+internal = ("Preflight-costs.csv",)
+
+
+def folder(cwd):
+    """ Folder of the user name files
+    """
+    return os.path.join(cwd, config.profilesfolder)
+
+
+def csvfiles(path):
+    """ Profile files (.csv and .json) in a folder
+    """
+    if not os.path.isdir(path):
+        return []
+    return [name for name in os.listdir(path)
+            if name.endswith(extensions) and os.path.isfile(os.path.join(path, name))]
+
+
+def names(cwd):
+    """ All saved user names, sorted
+    """
+    found = set(csvfiles(folder(cwd)))
+    found.update([name for name in csvfiles(cwd) if name not in internal])
+    return sorted(found)
+
+
+def path(cwd, user, create=False):
+    """ Path of a user name file
+    User names saved by older versions are read from (and saved to) the
+    MyelinJ folder, all others are in the profiles folder, which is
+    created if create is True (for saving).
+    """
+    legacy = os.path.join(cwd, user)
+    fullpath = os.path.join(folder(cwd), user)
+    if not os.path.exists(fullpath) and os.path.exists(legacy):
+        return legacy
+    if create is True and not os.path.isdir(folder(cwd)):
+        os.makedirs(folder(cwd))
+    return fullpath
+
+
+# typed profiles
+# version of the .json profile format, changed if its layout changes
+version = 1
+extensions = (".csv", ".json")
+# settings of dense neurite profiles, in the order of readsettings (see
+# MyelinJanalysis.getsettings), with their types
+densefields = (("Min", "int"), ("Max", "int"), ("threshChoice", "text"),
+               ("despeckle", "bool"), ("g", "int"), ("r", "int"),
+               ("backgroundsubRolling", "bool"), ("radius", "number"), ("mCLAHE", "bool"),
+               ("backgroundsubNeurite", "bool"), ("setpixels", "number"),
+               ("greyscaleMinVal", "int"), ("contrast", "number"), ("cellbodycb", "bool"))
+# further settings of sparse neurite profiles
+sparsefields = (("Sbgcbstate", "bool"), ("mCLAHE2", "bool"), ("threshChoice2", "text"),
+                ("Min2", "int"), ("Max2", "int"))
+# unused settings saved by newUser to fill the last row of sparse profiles
+padding = ["0", "0"]
+
+
+def parsevalue(value, kind):
+    """ Typed value of a setting read from a .csv or .json profile
+    Raises
+    ------
+    ValueError if the value does not have the type of the setting.
+    """
+    if kind == "bool":
+        if value in (True, False):
+            return value
+        if value in ("True", "False"):
+            return value == "True"
+    elif kind == "int":
+        if not isinstance(value, bool) and float(value) == int(float(value)):
+            return int(float(value))
+    elif kind == "number":
+        if not isinstance(value, bool):
+            value = float(value)
+            return int(value) if value == int(value) else value
+    elif kind == "text":
+        return str(value)
+    raise ValueError("not a "+kind+": "+str(value))
+
+
+def formatvalue(value):
+    """ Setting as a string, as it is saved in .csv profiles
+    """
+    return str(value)
+
+
+class Profile(object):
+    """ Typed analysis settings of a user name
+    Attributes
+    ----------
+    name: string
+        user name.
+    sparse: bool
+        sparse neurite settings (from Dialog6) rather than dense.
+    settings: dictionary
+        typed value of each setting of densefields (and sparsefields).
+    path: string
+        file the profile was read from, or None.
+    """
+
+    def __init__(self, name, sparse, settings, path=None):
+        self.name = name
+        self.sparse = sparse
+        self.settings = settings
+        self.path = path
+        self.validate()
+
+    def fields(self):
+        if self.sparse is True:
+            return densefields + sparsefields
+        return densefields
+
+    def validate(self):
+        """ Check that every setting is present, has its type and is in
+        range
+        Raises
+        ------
+        ValueError naming the profile and the first problem found.
+        """
+        def fail(problem):
+            raise ValueError("profile "+str(self.path or self.name)+": "+problem)
+
+        for name, kind in self.fields():
+            if name not in self.settings:
+                fail("missing setting "+name)
+            try:
+                self.settings[name] = parsevalue(self.settings[name], kind)
+            except ValueError as error:
+                fail(name+" is "+str(error))
+        limits = [("Min", "Max")]
+        if self.sparse is True:
+            limits.append(("Min2", "Max2"))
+        for lower, upper in limits:
+            if not 0 <= self.settings[lower] <= self.settings[upper] <= 255:
+                fail(lower+" and "+upper+" must be between 0 and 255")
+        if self.settings["g"] < 0 or self.settings["r"] < 0:
+            fail("channels must not be negative")
+
+    def aslist(self):
+        """ Settings as the flat list of strings used by the analysis
+        (readsettings, see MyelinJanalysis.getsettings)
+        """
+        readsettings = [formatvalue(self.settings[name]) for name, kind in self.fields()]
+        if self.sparse is True:
+            readsettings.extend(padding)
+        return readsettings
+
+    def asdict(self):
+        """ Contents of a .json profile
+        """
+        return {"format": "MyelinJ profile", "version": version, "name": self.name,
+                "sparse": self.sparse, "settings": dict(self.settings)}
+
+    def save(self, fullpath):
+        """ Save as a .json profile
+        """
+        f = open(fullpath, 'w')
+        json.dump(self.asdict(), f, indent=1, sort_keys=True)
+        f.close()
+
+
+def fromlist(name, readsettings, fullpath=None):
+    """ Profile from a flat list of settings (readsettings)
+    Raises
+    ------
+    ValueError if the list is neither a dense nor a sparse profile.
+    """
+    if len(readsettings) == len(densefields):
+        sparse = False
+    elif len(readsettings) >= len(densefields) + len(sparsefields):
+        sparse = True
+    else:
+        raise ValueError("profile "+str(fullpath or name)+": %d settings" % len(readsettings))
+    fields = densefields + sparsefields if sparse else densefields
+    return Profile(name, sparse, dict([(field, value) for ((field, kind), value)
+                                       in zip(fields, readsettings)]), fullpath)
+
+
+def readcsv(fullpath):
+    """ Profile from a user name .csv file saved by newUser
+    """
+    readsettings = []
+    f = open(fullpath, 'rb')
+    for row in csv.reader(f):
+        readsettings.extend(row[0:7])
+    f.close()
+    return fromlist(os.path.splitext(os.path.basename(fullpath))[0], readsettings, fullpath)
+
+
+def readjson(fullpath):
+    """ Profile from a .json profile saved by Profile.save
+    Raises
+    ------
+    ValueError for files of other formats or newer versions.
+    """
+    f = open(fullpath, 'r')
+    try:
+        contents = json.load(f)
+    finally:
+        f.close()
+    if not isinstance(contents, dict) or contents.get("format") != "MyelinJ profile":
+        raise ValueError("not a MyelinJ profile: "+fullpath)
+    if contents.get("version") != version:
+        raise ValueError("profile "+fullpath+": unsupported version "+str(contents.get("version")))
+    return Profile(str(contents.get("name")), contents.get("sparse") is True,
+                   dict(contents.get("settings", {})), fullpath)
+
+
+def load(fullpath):
+    """ Profile from a .csv or .json file
+    """
+    if fullpath.endswith(".json"):
+        return readjson(fullpath)
+    return readcsv(fullpath)
+
+
+class Registry(object):
+    """ Profiles read once and kept in memory
+    A profile is read again only when the modification time of its file
+    changes, so workers analysing many images never parse settings per
+    image. Safe to share between threads.
+    Attributes
+    ----------
+    profiles: dictionary
+        (modification time, Profile) of each file read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = {}
+
+    def get(self, fullpath):
+        """ Profile of a .csv or .json file
+        Raises
+        ------
+        IOError if the file cannot be read, ValueError if it is not a
+        valid profile.
+        """
+        fullpath = os.path.abspath(fullpath)
+        mtime = os.path.getmtime(fullpath)
+        with self.lock:
+            cached = self.profiles.get(fullpath)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        profile = load(fullpath)
+        with self.lock:
+            self.profiles[fullpath] = (mtime, profile)
+        return profile
+
+    def forget(self, fullpath=None):
+        """ Drop one or all profiles, e.g. after they are deleted
+        """
+        with self.lock:
+            if fullpath is None:
+                self.profiles.clear()
+            else:
+                self.profiles.pop(os.path.abspath(fullpath), None)
+
+
+registry = Registry()
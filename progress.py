@@ -0,0 +1,222 @@
+""" Progress of a batch analysis
+
+Progress keeps count of the images analysed, the rolling throughput and
+the time spent in each stage of the analysis, and whether the user has
+asked to cancel. ProgressWindow shows it while MyelinJanalysis.analyse
+runs, with a Cancel button that stops the analysis after the current
+image.
+
+"""
+
+from __future__ import division
+import time
+import threading
+from ij import IJ
+from java.awt import Color, Font
+from java.lang import Runnable
+from javax.swing import JButton, JFrame, JLabel, JPanel, SwingUtilities
+
+# number of recent images used for the rolling throughput
+window = 10
+# order of the stages in the time breakdown
+stagenames = ("open", "quality", "cell bodies", "preprocess", "frangi", "myelin", "neurites",
+              "save", "metrics")
+
+
+class Progress(object):
+    """ Count of analysed images, throughput and time per stage
+    Attributes
+    ----------
+    total: int
+        number of images to analyse.
+    done: int
+        number of images analysed.
+    timings: dictionary
+        name of each stage and total seconds spent in it, filled in by
+        MyelinJanalysis.analyseimage.
+    cancelled: bool
+        the analysis should stop after the current image.
+    queues: dictionary
+        current and mean number of images waiting in each queue of a
+        pipelined analysis (see pipeline.py), empty otherwise.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.folder = ""
+        self.image = ""
+        self.times = []
+        self.timings = {}
+        self.cancelled = False
+        self.queues = {}
+        self.listeners = []
+
+    def start(self, total):
+        with self.lock:
+            self.total = total
+            self.done = 0
+            self.times = [time.time()]
+        self.changed()
+
+    def begin(self, folder, image):
+        """ An image is about to be analysed
+        """
+        with self.lock:
+            self.folder = str(folder)
+            self.image = image
+        self.changed()
+
+    def end(self):
+        """ The current image has been analysed
+        """
+        with self.lock:
+            self.done = self.done + 1
+            self.times.append(time.time())
+            self.times = self.times[-(window + 1):]
+        self.changed()
+
+    def setqueues(self, pipelined):
+        """ Queue depths of a pipelined analysis
+        Parameters
+        ----------
+        pipelined: Pipeline
+        """
+        depths = pipelined.depths()
+        means = pipelined.meandepths()
+        with self.lock:
+            self.queues = dict([(name, (depths[name], means[name], pipelined.depth))
+                                for name in depths])
+        self.changed()
+
+    def cancel(self):
+        self.cancelled = True
+        self.changed()
+
+    def throughput(self):
+        """ Images per second over the most recent images
+        """
+        with self.lock:
+            if len(self.times) < 2 or self.times[-1] == self.times[0]:
+                return 0
+            return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def eta(self):
+        """ Estimated seconds remaining or None if not known
+        """
+        rate = self.throughput()
+        if rate == 0:
+            return None
+        return (self.total - self.done) / rate
+
+    def breakdown(self):
+        """ Fraction of the time spent in each stage
+        Returns
+        -------
+        breakdown: list of (string, float)
+            stage name and fraction of the total stage time.
+        """
+        with self.lock:
+            timings = dict(self.timings)
+        total = sum(timings.values())
+        if total == 0:
+            return []
+        names = [n for n in stagenames if n in timings] + \
+                sorted([n for n in timings if n not in stagenames])
+        return [(n, timings[n] / total) for n in names]
+
+    def addlistener(self, listener):
+        self.listeners.append(listener)
+
+    def changed(self):
+        for listener in self.listeners:
+            listener(self)
+
+
+def formatseconds(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Update(Runnable):
+    """ Show the current progress on the event dispatch thread
+    """
+    def __init__(self, frame, progress):
+        self.frame = frame
+        self.progress = progress
+
+    def run(self):
+        self.frame.display(self.progress)
+
+
+class ProgressWindow(JFrame):
+    """ Window showing the progress of the analysis
+    Updated whenever progress changes. Cancel stops the analysis after
+    the image being analysed; results for the images already analysed
+    are still saved.
+    """
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.initUI()
+        progress.addlistener(self.changed)
+
+    def initUI(self):
+        panel = JPanel()
+        self.getContentPane().add(panel)
+        panel.setBackground(Color.WHITE)
+        panel.setLayout(None)
+        self.setTitle("MyelinJ analysis")
+        self.setSize(420, 400)
+        self.labels = []
+        for i in range(6):
+            label = JLabel("")
+            label.setBounds(15, 10 + i * 25, 390, 20)
+            panel.add(label)
+            self.labels.append(label)
+        self.stages = JLabel("")
+        self.stages.setFont(Font("Monospaced", Font.PLAIN, 11))
+        self.stages.setBounds(15, 160, 390, 160)
+        panel.add(self.stages)
+        self.cancelbutton = JButton("Cancel", actionPerformed=self.onCancel)
+        self.cancelbutton.setBounds(160, 325, 100, 30)
+        panel.add(self.cancelbutton)
+        self.setLocation(int(IJ.getScreenSize().width * 0.01),
+                         int(IJ.getScreenSize().height * 3 / 10))
+        self.setVisible(True)
+
+    def changed(self, progress):
+        SwingUtilities.invokeLater(Update(self, progress))
+
+    def display(self, progress):
+        rate = progress.throughput()
+        self.labels[0].setText("Folder: "+progress.folder)
+        self.labels[1].setText("Image: "+progress.image)
+        self.labels[2].setText("Images: %d of %d" % (progress.done, progress.total))
+        self.labels[3].setText("Throughput: %.2f images/s" % rate)
+        self.labels[4].setText("Time remaining: "+formatseconds(progress.eta()))
+        if progress.cancelled:
+            self.labels[5].setText("Cancelling after the current image...")
+        queues = ["%s queue: %d of %d (mean %.1f)" % (name, depth, capacity, mean)
+                  for name, (depth, mean, capacity) in sorted(progress.queues.items())]
+        self.stages.setText("<html>"+"<br>".join(queues +
+            ["%s: %d%%" % (name, fraction * 100) for name, fraction in progress.breakdown()])
+            + "</html>")
+
+    def onCancel(self, event):
+        self.progress.cancel()
+        self.cancelbutton.setEnabled(False)
+
+    def close(self):
+        SwingUtilities.invokeLater(Dispose(self))
+
+
+class Dispose(Runnable):
+    def __init__(self, frame):
+        self.frame = frame
+
+    def run(self):
+        self.frame.dispose()
@@ -0,0 +1,87 @@
+""" Rejection of blank, out of focus and saturated fields
+
+Measured on a downsampled copy of the 8bit channels, before the
+expensive stages of the analysis:
+
+    focus       variance of the Laplacian of the neurite channel, low
+                for out of focus fields.
+    coverage    fraction of neurite channel pixels above coveragelevel,
+                low for empty fields.
+    saturation  fraction of pixels at 255 in either channel.
+
+Limits are set in config.py and depend on the microscope, so fields are
+only flagged (not skipped) by default. See MyelinJanalysis.analysechannels.
+
+"""
+
+from __future__ import division
+import jarray
+from ij.process import ImageStatistics
+from ij.measure import Measurements
+
+# width of the downsampled copy
+width = 512
+# 8bit intensity above which a pixel counts towards coverage
+coveragelevel = 20
+laplacian = jarray.array([0, 1, 0, 1, -4, 1, 0, 1, 0], 'i')
+
+
+def downsample(ip):
+    """ Copy of a processor no wider than width, averaging pixels
+    Processors interpolate bilinearly unless set otherwise.
+    """
+    if ip.getWidth() <= width:
+        return ip.duplicate()
+    return ip.resize(width, int(ip.getHeight() * width / ip.getWidth()), True)
+
+
+def focus(ip):
+    """ Variance of the Laplacian
+    """
+    fp = ip.convertToFloat()
+    fp.convolve3x3(laplacian)
+    stats = ImageStatistics.getStatistics(fp, Measurements.STD_DEV, None)
+    return stats.stdDev ** 2
+
+
+def fraction(ip, lower, upper=255):
+    """ Fraction of 8bit pixels between lower and upper
+    """
+    histogram = ip.getHistogram()
+    return sum(histogram[lower:upper + 1]) / (ip.getWidth() * ip.getHeight())
+
+
+def measure(green, red):
+    """ Quality measures of a field
+    Parameters
+    ----------
+    green, red: ImagePlus
+        8bit myelin and neurite channels, not changed.
+    Returns
+    -------
+    measures: dictionary
+        focus, coverage and saturation.
+    """
+    neurites = downsample(red.getProcessor())
+    myelin = downsample(green.getProcessor())
+    return {"focus": focus(neurites),
+            "coverage": fraction(neurites, coveragelevel + 1),
+            "saturation": max(fraction(neurites, 255), fraction(myelin, 255))}
+
+
+def check(green, red, minfocus, mincoverage, maxsaturation):
+    """ Reasons a field fails the quality gate
+    Returns
+    -------
+    reason: string
+        "" if the field passes, otherwise the failed measures.
+    """
+    measures = measure(green, red)
+    reasons = []
+    if measures["coverage"] < mincoverage:
+        reasons.append("blank (coverage %.3f)" % measures["coverage"])
+    if measures["focus"] < minfocus:
+        reasons.append("out of focus (focus %.1f)" % measures["focus"])
+    if measures["saturation"] > maxsaturation:
+        reasons.append("saturated (%.3f)" % measures["saturation"])
+    return ", ".join(reasons)
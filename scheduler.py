@@ -0,0 +1,120 @@
+""" Memory aware scheduling of images between worker threads
+
+Field sizes differ between microscopes, so a fixed number of images in
+flight can exhaust the Java heap. The peak working set of the analysis
+of each image is estimated from its TIFF header (see tiffheader.py) and
+an image is only started while the estimates of all images being
+analysed fit under a fraction of Runtime.maxMemory().
+
+"""
+
+from __future__ import with_statement, division
+import threading
+from java.lang import Runtime
+import tiffheader
+import workers
+
+# Working set of the analysis of one image, in bytes per pixel of a
+# plane, in addition to the decoded image (estimates, rounded up): the
+# split channels at their original bit depth are counted with the
+# decoded image, then 8bit myelin and neurite channels, the cell body
+# mask, the 8bit myelin mask and the attribute filter result and queue
+# (about 12 bytes), and the float hessian, eigenvalue and vesselness
+# images of frangi (about 32 bytes).
+bytesperpixel = 44
+
+
+def workingset(info):
+    """ Estimated peak heap use of analysing one image
+    Parameters
+    ----------
+    info: TiffInfo
+        header of the image.
+    Returns
+    -------
+    bytes: int
+    """
+    if info.hyperstack():
+        # read one plane at a time, plus float projections (hyperstack.py)
+        return 3 * info.planebytes() + (bytesperpixel + 8) * info.width * info.height
+    decoded = info.planebytes() * info.images
+    return 2 * decoded + bytesperpixel * info.width * info.height
+
+
+def estimate(path):
+    """ Working set of an image, or 0 if its header cannot be read
+    An image that cannot be read fails when it is opened, as it would
+    without scheduling.
+    """
+    try:
+        return workingset(tiffheader.readheader(path))
+    except (IOError, KeyError):
+        return 0
+
+
+class MemoryScheduler(object):
+    """ Admits images while their working sets fit in the memory budget
+    One image is always admitted, even if it is larger than the budget,
+    so that every image is analysed.
+    Attributes
+    ----------
+    budget: int
+        bytes available to images being analysed.
+    used: int
+        estimated bytes used by images being analysed.
+    """
+
+    def __init__(self, fraction=0.6):
+        self.budget = int(Runtime.getRuntime().maxMemory() * fraction)
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def admit(self, size):
+        """ Wait until an image of size bytes fits in the budget
+        """
+        with self.condition:
+            while self.used > 0 and self.used + size > self.budget:
+                self.condition.wait()
+            self.used = self.used + size
+
+    def finished(self, size):
+        with self.condition:
+            self.used = self.used - size
+            self.condition.notifyAll()
+
+    def map(self, fn, items, paths, threads=None):
+        """ Apply fn to each item in parallel within the memory budget
+        Items are started in order.
+        Parameters
+        ----------
+        fn: function
+            function taking one item.
+        items: list
+            items to process.
+        paths: list of strings
+            .tif image of each item.
+        threads: int
+            maximum number of worker threads.
+        Returns
+        -------
+        results: list
+            fn(item) for each item, in the order of items.
+        """
+        pool = workers.sharedpool(threads)
+
+        def run(item, size):
+            try:
+                return fn(item)
+            finally:
+                self.finished(size)
+
+        futures = []
+        try:
+            for item, path in zip(items, paths):
+                size = estimate(path)
+                self.admit(size)
+                futures.append(pool.submit(workers.Task(run, (item, size))))
+            return [future.get() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel(True)
@@ -0,0 +1,133 @@
+""" Sharded batch analysis across several nodes
+
+A plate can be divided between several Fiji instances (e.g. the tasks of
+a SLURM job array). Every shard takes a fixed slice of the images (or
+of the subfolders), analyses them with MyelinJanalysis.analyse and
+saves the pixel counts as a partial result file in the folder "shards"
+within the image folder. MyelinJanalysis.mergeshards then reads all of
+the partial results and produces Results.csv, Result-Summary.csv and
+the statistical analysis .csv files.
+
+"""
+
+import os
+import csv
+import metrics
+
+header = ["Position", "Folder", "Image", "Myelin pixels", "Neurite pixels", "Total pixels",
+          "Quality"] + list(metrics.names)
+
+
+def select(work, shard, shards, by="images"):
+    """ This shard's slice of the work
+    Images (or subfolders) are dealt out in turn, so every shard gets a
+    similar number whatever the order of the folders.
+    Parameters
+    ----------
+    work: list of tuples
+        (position, folder index, ...) for every image, in a fixed order.
+    shard: int
+        index of this shard, 0 to shards - 1.
+    shards: int
+        number of shards.
+    by: string
+        "images" or "folders".
+    """
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError("shard index must be between 0 and "+str(shards - 1))
+    if by == "folders":
+        return [w for w in work if w[1] % shards == shard]
+    return [w for w in work if w[0] % shards == shard]
+
+
+def fromenvironment():
+    """ Shard index and count from a SLURM job array
+    The shard index is the position of the task in the array, so
+    stepped arrays (e.g. --array=0-14:2) give indices 0 to count - 1.
+    Returns
+    -------
+    shard, shards: int
+        each None if not set, e.g. when not running as a SLURM array
+        task.
+    Raises
+    ------
+    ValueError if the position of the task is not below the count.
+    """
+    task = os.environ.get("SLURM_ARRAY_TASK_ID")
+    count = os.environ.get("SLURM_ARRAY_TASK_COUNT")
+    shards = int(count) if count is not None else None
+    if task is None:
+        return None, shards
+    first = int(os.environ.get("SLURM_ARRAY_TASK_MIN", "0"))
+    step = int(os.environ.get("SLURM_ARRAY_TASK_STEP", "1"))
+    shard = (int(task) - first) // max(step, 1)
+    if shards is not None and not 0 <= shard < shards:
+        raise ValueError("SLURM array task %s is position %d of an array of %d tasks"
+                         % (task, shard, shards))
+    return shard, shards
+
+
+def partialpath(imagefolder, shard, shards):
+    return os.path.join(imagefolder, "shards",
+                        "Results-shard-%03d-of-%03d.csv" % (shard, shards))
+
+
+def writepartial(imagefolder, shard, shards, rows):
+    """ Save the pixel counts of one shard
+    Image paths are saved relative to the image folder, so shards can be
+    merged on a node where the folder is mounted elsewhere. The file is
+    renamed into place when complete.
+    Parameters
+    ----------
+    rows: list of tuples
+        (position, folder index, image path, myelin pixels, neurite
+        pixels, pixel total, quality, measures).
+    """
+    fullpath = partialpath(imagefolder, shard, shards)
+    if not os.path.exists(os.path.dirname(fullpath)):
+        try:
+            os.makedirs(os.path.dirname(fullpath))
+        except OSError:
+            # made by another shard at the same time
+            pass
+    temporary = fullpath + ".tmp"
+    f = open(temporary, 'wb')
+    writer = csv.writer(f)
+    writer.writerow(header)
+    for position, i, imagepath, myelinpixels, neuritepixels, totalpixels, quality, measures in rows:
+        writer.writerow([position, i, os.path.relpath(imagepath, imagefolder),
+                         myelinpixels, neuritepixels, totalpixels, quality] + list(measures))
+    f.close()
+    if os.path.exists(fullpath):
+        os.remove(fullpath)
+    os.rename(temporary, fullpath)
+
+
+def readpartials(imagefolder, shards):
+    """ Read the pixel counts of all shards
+    Returns
+    -------
+    rows: list of tuples
+        (position, folder index, image path, myelin pixels, neurite
+        pixels, pixel total, quality, measures) in the order of an
+        unsharded analysis.
+    Raises
+    ------
+    IOError if the partial result of any shard is missing.
+    """
+    missing = [str(shard) for shard in range(shards)
+               if not os.path.exists(partialpath(imagefolder, shard, shards))]
+    if len(missing) > 0:
+        raise IOError("missing results for shard(s) "+", ".join(missing))
+    rows = []
+    for shard in range(shards):
+        f = open(partialpath(imagefolder, shard, shards), 'rb')
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            rows.append((int(row[0]), int(row[1]), os.path.join(imagefolder, row[2]),
+                         int(row[3]), int(row[4]), int(row[5]), row[6],
+                         metrics.parse(row[7:])))
+        f.close()
+    rows.sort()
+    return rows
@@ -0,0 +1,174 @@
+""" Analysis of batches of fields of the same size
+
+Plates are mostly thousands of fields of the same size. Fields are
+grouped by size (read from their TIFF headers) and the channels of a
+batch are held as the slices of one ImageStack per channel. Slices share
+the pixel arrays of the fields, so no pixels are copied, and the point
+operations of the analysis are run once per batch: the cell body
+threshold (one lookup table applied to the whole stack), the subtraction
+of the neurite channel or of the rolling ball background and of a
+constant value. These run slice by slice inside ImageJ, so the results
+are the same as for fields analysed one at a time.
+
+Frangi vesselness (Gaussian derivatives) treats a stack as a 3D volume,
+so it is still run per field, as are CLAHE, the myelin and neurite masks
+and the pixel counts, whose results differ between fields.
+
+A batch holds the decoded channels of all of its fields at once, so the
+number of fields in a batch is limited by the memory budget, using the
+working set estimates of scheduler.py.
+
+"""
+
+from ij import IJ, ImagePlus, ImageStack, Prefs
+from ij.plugin import ImageCalculator
+from ij.process import StackProcessor
+import bufferpool
+import scheduler
+import stages
+import tiffheader
+
+
+def shape(path):
+    """ Size of an image and its working set, see scheduler.workingset
+    Returns
+    -------
+    key: tuple
+        (width, height, bit depth, samples, channels), images with the
+        same key can be analysed as one batch. None for z-stacks,
+        time-lapse images and images whose header cannot be read.
+    workingset: int
+        estimated bytes used by the analysis of the image.
+    """
+    try:
+        info = tiffheader.readheader(path)
+    except (IOError, KeyError):
+        return None, 0
+    if info.hyperstack():
+        return None, 0
+    return (info.width, info.height, info.bitdepth, info.samples,
+            info.channels), scheduler.workingset(info)
+
+
+def batchsize(workingset, budget, limit):
+    """ Number of fields of a batch within the memory budget
+    At least one, so that every image is analysed.
+    """
+    if workingset <= 0:
+        return 1
+    return int(max(1, min(limit, budget // workingset)))
+
+
+def batches(paths, budget, limit):
+    """ Groups of .tif images analysed together
+    Parameters
+    ----------
+    paths: list of strings
+        .tif images.
+    budget: int
+        bytes available to one batch.
+    limit: int
+        maximum number of fields of a batch.
+    Returns
+    -------
+    batches: list of lists of strings
+        images of the same size in the order of paths, sizes in the
+        order they first appear. Images that cannot be batched are
+        alone in their batch.
+    """
+    groups = {}
+    order = []
+    single = []
+    for path in paths:
+        key, workingset = shape(path)
+        if key is None or limit <= 1:
+            single.append([path])
+            continue
+        if key not in groups:
+            groups[key] = []
+            order.append((key, workingset))
+        groups[key].append(path)
+    result = []
+    for key, workingset in order:
+        group = groups[key]
+        size = batchsize(workingset, budget, limit)
+        result.extend([group[x:x + size] for x in range(0, len(group), size)])
+    return result + single
+
+
+def stack(imps, title="batch"):
+    """ ImagePlus with the processors of images as slices
+    The slices share the pixel arrays of the images.
+    """
+    first = imps[0]
+    slices = ImageStack(first.getWidth(), first.getHeight())
+    for imp in imps:
+        slices.addSlice(imp.getTitle(), imp.getProcessor())
+    batch = ImagePlus(title, slices)
+    batch.setCalibration(first.getCalibration())
+    return batch
+
+
+def cellbodymasks(greens, readsettings):
+    """ Cell body masks of a batch, see stages.cellbodymask
+    The threshold is applied to all fields at once.
+    Returns
+    -------
+    masks: list of ImagePlus
+        one for each field, None if cell bodies are not removed.
+    """
+    if (readsettings[0] == "0") and (readsettings[1] == "0"):
+        return [None] * len(greens)
+    masks = [stages.duplicate(green) for green in greens]
+    Prefs.blackBackground = True
+    StackProcessor(stack(masks).getStack()).applyTable(
+        bufferpool.thresholdlut(int(readsettings[0]), int(readsettings[1])))
+    return [stages.removeoutliers(mask, readsettings) for mask in masks]
+
+
+def preprocessmyelin(greens, reds, readsettings):
+    """ CLAHE and background subtraction of a batch, in place
+    See stages.preprocessmyelin. CLAHE is run per field.
+    """
+    if readsettings[8] == "True":
+        import mpicbg.ij.clahe.Flat
+        for green in greens:
+            mpicbg.ij.clahe.Flat.getFastInstance().run(green, 127, 256, 3, None, False)
+    batch = stack(greens)
+    if readsettings[9] == "True":
+        ImageCalculator().run("Subtract stack", batch, stack(reds))
+    elif readsettings[6] == "True":
+        IJ.run(batch, "Subtract Background...", "rolling=50 stack")
+    if readsettings[10] != "0":
+        IJ.run(batch, "Subtract...", "value="+readsettings[10]+" stack")
+    return greens
+
+
+def finalmasks(greens, reds, readsettings, cache, timed):
+    """ Final myelin and neurite masks of a batch of fields
+    The batch counterpart of MyelinJanalysis.finalmasks, the channels
+    are processed in place.
+    Parameters
+    ----------
+    greens, reds: lists of ImagePlus
+        8bit myelin and neurite channels of fields of the same size.
+    Returns
+    -------
+    masks: list of (ImagePlus, ImagePlus)
+        myelin and neurite mask of each field.
+    """
+    cellbodies = cellbodymasks(greens, readsettings)
+    timed("cell bodies")
+    greens = preprocessmyelin(greens, reds, readsettings)
+    timed("preprocess")
+    masks = []
+    for green, red, green2 in zip(greens, reds, cellbodies):
+        green = stages.frangi(green, cache)
+        timed("frangi")
+        green = stages.myelinmask(green, green2, readsettings)
+        stages.release(green2)
+        timed("myelin")
+        red = stages.neuritemask(red, readsettings)
+        timed("neurites")
+        masks.append((green, red))
+    return masks
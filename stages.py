@@ -0,0 +1,242 @@
+""" Image analysis stages for MyelinJanalysis.py
+
+Each stage of the analysis of a single image is a separate function so
+that the expensive upstream stages (decoding, CLAHE, background
+subtraction and frangi vesselness) can be run once per image and their
+output shared by the cheaper downstream stages (cell body selection,
+thresholding, grey scale attribute filtering and neurite segmentation).
+All stages take the flat list of user settings read from the user name
+.csv file (readsettings, see MyelinJanalysis.getsettings). Stages with
+radii in pixels take a scale, so a downsampled copy of an image (e.g.
+for previews, see preview.py) is processed with proportionally smaller
+radii.
+Duplicates are taken from a shared BufferPool (pool) and subtraction,
+thresholding and LUT inversion are performed in place, so buffers can
+be released back to the pool once an image has been analysed.
+
+"""
+
+from __future__ import with_statement
+import threading
+from ij import IJ, ImagePlus, Prefs
+from ij.plugin import ChannelSplitter
+from ij.process import ImageConverter
+import bufferpool
+
+pool = bufferpool.BufferPool()
+# frangi returns its result as the active image, so only one thread may
+# run it (or close image windows) at a time
+windowlock = threading.RLock()
+
+
+def duplicate(imp):
+    """ Duplicate an image using a pooled buffer
+    """
+    copy = ImagePlus(imp.getTitle(), pool.copy(imp.getProcessor()))
+    copy.setCalibration(imp.getCalibration())
+    return copy
+
+
+def scaled(radius, scale, minimum=1):
+    """ Radius in pixels of an image downsampled by scale, as a string
+    """
+    if scale == 1:
+        return str(radius)
+    return str(max(int(round(float(radius) * scale)), minimum))
+
+
+def release(*imps):
+    """ Return the buffers of images that are no longer needed to the pool
+    """
+    for imp in imps:
+        if imp is not None:
+            pool.release(imp.getProcessor())
+
+
+def splitchannels(imp, g, r):
+    """ Split channels and convert to 8bit grey scale
+    Parameters
+    ----------
+    imp: ImagePlus
+        merged .tif image.
+    g: int
+        position of the myelin channel.
+    r: int
+        position of the neurite channel.
+    Returns
+    -------
+    green, red: ImagePlus
+        8bit myelin and neurite channels.
+    """
+    channels = ChannelSplitter.split(imp)
+    green = channels[g]
+    red = channels[r]
+    ImageConverter(red).convertToGray8()
+    ImageConverter(green).convertToGray8()
+    return green, red
+
+
+def cellbodymask(green, readsettings, scale=1):
+    """ Threshold the myelin channel to select cell bodies
+    The myelin channel is not changed.
+    Returns
+    -------
+    green2: ImagePlus
+        mask of cell bodies or None if cell bodies are not removed.
+    """
+    if (readsettings[0] == "0") and (readsettings[1] == "0"):
+        return None
+    green2 = duplicate(green)
+    Prefs.blackBackground = True
+    bufferpool.threshold(green2, int(readsettings[0]), int(readsettings[1]))
+    return removeoutliers(green2, readsettings, scale)
+
+
+def removeoutliers(green2, readsettings, scale=1):
+    """ Finish a thresholded cell body mask
+    Inverts the LUT and removes outliers smaller than the cell body
+    radius, in place.
+    """
+    bufferpool.invertlut(green2)
+    if readsettings[7] != "0":
+        IJ.run(green2, "Make Binary", "")
+        IJ.run(green2, "Remove Outliers...", "radius="+scaled(readsettings[7], scale)+" threshold=50 which=Dark")
+    return green2
+
+
+def preprocessmyelin(green, red, readsettings, scale=1):
+    """ CLAHE and background subtraction of the myelin channel
+    All processing is performed in place.
+    Parameters
+    ----------
+    green: ImagePlus
+        8bit myelin channel.
+    red: ImagePlus
+        unprocessed 8bit neurite channel.
+    Returns
+    -------
+    green: ImagePlus
+        processed myelin channel.
+    """
+    if readsettings[8] == "True":
+        # CLAHE and MorpholibJ are only loaded once an image is analysed
+        import mpicbg.ij.clahe.Flat
+        mpicbg.ij.clahe.Flat.getFastInstance().run(green, int(scaled(127, scale, 8)), 256, 3, None, False)
+    if readsettings[9] == "True":
+        bufferpool.subtract(green, red)
+    elif readsettings[6] == "True":
+        IJ.run(green, "Subtract Background...", "rolling="+scaled(50, scale))
+    if readsettings[10] != "0":
+        IJ.run(green, "Subtract...", "value="+readsettings[10])
+    return green
+
+
+def frangi(green, cache=None):
+    """ Frangi vesselness
+    Run at the scale of one pixel. The plugin displays its result, which
+    is retrieved as the active image and hidden, holding windowlock so
+    images analysed in parallel are not mixed up. Hiding also keeps
+    closing image windows from flushing its pixels once they are
+    released to pool.
+    Parameters
+    ----------
+    green: ImagePlus
+        processed 8bit myelin channel.
+    cache: FrangiCache
+        disk cache of vesselness images (see frangicache) or None.
+    Returns
+    -------
+    vesselness: ImagePlus
+        32bit frangi vesselness image.
+    """
+    if cache is not None:
+        key = cache.key(green)
+        vesselness = cache.get(key, green.getCalibration())
+        if vesselness is not None:
+            return vesselness
+    pixelwidth = str(green.getCalibration().pixelWidth)
+    with windowlock:
+        IJ.run(green, "Frangi Vesselness (imglib, experimental)",
+               "number=1 minimum="+pixelwidth+" maximum="+pixelwidth)
+        vesselness = IJ.getImage()
+        vesselness.hide()
+    if cache is not None:
+        cache.put(key, vesselness)
+    return vesselness
+
+
+def myelinmask(vesselness, cellbodies, readsettings, scale=1):
+    """ Final myelin mask from the frangi vesselness image
+    Converts to a mask, removes cell bodies and runs the grey scale
+    attribute filter (box diagonal opening) from MorpholibJ. The
+    vesselness image is converted in place (the 8bit conversion and the
+    attribute filter still create new processors).
+    Parameters
+    ----------
+    vesselness: ImagePlus
+        32bit frangi vesselness image.
+    cellbodies: ImagePlus
+        mask of cell bodies from cellbodymask or None.
+    Returns
+    -------
+    green: ImagePlus
+        myelin mask.
+    """
+    green = vesselness
+    ImageConverter(green).convertToGray8()
+    IJ.run(green, "Convert to Mask", "")
+    if cellbodies is not None:
+        bufferpool.subtract(green, cellbodies)
+    if readsettings[11] != "0":
+        from inra.ijpb.morphology.attrfilt import BoxDiagonalOpeningQueue
+        algo = BoxDiagonalOpeningQueue()
+        algo.setConnectivity(4)
+        result = algo.process(green.getProcessor(), int(scaled(readsettings[11], scale)))
+        green.setProcessor(result)
+    bufferpool.invertlut(green)
+    return green
+
+
+def neuritemask(red, readsettings, scale=1):
+    """ Neurite mask
+    Sparse neurite settings (from Dialog6) threshold the neurite channel
+    after optional CLAHE and background subtraction, otherwise dense
+    neurite settings use normalise local contrast and the default auto
+    threshold. The neurite channel is processed in place.
+    Returns
+    -------
+    red: ImagePlus
+        neurite mask.
+    """
+    if len(readsettings) > 14:
+        # sparse neurite image analysis
+        if readsettings[15] == "True":
+            IJ.run(red, "Enhance Local Contrast (CLAHE)", "blocksize="+scaled(127, scale, 8)+" histogram=256 maximum=3 mask=*None* fast_(less_accurate)")
+        if readsettings[14] == "True":
+            IJ.run(red, "Subtract Background...", "rolling="+scaled(50, scale))
+        IJ.setAutoThreshold(red, readsettings[16])
+        IJ.setRawThreshold(red, int(readsettings[17]), int(readsettings[18]), None)
+        IJ.run(red, "Convert to Mask", "")
+        IJ.run(red, "Invert LUT", "")
+    else:
+        # dense neurite image analysis
+        radius = scaled(40, scale)
+        IJ.run(red, "Normalize Local Contrast", "block_radius_x="+radius+" block_radius_y="+radius+" standard_deviations="+readsettings[12]+" center stretch")
+        IJ.run(red, "Auto Threshold", "method=Default white")
+        IJ.run(red, "Invert LUT", "")
+    if readsettings[3] == "True":
+        IJ.run(red, "Despeckle", "")
+    return red
+
+
+def countpixels(mask):
+    """ Number of foreground pixels in a mask
+    Returns
+    -------
+    foreground: int
+        number of pixels with value 255.
+    total: int
+        number of pixels with value 0 or 255.
+    """
+    histogram = mask.getProcessor().getHistogram()
+    return histogram[255], histogram[0] + histogram[255]
@@ -0,0 +1,137 @@
+""" Parameter sweep for MyelinJ_.py
+
+Runs a grid of values for the cheaper user settings (Min, Max, radius,
+greyscaleMinVal and contrast) over a sample of images. The expensive
+upstream stages (decoding, CLAHE, background subtraction and frangi
+vesselness) are run once per image and only the downstream stages are
+repeated for each grid point, in parallel. The result is a table of
+% myelination and % neurite density for each grid point.
+
+"""
+
+from __future__ import with_statement, division
+import csv
+import itertools
+from ij import IJ
+import stages
+import workers
+
+# settings that can be swept and their position in readsettings
+parameters = (("Min", 0), ("Max", 1), ("radius", 7),
+              ("greyscaleMinVal", 11), ("contrast", 12))
+
+
+def sampleimages(paths, n):
+    """ Select n images evenly spaced through paths
+    """
+    if n >= len(paths):
+        return list(paths)
+    step = len(paths) / n
+    return [paths[int(i * step)] for i in range(n)]
+
+
+def upstream(path, readsettings, cache=None):
+    """ Expensive stages shared by all grid points
+    Parameters
+    ----------
+    path: string
+        path to .tif image.
+    readsettings: list of strings
+        user settings.
+    cache: FrangiCache
+        disk cache of vesselness images or None.
+    Returns
+    -------
+    images: dictionary
+        unprocessed 8bit myelin (green) and neurite (red) channels and
+        the frangi vesselness image of the processed myelin channel.
+    """
+    imp = IJ.openImage(path)
+    green, red = stages.splitchannels(imp, int(readsettings[4]), int(readsettings[5]))
+    images = {"green": green.duplicate(), "red": red}
+    green = stages.preprocessmyelin(green, red, readsettings)
+    vesselness = stages.frangi(green, cache)
+    images["vesselness"] = vesselness
+    return images
+
+
+def downstream(images, readsettings):
+    """ Cheap stages run for each grid point
+    The cached images are duplicated into pooled buffers so they can be
+    reused.
+    Returns
+    -------
+    myelinpixels, neuritepixels, totalpixels: int
+        pixel counts of the myelin and neurite masks.
+    """
+    cellbodies = stages.cellbodymask(images["green"], readsettings)
+    vesselness = stages.duplicate(images["vesselness"])
+    buffer = vesselness.getProcessor()
+    myelin = stages.myelinmask(vesselness, cellbodies, readsettings)
+    neurites = stages.neuritemask(stages.duplicate(images["red"]), readsettings)
+    myelinpixels, total = stages.countpixels(myelin)
+    neuritepixels, totalpixels = stages.countpixels(neurites)
+    stages.pool.release(buffer)
+    stages.release(cellbodies, neurites)
+    return myelinpixels, neuritepixels, totalpixels
+
+
+def percentages(counts):
+    """ Average % myelination and % neurite density
+    Calculated as in MyelinJanalysis.analyse.
+    Parameters
+    ----------
+    counts: list of tuples
+        (myelinpixels, neuritepixels, totalpixels) for each image.
+    """
+    myelination = [m / n * 100 if n else 0 for (m, n, t) in counts]
+    neuritedensity = [n / t * 100 for (m, n, t) in counts]
+    return (sum(myelination) / len(myelination),
+            sum(neuritedensity) / len(neuritedensity))
+
+
+def sweep(readsettings, paths, grid, threads=None, cache=None):
+    """ Run a parameter sweep
+    Parameters
+    ----------
+    readsettings: list of strings
+        user settings, values not in grid are kept.
+    paths: list of strings
+        sample of .tif images.
+    grid: dictionary
+        name of each setting (see parameters) and a list of values (strings).
+    threads: int
+        number of worker threads, defaults to the number of processors.
+    cache: FrangiCache
+        disk cache of vesselness images or None.
+    Returns
+    -------
+    names: list of strings
+        names of the settings swept.
+    rows: list of tuples
+        values of each setting followed by % myelination and % neurite
+        density, for each grid point.
+    """
+    names = [name for (name, index) in parameters if name in grid]
+    positions = dict(parameters)
+    points = list(itertools.product(*[grid[name] for name in names]))
+    upstreams = [upstream(path, readsettings, cache) for path in paths]
+
+    def evaluate(point):
+        settings = list(readsettings)
+        for name, value in zip(names, point):
+            settings[positions[name]] = value
+        counts = [downstream(images, settings) for images in upstreams]
+        return tuple(point) + percentages(counts)
+
+    return names, workers.parallelmap(evaluate, points, threads)
+
+
+def writesweep(fullpath, names, rows):
+    """ Save the sweep as a .csv file with one row per grid point
+    """
+    f = open(fullpath, 'wb')
+    writer = csv.writer(f)
+    writer.writerow(list(names) + ["% myelination", "% neurite density"])
+    writer.writerows(rows)
+    f.close()
@@ -0,0 +1,115 @@
+""" Auto-threshold explorer for MyelinJ_.py
+
+Computes every ImageJ auto-threshold method from one 256-bin histogram
+and displays the resulting masks side by side, so that a threshold
+method can be chosen in one pass rather than by trying each method in
+turn from the Dialog4/Dialog6 comboboxes.
+
+"""
+
+from ij import IJ, ImagePlus, ImageStack
+from ij.gui import ImageWindow
+from ij.plugin import MontageMaker
+from ij.process import AutoThresholder
+import jarray
+
+# threshold methods offered in Dialog4 (autoT) and Dialog6 (autoT2)
+methods = ("Default", "Huang", "Intermodes", "IsoData", "Li", "MaxEntropy",
+           "Mean", "MinError", "Minimum", "Moments", "Otsu", "Percentile",
+           "RenyiEntropy", "Shanbhag", "Triangle", "Yen")
+
+def gethistogram(ip):
+    """ 256-bin histogram of an 8-bit processor
+    Counted once per call and shared by every threshold method.
+    Parameters
+    ----------
+    ip: ImageProcessor
+        8-bit image.
+    Returns
+    -------
+    histogram: int[]
+        256-bin histogram.
+    """
+    return ip.getHistogram()
+
+
+def allthresholds(histogram):
+    """ Threshold level for every auto-threshold method
+    Parameters
+    ----------
+    histogram: int[]
+        256-bin histogram.
+    Returns
+    -------
+    levels: list of (string, int)
+        method name and threshold level, in the order of methods.
+    """
+    thresholder = AutoThresholder()
+    levels = []
+    for method in methods:
+        try:
+            levels.append((method, thresholder.getThreshold(method, histogram)))
+        except Exception:
+            # some methods fail to converge on degenerate histograms
+            levels.append((method, -1))
+    return levels
+
+
+def masklut(level, dark):
+    """ Lookup table turning an 8-bit image into a mask at level
+    As with IJ.setAutoThreshold, pixels above the level are foreground
+    for a dark background, otherwise pixels at or below the level.
+    """
+    if dark is True:
+        lut = [255 if i > level else 0 for i in range(256)]
+    else:
+        lut = [255 if i <= level else 0 for i in range(256)]
+    return jarray.array(lut, 'i')
+
+
+def explore(imp, dark=True, maxwidth=None):
+    """ Display masks for all threshold methods side by side
+    Thresholds are calculated from the full resolution histogram, masks
+    are drawn on a downscaled copy so the montage fits on screen.
+    Parameters
+    ----------
+    imp: ImagePlus
+        8-bit image (myelin or neurite channel).
+    dark: bool
+        objects are bright on a dark background (" dark" option of
+        IJ.setAutoThreshold).
+    maxwidth: int
+        maximum width of the montage, defaults to the screen width.
+    Returns
+    -------
+    levels: list of (string, int)
+        method name and threshold level.
+    """
+    ip = imp.getProcessor()
+    levels = allthresholds(gethistogram(ip))
+
+    columns = 4
+    rows = (len(levels) + columns - 1) // columns
+    if maxwidth is None:
+        maxwidth = int(IJ.getScreenSize().width * 0.6)
+    scale = min(1.0, maxwidth / float(ip.getWidth() * columns))
+    small = ip.resize(max(1, int(ip.getWidth() * scale)),
+                      max(1, int(ip.getHeight() * scale)))
+
+    stack = ImageStack(small.getWidth(), small.getHeight())
+    for method, level in levels:
+        mask = small.duplicate()
+        if level >= 0:
+            mask.applyTable(masklut(level, dark))
+        else:
+            mask.setValue(0)
+            mask.fill()
+        stack.addSlice(method + " (" + str(level) + ")", mask)
+    masks = ImagePlus("threshold methods", stack)
+    montage = MontageMaker().makeMontage2(masks, columns, rows, 1.0, 1,
+                                          len(levels), 1, 2, True)
+    montage.setTitle("threshold methods")
+    ImageWindow.setNextLocation(int(IJ.getScreenSize().width * 1/3),
+                                int(IJ.getScreenSize().height * 1/14))
+    montage.show()
+    return levels
@@ -0,0 +1,211 @@
+""" Read the dimensions of .tif images without decoding pixels
+
+Only the header and the first image file directory (IFD) are read, with
+the ImageJ description if present, so large batches can be planned and
+scheduled quickly. Used by scheduler.py and preflight.py.
+
+"""
+
+from __future__ import division
+import os
+import re
+import struct
+
+# TIFF tags
+WIDTH = 256
+LENGTH = 257
+BITSPERSAMPLE = 258
+COMPRESSION = 259
+DESCRIPTION = 270
+STRIPOFFSETS = 273
+SAMPLESPERPIXEL = 277
+STRIPBYTECOUNTS = 279
+
+# size in bytes of each TIFF field type
+typesizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+typeformats = {1: "B", 3: "H", 4: "I", 6: "b", 8: "h", 9: "i"}
+
+
+class TiffInfo(object):
+    """ Dimensions of a .tif image
+    Attributes
+    ----------
+    width, height: int
+        size of each plane in pixels.
+    bitdepth: int
+        bits per sample (8, 16 or 32).
+    samples: int
+        samples per pixel (3 for RGB).
+    channels, slices, frames: int
+        hyperstack dimensions from the ImageJ description, or channels
+        equal to the number of pages (or samples) for other files.
+    images: int
+        number of planes.
+    compression: int
+        TIFF compression (1 is uncompressed).
+    filesize: int
+        size of the file in bytes.
+    truncated: bool
+        pixel data ends beyond the end of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.width = 0
+        self.height = 0
+        self.bitdepth = 8
+        self.samples = 1
+        self.channels = 1
+        self.slices = 1
+        self.frames = 1
+        self.images = 1
+        self.compression = 1
+        self.filesize = os.path.getsize(path)
+        self.truncated = False
+
+    def planebytes(self):
+        """ Bytes in one decoded plane
+        """
+        return self.width * self.height * self.samples * max(self.bitdepth // 8, 1)
+
+    def megapixels(self):
+        return self.width * self.height / 1e6
+
+    def hyperstack(self):
+        """ True for z-stacks and time-lapse images
+        """
+        return self.slices > 1 or self.frames > 1
+
+    def __repr__(self):
+        return "TiffInfo(%s, %dx%d, %d bit, c=%d z=%d t=%d)" % (
+            os.path.basename(self.path), self.width, self.height, self.bitdepth,
+            self.channels, self.slices, self.frames)
+
+
+def readvalue(f, order, fieldtype, count, valueoffset):
+    """ Values of an IFD entry, read from the entry or from its offset
+    """
+    size = typesizes.get(fieldtype, 1) * count
+    if fieldtype not in typeformats and fieldtype != 2:
+        return None
+    if size <= 4:
+        data = valueoffset[:size]
+    else:
+        offset = struct.unpack(order+"I", valueoffset)[0]
+        position = f.tell()
+        f.seek(offset)
+        data = f.read(size)
+        f.seek(position)
+        if len(data) < size:
+            raise IOError("truncated TIFF header")
+    if fieldtype == 2:
+        return data.rstrip(b"\0").decode("latin-1")
+    return struct.unpack(order+typeformats[fieldtype]*count, data)
+
+
+def readheader(path):
+    """ Dimensions of a .tif image
+    Raises
+    ------
+    IOError if the file cannot be read, is not a TIFF or its header is
+    truncated or malformed (e.g. missing tags, tags of unexpected types
+    or an ImageJ description with non-numeric dimensions), so callers
+    only need to handle IOError.
+    """
+    try:
+        return parseheader(path)
+    except (OSError, KeyError, IndexError, TypeError, ValueError, struct.error) as error:
+        raise IOError("malformed TIFF header: "+str(error))
+
+
+def parseheader(path):
+    """ Dimensions of a .tif image, see readheader
+    """
+    info = TiffInfo(path)
+    f = open(path, 'rb')
+    try:
+        header = f.read(8)
+        if len(header) < 8:
+            raise IOError("truncated TIFF header")
+        if header[:2] == b"II":
+            order = "<"
+        elif header[:2] == b"MM":
+            order = ">"
+        else:
+            raise IOError("not a TIFF file")
+        magic, offset = struct.unpack(order+"HI", header[2:])
+        if magic != 42:
+            raise IOError("not a TIFF file (or BigTIFF, which is not supported)")
+        f.seek(offset)
+        data = f.read(2)
+        if len(data) < 2:
+            raise IOError("truncated TIFF header")
+        entries = struct.unpack(order+"H", data)[0]
+        tags = {}
+        for i in range(entries):
+            entry = f.read(12)
+            if len(entry) < 12:
+                raise IOError("truncated TIFF header")
+            tag, fieldtype, count = struct.unpack(order+"HHI", entry[:8])
+            if tag in (WIDTH, LENGTH, BITSPERSAMPLE, COMPRESSION, DESCRIPTION,
+                       STRIPOFFSETS, SAMPLESPERPIXEL, STRIPBYTECOUNTS):
+                tags[tag] = readvalue(f, order, fieldtype, count, entry[8:])
+        nextifd = f.read(4)
+    finally:
+        f.close()
+
+    info.width = tags[WIDTH][0]
+    info.height = tags[LENGTH][0]
+    info.bitdepth = tags.get(BITSPERSAMPLE, (1,))[0]
+    info.samples = tags.get(SAMPLESPERPIXEL, (1,))[0]
+    info.compression = tags.get(COMPRESSION, (1,))[0]
+    description = tags.get(DESCRIPTION) or u""
+    if description.startswith("ImageJ"):
+        fields = dict(re.findall(r"(\w+)=(\S+)", description))
+        info.images = int(fields.get("images", 1))
+        info.channels = int(fields.get("channels", 1))
+        info.slices = int(fields.get("slices", 1))
+        info.frames = int(fields.get("frames", 1))
+        if info.channels * info.slices * info.frames == 1 and info.images > 1:
+            info.slices = info.images
+    elif info.samples > 1:
+        info.channels = info.samples
+    elif len(nextifd) == 4 and struct.unpack(order+"I", nextifd)[0] != 0:
+        # pages of a multipage .tif are opened as channels
+        info.images = countpages(path, order, struct.unpack(order+"I", nextifd)[0])
+        info.channels = info.images
+    if info.samples > 1:
+        info.channels = max(info.channels, info.samples)
+
+    # pixel data must lie within the file
+    offsets = tags.get(STRIPOFFSETS) or (0,)
+    counts = tags.get(STRIPBYTECOUNTS) or (0,)
+    end = max([o + c for (o, c) in zip(offsets, counts)] + [0])
+    if info.compression == 1 and description.startswith("ImageJ"):
+        # ImageJ saves the planes of a stack contiguously
+        end = max(end, offsets[0] + info.planebytes() * info.images)
+    info.truncated = end > info.filesize
+    return info
+
+
+def countpages(path, order, offset, limit=10000):
+    """ Number of IFDs of a multipage .tif
+    """
+    pages = 1
+    f = open(path, 'rb')
+    try:
+        while offset != 0 and pages < limit:
+            f.seek(offset)
+            data = f.read(2)
+            if len(data) < 2:
+                break
+            entries = struct.unpack(order+"H", data)[0]
+            f.seek(offset + 2 + entries * 12)
+            data = f.read(4)
+            if len(data) < 4:
+                break
+            offset = struct.unpack(order+"I", data)[0]
+            pages = pages + 1
+    finally:
+        f.close()
+    return pages
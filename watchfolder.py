@@ -0,0 +1,209 @@
+""" Watch an acquisition folder and analyse images as they arrive
+
+Microscopes write the fields of a plate over several hours. Instead of
+waiting for the whole plate, the acquisition folder is polled and every
+new .tif is analysed as soon as its size has stopped changing, using a
+saved user name. Results.csv of each folder is rewritten after every
+image, so results are always up to date. When the completion marker
+file appears in the acquisition folder the remaining images are
+analysed and the summary and statistical analysis are produced, as at
+the end of MyelinJanalysis.analyse.
+
+Polling is used rather than file system notifications so that network
+shares, where notifications are unreliable, can be watched.
+
+"""
+
+from __future__ import division
+import os
+import csv
+import time
+import threading
+from java.lang import Throwable
+from ij import IJ
+import MyelinJanalysis
+import metrics
+
+# folders inside the acquisition folder that never contain images
+ignored = ("shards", "statistical analysis")
+statefile = "Watch-state.csv"
+
+
+class WatchFolder(object):
+    """ Streaming analysis of an acquisition folder
+    Attributes
+    ----------
+    marker: string
+        name of the file written when acquisition is complete.
+    interval: float
+        seconds between polls.
+    processed: dictionary
+        image path relative to the acquisition folder and its pixel
+        counts (myelin, neurite, total), quality and measures (see
+        metrics.py), kept in Watch-state.csv so that
+        a restarted watcher does not analyse images again. Images that
+        could not be analysed are kept as skipped, with the error as
+        their quality.
+    """
+
+    def __init__(self, cwd, user, imagefolder, multi, marker="acquisition.done",
+                 interval=10, stats=False, experiments=None, names=None,
+                 Rloc2="", statsfolderPath="", cwdR=""):
+        self.cwd = cwd
+        self.imagefolder = os.path.join(imagefolder, "")
+        self.multi = multi
+        self.marker = marker
+        self.interval = interval
+        self.stats = stats
+        self.experiments = experiments or []
+        self.names = names or []
+        self.Rloc2 = Rloc2
+        self.statsfolderPath = statsfolderPath
+        self.cwdR = cwdR
+        self.readsettings = MyelinJanalysis.getsettings(cwd, user)
+        self.cache = MyelinJanalysis.getcache(cwd)
+        self.sizes = {}
+        self.processed = {}
+        self.stopped = False
+        self.finished = False
+        self.readstate()
+
+    def subfoldernames(self):
+        """ Subfolders (experiments) found so far, or [1] if not multi
+        """
+        if self.multi is not True:
+            return [1]
+        return sorted([d for d in next(os.walk(self.imagefolder))[1] if d not in ignored])
+
+    def readstate(self):
+        fullpath = os.path.join(self.imagefolder, statefile)
+        if os.path.exists(fullpath):
+            f = open(fullpath, 'rb')
+            for row in csv.reader(f):
+                self.processed[row[0]] = (int(row[1]), int(row[2]), int(row[3]), row[4],
+                                          metrics.parse(row[5:]))
+            f.close()
+
+    def writestate(self):
+        fullpath = os.path.join(self.imagefolder, statefile)
+        f = open(fullpath+".tmp", 'wb')
+        writer = csv.writer(f)
+        for relpath in sorted(self.processed):
+            m, n, t, quality, measures = self.processed[relpath]
+            writer.writerow([relpath, m, n, t, quality] + list(measures))
+        f.close()
+        if os.path.exists(fullpath):
+            os.remove(fullpath)
+        os.rename(fullpath+".tmp", fullpath)
+
+    def stable(self, fullpath):
+        """ True once the size and time of a file are unchanged between polls
+        """
+        try:
+            current = (os.path.getsize(fullpath), os.path.getmtime(fullpath))
+        except OSError:
+            return False
+        previous = self.sizes.get(fullpath)
+        self.sizes[fullpath] = current
+        return current[0] > 0 and previous == current
+
+    def counts(self, subfoldernames):
+        """ Pixel counts of the processed images of each folder
+        """
+        counts = []
+        for subfolder in subfoldernames:
+            settings2 = MyelinJanalysis.folderpath(self.imagefolder, subfolder, self.multi)
+            rows = []
+            for root, name in MyelinJanalysis.listimages(settings2):
+                relpath = os.path.relpath(os.path.join(root, name), self.imagefolder)
+                if relpath in self.processed:
+                    rows.append((name,) + self.processed[relpath])
+            counts.append(rows)
+        return counts
+
+    def updatefolder(self, subfolder):
+        """ Rewrite Results.csv of a folder with the images analysed so far
+        """
+        settings2 = MyelinJanalysis.folderpath(self.imagefolder, subfolder, self.multi)
+        rows = self.counts([subfolder])[0]
+        if len(rows) > 0:
+            result, myelinaverage, neuriteaverage = MyelinJanalysis.folderresults(
+                [row[0] for row in rows], [row[1] for row in rows],
+                [row[2] for row in rows], [row[3] for row in rows],
+                [row[4] for row in rows], [row[5] for row in rows])
+            MyelinJanalysis.writeresult(os.path.join(settings2, "Results.csv"), result)
+
+    def poll(self, final=False):
+        """ Analyse new images whose size is stable
+        Parameters
+        ----------
+        final: bool
+            acquisition is complete, analyse every remaining image.
+        Returns
+        -------
+        analysed: int
+            number of images analysed.
+        """
+        analysed = 0
+        for subfolder in self.subfoldernames():
+            settings2 = MyelinJanalysis.folderpath(self.imagefolder, subfolder, self.multi)
+            changed = False
+            for root, name in MyelinJanalysis.listimages(settings2):
+                fullpath = os.path.join(root, name)
+                relpath = os.path.relpath(fullpath, self.imagefolder)
+                if relpath in self.processed or self.stopped:
+                    continue
+                if final is True or self.stable(fullpath):
+                    self.processed[relpath] = self.analyseimage(fullpath, settings2)
+                    self.writestate()
+                    analysed = analysed + 1
+                    changed = True
+            if changed is True:
+                self.updatefolder(subfolder)
+        return analysed
+
+    def analyseimage(self, fullpath, settings2):
+        """ Counts of an image, see MyelinJanalysis.analyseimage
+        An image that cannot be analysed (e.g. corrupt or still being
+        written) is logged and counted as skipped, so one image does not
+        stop the watcher.
+        """
+        try:
+            return MyelinJanalysis.analyseimage(fullpath, settings2, self.readsettings,
+                                                self.cache)
+        except (Exception, Throwable) as error:
+            error = " ".join(str(error).split())
+            IJ.log("MyelinJ watch folder: "+fullpath+" could not be analysed: "+error)
+            return 0, 0, 0, "skipped: failed: "+error, metrics.empty()
+
+    def finish(self):
+        """ Analyse remaining images and save summary and statistics
+        """
+        self.poll(final=True)
+        subfoldernames = self.subfoldernames()
+        MyelinJanalysis.finishfolders(self.imagefolder, self.stats, self.experiments,
+                                      self.multi, self.Rloc2, subfoldernames, self.names,
+                                      self.statsfolderPath, self.cwdR,
+                                      self.counts(subfoldernames))
+        self.finished = True
+
+    def run(self):
+        """ Poll until the completion marker appears or stop is called
+        """
+        while not self.stopped:
+            self.poll()
+            if os.path.exists(os.path.join(self.imagefolder, self.marker)):
+                self.finish()
+                return
+            time.sleep(self.interval)
+
+    def start(self):
+        """ Run in a background thread
+        """
+        thread = threading.Thread(target=self.run, name="MyelinJ watch folder")
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped = True
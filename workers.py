@@ -0,0 +1,115 @@
+""" Worker threads for MyelinJ
+
+Jython threads are Java threads and Jython has no global interpreter
+lock, so image processing run through a Java thread pool is executed in
+parallel, python code included. Workers share the Java heap with the
+caller, so images are passed to them by reference and never copied, and
+buffers are shared through stages.pool.
+
+A separate process pool would have to copy every image between
+processes, so threads are used throughout. Pools are kept for the whole
+run rather than started and shut down for every folder, batch and call
+of parallelmap: sharedpool returns the same daemon threads for every
+call with the same number of threads, so a run never has more worker
+threads than it asked for.
+
+"""
+
+from __future__ import with_statement
+import threading
+from java.lang import Runtime, Thread
+from java.util.concurrent import Callable, Executors, ThreadFactory
+
+# shared pools by number of threads
+pools = {}
+poolslock = threading.Lock()
+
+
+class Daemon(ThreadFactory):
+    """ Named daemon threads, so idle or pending work does not keep Fiji
+    open
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+
+    def newThread(self, runnable):
+        self.count = self.count + 1
+        thread = Thread(runnable, "%s %d" % (self.name, self.count))
+        thread.setDaemon(True)
+        return thread
+
+
+class Task(Callable):
+    """ Wraps a python function and its arguments as a java Callable
+    """
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+    def call(self):
+        return self.fn(*self.args)
+
+
+def threadcount(threads=None):
+    """ Number of worker threads, defaults to the number of processors
+    """
+    if threads is None or threads < 1:
+        threads = Runtime.getRuntime().availableProcessors()
+    return threads
+
+
+def sharedpool(threads=None):
+    """ Thread pool reused for the whole run
+    Tasks run in a shared pool must not wait for other tasks of the same
+    pool, which could then never start.
+    Parameters
+    ----------
+    threads: int
+        number of worker threads, see threadcount.
+    Returns
+    -------
+    pool: ExecutorService
+        not to be shut down by callers.
+    """
+    threads = threadcount(threads)
+    with poolslock:
+        pool = pools.get(threads)
+        if pool is None or pool.isShutdown():
+            pool = Executors.newFixedThreadPool(threads, Daemon("MyelinJ worker"))
+            pools[threads] = pool
+        return pool
+
+
+def shutdown():
+    """ Stop the threads of all shared pools
+    """
+    with poolslock:
+        for pool in pools.values():
+            pool.shutdown()
+        pools.clear()
+
+
+def parallelmap(fn, items, threads=None):
+    """ Apply fn to each item in parallel
+    Parameters
+    ----------
+    fn: function
+        function taking one item.
+    items: list
+        items to process.
+    threads: int
+        number of worker threads.
+    Returns
+    -------
+    results: list
+        fn(item) for each item, in the order of items.
+    """
+    futures = [sharedpool(threads).submit(Task(fn, (item,))) for item in items]
+    try:
+        return [future.get() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel(True)
@@ -0,0 +1,314 @@
+""" Long running MyelinJ worker taking analysis jobs from a spool folder
+
+Starting Fiji, discovering plugins and importing MyelinJ for every
+folder can take longer than analysing a small folder. A WorkerService is
+started once (see MyelinJ_Worker.py) and then analyses the jobs written
+to its spool folder with the batch engine (engine.py), keeping the JVM,
+the imported modules, the shared worker threads, the frangi cache and
+the profiles read from user name files (profiles.registry) warm between
+jobs.
+
+Spool folder layout:
+
+    incoming/   jobs waiting, one .job file each (JSON)
+    running/    jobs being analysed, with a .worker file naming the
+                worker that claimed each one
+    done/       finished jobs, with a .csv of the results of each image
+    failed/     jobs that failed, with a .txt file giving the error
+
+A job is claimed by renaming it from incoming/ to running/, so several
+workers can share one spool folder. While a job runs its worker touches
+the .worker file every stale/4 seconds; a worker that starts puts jobs
+whose .worker file has not been touched for stale seconds (their worker
+died) back in incoming/. submit and status only use the
+python standard library, so jobs can be submitted in milliseconds from
+any python, including outside Fiji:
+
+    import workerservice
+    job = workerservice.submit("/data/spool", "/data/plate1", "alice.csv",
+                               multi=True, threads=4)
+    workerservice.status("/data/spool", job)
+
+Modules using Java are imported by the worker only, when it starts.
+Results.csv is saved in each analysed folder as by
+MyelinJanalysis.analyse, with the planes of z-stacks analysed by plane
+added up per image, the processed .jpg images are not saved.
+
+"""
+
+import os
+import csv
+import json
+import time
+import uuid
+import threading
+import traceback
+
+folders = ("incoming", "running", "done", "failed")
+# options a job may set, and their defaults
+options = {"multi": False, "threads": 1, "projection": None, "maxbatch": None}
+
+
+def jobpath(spool, folder, job, extension=".job"):
+    return os.path.join(spool, folder, job+extension)
+
+
+def makespool(spool):
+    for folder in folders:
+        if not os.path.isdir(os.path.join(spool, folder)):
+            os.makedirs(os.path.join(spool, folder))
+
+
+def submit(spool, imagefolder, profile, **settings):
+    """ Add a job to the spool folder
+    Parameters
+    ----------
+    spool: string
+        spool folder of a WorkerService.
+    imagefolder: string
+        folder of .tif images to analyse.
+    profile: string
+        user name .csv or .json file (see profiles.py), as a path or a
+        file name in the MyelinJ folder of the worker.
+    settings:
+        job options, see options.
+    Returns
+    -------
+    job: string
+        name of the job, in the order jobs were submitted.
+    """
+    unknown = [name for name in settings if name not in options]
+    if unknown:
+        raise ValueError("unknown job options: "+", ".join(unknown))
+    makespool(spool)
+    job = "%013d-%s" % (int(time.time() * 1000), uuid.uuid4().hex[:8])
+    description = dict(settings)
+    description["folder"] = imagefolder
+    description["profile"] = profile
+    fullpath = jobpath(spool, "incoming", job)
+    f = open(fullpath+".tmp", 'w')
+    json.dump(description, f)
+    f.close()
+    # a job is only seen once it is complete
+    os.rename(fullpath+".tmp", fullpath)
+    return job
+
+
+def status(spool, job):
+    """ "incoming", "running", "done" or "failed", None for unknown jobs
+    """
+    for folder in folders:
+        if os.path.exists(jobpath(spool, folder, job)):
+            return folder
+    return None
+
+
+class WorkerService(object):
+    """ Analyses the jobs of a spool folder one at a time
+    Attributes
+    ----------
+    spool: string
+        spool folder.
+    interval: float
+        seconds between polls of an empty spool folder.
+    stale: float
+        seconds after which a running job whose worker has stopped
+        touching its .worker file is requeued.
+    worker: string
+        name of the worker (process and host), saved in the .worker file
+        of the jobs it claims.
+    """
+
+    def __init__(self, cwd, spool, interval=1, stale=300):
+        from java.lang.management import ManagementFactory
+        import MyelinJanalysis
+        self.cwd = cwd
+        self.spool = spool
+        self.interval = interval
+        self.stale = stale
+        self.worker = ManagementFactory.getRuntimeMXBean().getName()
+        self.cache = MyelinJanalysis.getcache(cwd)
+        self.stopped = False
+        makespool(spool)
+        self.requeue()
+
+    def requeue(self):
+        """ Put running jobs whose worker has died back in incoming/
+        Returns
+        -------
+        jobs: list of strings
+            names of the jobs requeued.
+        """
+        requeued = []
+        now = time.time()
+        for name in sorted(os.listdir(os.path.join(self.spool, "running"))):
+            if not name.endswith(".job"):
+                continue
+            job = name[:-len(".job")]
+            running = jobpath(self.spool, "running", job)
+            worker = jobpath(self.spool, "running", job, ".worker")
+            try:
+                touched = os.path.getmtime(worker if os.path.exists(worker) else running)
+                if now - touched < self.stale:
+                    continue
+                os.rename(running, jobpath(self.spool, "incoming", job))
+            except OSError:
+                # finished or requeued by another worker
+                continue
+            if os.path.exists(worker):
+                os.remove(worker)
+            requeued.append(job)
+        return requeued
+
+    def settings(self, profile):
+        """ User settings of a job, read again only if the file changed
+        """
+        import profiles
+        if os.path.isabs(profile):
+            return profiles.registry.get(profile).aslist()
+        return profiles.registry.get(profiles.path(self.cwd, profile)).aslist()
+
+    def claim(self):
+        """ Move the oldest waiting job to running/
+        Returns
+        -------
+        job: string
+            name of the job, None if no job is waiting.
+        """
+        waiting = sorted([name[:-len(".job")] for name in
+                          os.listdir(os.path.join(self.spool, "incoming"))
+                          if name.endswith(".job")])
+        for job in waiting:
+            try:
+                os.rename(jobpath(self.spool, "incoming", job),
+                          jobpath(self.spool, "running", job))
+            except OSError:
+                # claimed by another worker
+                continue
+            f = open(jobpath(self.spool, "running", job, ".worker"), 'w')
+            f.write(self.worker)
+            f.close()
+            return job
+        return None
+
+    def heartbeat(self, job, finished):
+        """ Touch the .worker file of a running job until finished is set
+        """
+        worker = jobpath(self.spool, "running", job, ".worker")
+        while not finished.wait(self.stale / 4):
+            try:
+                os.utime(worker, None)
+            except OSError:
+                return
+
+    def analyse(self, description):
+        """ Analyse the images of a job
+        Returns
+        -------
+        rows: list of lists
+            folder, image and results of each image.
+        """
+        import MyelinJanalysis
+        import config
+        import engine
+        import metrics
+        settings = dict(options)
+        settings.update(description)
+        readsettings = self.settings(settings["profile"])
+        imagefolder = os.path.join(settings["folder"], "")
+        if settings["multi"] is True:
+            subfoldernames = sorted([d for d in next(os.walk(imagefolder))[1]
+                                     if d not in ("shards", "statistical analysis")])
+        else:
+            subfoldernames = [1]
+        projection = config.projection
+        if settings["projection"] is not None:
+            config.projection = settings["projection"]
+        rows = []
+        try:
+            for subfolder in subfoldernames:
+                settings2 = MyelinJanalysis.folderpath(imagefolder, subfolder,
+                                                       settings["multi"])
+                paths = [os.path.join(root, name)
+                         for root, name in MyelinJanalysis.listimages(settings2)]
+                results = list(engine.analysebatch(paths, readsettings, settings["threads"],
+                                                   self.cache, maxbatch=settings["maxbatch"]))
+                if len(results) == 0:
+                    continue
+                # in the order of paths, as analyse saves them, with the
+                # planes of z-stacks added up per image
+                order = dict([(path, x) for (x, path) in enumerate(paths)])
+                results.sort(key=lambda item: order[item.path])
+                results = engine.perimage(results)
+                counts = [result.counts() for result in results]
+                result, myelinaverage, neuriteaverage = MyelinJanalysis.folderresults(
+                    [row[0] for row in counts], [row[1] for row in counts],
+                    [row[2] for row in counts], [row[3] for row in counts],
+                    [row[4] for row in counts], [row[5] for row in counts])
+                MyelinJanalysis.writeresult(os.path.join(settings2, "Results.csv"), result)
+                for item in results:
+                    rows.append([str(subfolder), item.name, item.myelinpixels,
+                                 item.neuritepixels, item.totalpixels,
+                                 item.neuritedensity(), item.myelination(), item.quality]
+                                + [item.measures[name] for name in metrics.names])
+        finally:
+            config.projection = projection
+        return rows
+
+    def runjob(self, job):
+        """ Analyse a claimed job and move it to done/ or failed/
+        """
+        from java.lang import Throwable
+        import metrics
+        running = jobpath(self.spool, "running", job)
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self.heartbeat, args=(job, finished),
+                                     name="MyelinJ worker heartbeat")
+        heartbeat.setDaemon(True)
+        heartbeat.start()
+        try:
+            f = open(running, 'r')
+            description = json.load(f)
+            f.close()
+            rows = self.analyse(description)
+            f = open(jobpath(self.spool, "done", job, ".csv"), 'wb')
+            writer = csv.writer(f)
+            writer.writerow(["Folder", "Image", "Myelin pixels", "Neurite pixels",
+                             "Total pixels", "% neurite density", "% myelination",
+                             "Quality"] + list(metrics.names))
+            writer.writerows(rows)
+            f.close()
+            os.rename(running, jobpath(self.spool, "done", job))
+        except (Exception, Throwable):
+            f = open(jobpath(self.spool, "failed", job, ".txt"), 'w')
+            f.write(traceback.format_exc())
+            f.close()
+            os.rename(running, jobpath(self.spool, "failed", job))
+        finally:
+            finished.set()
+            heartbeat.join()
+            worker = jobpath(self.spool, "running", job, ".worker")
+            if os.path.exists(worker):
+                os.remove(worker)
+
+    def poll(self):
+        """ Analyse the oldest waiting job, if any
+        Returns
+        -------
+        job: string
+            name of the job analysed or None.
+        """
+        job = self.claim()
+        if job is not None:
+            self.runjob(job)
+        return job
+
+    def run(self):
+        """ Analyse jobs until stop is called
+        """
+        while not self.stopped:
+            if self.poll() is None:
+                time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped = True